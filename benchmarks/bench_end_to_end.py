@@ -0,0 +1,78 @@
+"""
+Run revert_tag_changes.py against a local stand-in of the OSM API and measure the throughput of
+the whole revert including all HTTP requests.
+
+The API serves ways whose name tag has been changed by a vandal. The name revert implementation
+restores the names. Arguments after ``--`` are passed to revert_tag_changes.py.
+
+Usage: python3 -m benchmarks.bench_end_to_end [--ways N] [--latency SECONDS] [--error-rate RATE] [-- OPTIONS]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from tests.mock_api_server import FixtureStore, MockApiServer, way_xml
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_fixture(store, osc_path, way_count):
+    with open(osc_path, "w") as osc:
+        osc.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<osmChange version=\"0.6\" generator=\"benchmark\">\n<modify>\n")
+        for i in range(1, way_count + 1):
+            node_refs = range(i * 10, i * 10 + 10)
+            store.add_xml("<osm>{}</osm>".format(way_xml(i, 1, 10, {"highway": "residential", "name": "Street {}".format(i)}, node_refs)))
+            vandalised = way_xml(i, 2, 20, {"highway": "residential", "name": "Vandalised {}".format(i)}, node_refs, uid=99)
+            store.add_xml("<osm>{}</osm>".format(vandalised))
+            osc.write(vandalised)
+            osc.write("\n")
+        osc.write("</modify>\n</osmChange>\n")
+
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of revert_tag_changes.py against a mock API")
+    parser.add_argument("--ways", type=int, default=1000, help="number of ways to revert")
+    parser.add_argument("--latency", type=float, default=0.005, help="delay of every API response in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of GET requests answered with status 503")
+    parser.add_argument("--rate", type=float, default=0, help="http_rate of the client, 0 for unlimited")
+    parser.add_argument("options", nargs="*", help="options for revert_tag_changes.py")
+    args = parser.parse_args()
+
+    store = FixtureStore()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        osc_path = os.path.join(tmp_dir, "input.osc")
+        make_fixture(store, osc_path, args.ways)
+        with MockApiServer(store, latency=args.latency, error_rate=args.error_rate) as server:
+            config_path = os.path.join(tmp_dir, "config.json")
+            with open(config_path, "w") as config_file:
+                json.dump({"user": "bench", "uid": 1, "password": "secret", "api_url": server.api_url, "http_rate": args.rate, "http_retry_base_delay": 0.01}, config_file)
+            command = [sys.executable, os.path.join(BASE_DIR, "revert_tag_changes.py"), "-c", config_path,
+                       "-i", os.path.join(BASE_DIR, "implementations", "revert_implementation.py"),
+                       "-l", "WARNING"] + args.options + ["Benchmark", osc_path]
+            start = time.perf_counter()
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            duration = time.perf_counter() - start
+    reverted = sum(1 for i in range(1, args.ways + 1) if store.version("way", i).get("version") == "3")
+    latencies = server.latencies()
+    print("{} of {} objects reverted in {:.2f} s: {:.1f} objects/s".format(reverted, args.ways, duration, reverted / duration))
+    print("{} requests, {} errors, latency p50 {:.1f} ms, p99 {:.1f} ms".format(len(latencies), sum(1 for r in server.requests if r[2] >= 400), percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000))
+    for method in ("GET", "PUT", "POST"):
+        method_latencies = [r[3] for r in server.requests if r[0] == method]
+        if method_latencies:
+            print("  {:4s} {:6d} requests, p50 {:.1f} ms, p99 {:.1f} ms".format(method, len(method_latencies), percentile(method_latencies, 0.5) * 1000, percentile(method_latencies, 0.99) * 1000))
+
+
+if __name__ == "__main__":
+    main()
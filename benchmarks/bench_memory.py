@@ -0,0 +1,82 @@
+"""
+Compare the memory used by parsed OSC input with the compact mutable objects and with the former
+dict-based objects.
+
+Usage: python3 -m benchmarks.bench_memory [WAY_COUNT]
+"""
+
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import osmium
+
+from machina_reparanda.input_handler import InputHandler
+from benchmarks.synthetic_data import write_osc
+
+
+class LegacyLocation:
+    def __init__(self, base):
+        self._valid = base.valid()
+        self.x = base.x
+        self.y = base.y
+        self.lat = base.lat_without_check()
+        self.lon = base.lon_without_check()
+
+
+class LegacyNodeRef:
+    def __init__(self, base):
+        self.location = LegacyLocation(base.location)
+        self.ref = base.ref
+
+
+class LegacyNodeRefList():
+    def __init__(self, base):
+        self._nodes = []
+        for n in base:
+            self._nodes.append(LegacyNodeRef(n))
+
+
+class LegacyTagList():
+    def __init__(self, base):
+        self._tags = dict()
+        for t in base:
+            self._tags[t.k] = t.v
+
+
+class LegacyInputHandler(osmium.SimpleHandler):
+    """InputHandler with the mutable objects as they were before they became compact."""
+
+    def __init__(self, object_list):
+        osmium.SimpleHandler.__init__(self)
+        self.object_list = object_list
+
+    def way(self, way):
+        self.object_list.append(osmium.osm.mutable.Way(way, tags=LegacyTagList(way.tags), nodes=LegacyNodeRefList(way.nodes)))
+
+
+def measure(handler_class, path):
+    tracemalloc.start()
+    objects = []
+    handler_class(objects).apply_file(path)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(objects), current
+
+
+def main():
+    way_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.osc")
+        write_osc(path, way_count)
+        results = {}
+        for name, handler_class in [("legacy", LegacyInputHandler), ("compact", InputHandler)]:
+            count, size = measure(handler_class, path)
+            results[name] = size
+            print("{:8s} {:8d} objects: {:8.1f} MB, {:6.0f} bytes/object".format(name, count, size / 1024 / 1024, size / count))
+        print("reduction: {:.1f}x".format(results["legacy"] / results["compact"]))
+
+
+if __name__ == "__main__":
+    main()
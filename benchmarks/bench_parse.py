@@ -0,0 +1,57 @@
+"""
+Compare the parsing speed of the copy-once InputHandler with the former construction path which
+deep-copied every object after wrapping it.
+
+Usage: python3 -m benchmarks.bench_parse [WAY_COUNT]
+"""
+
+import copy
+import os
+import sys
+import tempfile
+import time
+
+import osmium
+
+from machina_reparanda.input_handler import InputHandler
+from machina_reparanda.mutable_osm_objects import MutableTagList, MutableWayNodeList, MutableRelationMemberList, MutableLocation
+from benchmarks.synthetic_data import write_osc
+
+
+class DeepCopyInputHandler(osmium.SimpleHandler):
+    """InputHandler as it was before the copy-once construction path."""
+
+    def __init__(self, object_list):
+        osmium.SimpleHandler.__init__(self)
+        self.object_list = object_list
+
+    def node(self, node):
+        self.object_list.append(copy.deepcopy(osmium.osm.mutable.Node(node, tags=MutableTagList(node.tags), location=MutableLocation(node.location))))
+
+    def way(self, way):
+        self.object_list.append(copy.deepcopy(osmium.osm.mutable.Way(way, tags=MutableTagList(way.tags), nodes=MutableWayNodeList(way.nodes))))
+
+    def relation(self, relation):
+        self.object_list.append(copy.deepcopy(osmium.osm.mutable.Relation(relation, tags=MutableTagList(relation.tags), members=MutableRelationMemberList(relation.members))))
+
+
+def measure(handler_class, path):
+    objects = []
+    start = time.perf_counter()
+    handler_class(objects).apply_file(path)
+    duration = time.perf_counter() - start
+    return len(objects), duration
+
+
+def main():
+    way_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.osc")
+        write_osc(path, way_count)
+        for name, handler_class in [("deepcopy", DeepCopyInputHandler), ("copy-once", InputHandler)]:
+            count, duration = measure(handler_class, path)
+            print("{:10s} {:8d} objects in {:6.2f} s: {:10.0f} objects/s".format(name, count, duration, count / duration))
+
+
+if __name__ == "__main__":
+    main()
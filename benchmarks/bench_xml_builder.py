@@ -0,0 +1,104 @@
+"""
+Compare the serialization speed of OsmXmlBuilder with the former implementation which built the
+documents by string concatenation and escaped every attribute value with saxutils.
+
+The former implementation is loaded from the Git history, by default from the revision before
+the fragment lists were introduced.
+
+Usage: python3 -m benchmarks.bench_xml_builder [DOCUMENT_COUNT [LEGACY_REVISION]]
+"""
+
+import os
+import subprocess
+import sys
+import time
+import types
+
+import osmium
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.mutable_osm_objects import MutableTagList, MutableNodeRefList
+from machina_reparanda.osm_xml_builder import OsmXmlBuilder
+
+#: directory of the Git repository the legacy builder is loaded from
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_legacy_builder(revision):
+    """
+    Load OsmXmlBuilder from an older revision of the repository.
+
+    Args:
+        revision (str): Git revision, if None the revision before the fragment lists were
+            introduced
+
+    Returns:
+        type: OsmXmlBuilder class of that revision
+    """
+    if revision is None:
+        commits = subprocess.check_output(["git", "log", "--reverse", "--format=%H", "-S", "self.parts", "--", "machina_reparanda/osm_xml_builder.py"], cwd=REPOSITORY, universal_newlines=True).split()
+        revision = commits[0] + "^"
+    source = subprocess.check_output(["git", "show", "{}:machina_reparanda/osm_xml_builder.py".format(revision)], cwd=REPOSITORY)
+    module = types.ModuleType("machina_reparanda.legacy_osm_xml_builder")
+    # the relative imports of the module are resolved in the current package
+    module.__package__ = "machina_reparanda"
+    exec(compile(source, "{}:osm_xml_builder.py".format(revision), "exec"), module.__dict__)
+    return module.OsmXmlBuilder
+
+
+class Member:
+    def __init__(self, mtype, ref, role):
+        self.type = mtype
+        self.ref = ref
+        self.role = role
+
+
+def make_tags(i):
+    tags = MutableTagList([])
+    tags["highway"] = "residential"
+    tags["name"] = "Straße {}".format(i)
+    tags["source"] = "survey & Bing"
+    return tags
+
+
+def make_objects():
+    """10 ways with 2000 nodes each and a relation with 2000 members."""
+    objects = []
+    for i in range(10):
+        nodes = MutableNodeRefList()
+        for ref in range(i * 2000, (i + 1) * 2000):
+            nodes.append(ref)
+        objects.append(osmium.osm.mutable.Way(id=i + 1, version=3, visible=True, tags=make_tags(i), nodes=nodes))
+    members = [Member("w", i, "outer" if i % 2 else "inner") for i in range(2000)]
+    objects.append(osmium.osm.mutable.Relation(id=1, version=7, visible=True, tags=make_tags(0), members=members))
+    return objects
+
+
+def measure(builder, objects, count):
+    start = time.perf_counter()
+    for i in range(count):
+        document = builder.osm_change(objects)
+    duration = time.perf_counter() - start
+    return document, duration
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    legacy_builder_class = load_legacy_builder(sys.argv[2] if len(sys.argv) > 2 else None)
+    config = Configuration({"user": "testUser", "uid": 1, "password": "secret"})
+    objects = make_objects()
+    documents = {}
+    for name, builder_class in [("legacy", legacy_builder_class), ("fragments", OsmXmlBuilder)]:
+        builder = builder_class(config)
+        builder.set_changeset(42)
+        documents[name], duration = measure(builder, objects, count)
+        if isinstance(documents[name], str):
+            # the legacy builder returned str which had to be encoded before the upload
+            documents[name] = documents[name].encode("utf-8")
+        print("{:10s} {:4d} documents ({:.1f} MB) in {:6.2f} s: {:8.2f} documents/s".format(name, count, len(documents[name]) / 1024 / 1024, duration, count / duration))
+    if documents["legacy"] != documents["fragments"]:
+        print("WARNING: the builders created different documents")
+
+
+if __name__ == "__main__":
+    main()
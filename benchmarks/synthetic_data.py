@@ -0,0 +1,23 @@
+"""
+Generate synthetic OSC files for benchmarks.
+"""
+
+import random
+
+
+def write_osc(path, way_count, nodes_per_way=20, first_id=1, changeset=1, seed=1):
+    """
+    Write an OSC file modifying way_count ways with tags and nodes_per_way node references each.
+    """
+    rng = random.Random(seed)
+    keys = ["highway", "name", "surface", "lanes", "maxspeed", "source", "wikidata", "ref", "oneway", "lit"]
+    with open(path, "w") as osc:
+        osc.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<osmChange version=\"0.6\" generator=\"benchmark\">\n<modify>\n")
+        for way_id in range(first_id, first_id + way_count):
+            osc.write("  <way id=\"{}\" version=\"{}\" timestamp=\"2018-01-01T00:00:00Z\" uid=\"1\" user=\"bench\" changeset=\"{}\">\n".format(way_id, rng.randint(2, 9), changeset))
+            for i in range(nodes_per_way):
+                osc.write("    <nd ref=\"{}\"/>\n".format(way_id * 1000 + i))
+            for key in rng.sample(keys, rng.randint(2, 6)):
+                osc.write("    <tag k=\"{}\" v=\"value {} &amp; {}\"/>\n".format(key, way_id, rng.randint(0, 99)))
+            osc.write("  </way>\n")
+        osc.write("</modify>\n</osmChange>\n")
@@ -20,8 +20,9 @@ along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import sys
-import os.path
 import re
+import queue
+import threading
 import datetime
 import argparse
 import osmium
@@ -31,65 +32,79 @@ import urllib.parse
 from machina_reparanda.utils import api_url as API_URL
 from machina_reparanda.utils import date_format as DATE_FORMAT
 from machina_reparanda.utils import user_agent as USER_AGENT
-from machina_reparanda.utils import download_changeset
+from machina_reparanda.changeset_download import ChangesetDownloadPool
+from machina_reparanda.rate_limit import HostRateLimiter, send_with_retry
+
+
+class ChangesetRecord():
+    """Copy of the metadata of a changeset which can be kept after the osmium callback returned."""
+    def __init__(self, cs):
+        self.id = cs.id
+        self.created_at = cs.created_at
+        self.box = None
+        if cs.bounds.valid():
+            self.box = CSBox(cs.bounds.bottom_left.lon, cs.bounds.bottom_left.lat, cs.bounds.top_right.lon, cs.bounds.top_right.lat)
+        self.tags = {tag.k: tag.v for tag in cs.tags}
+
+
+class PageHandler(osmium.SimpleHandler):
+    """Collect the changesets of one page of the changeset list."""
+    def __init__(self):
+        osmium.SimpleHandler.__init__(self)
+        self.records = []
+
+    def changeset(self, cs):
+        self.records.append(ChangesetRecord(cs))
 
 
 class CSHandler(osmium.SimpleHandler):
-    def __init__(self, filter_bbox, osc_output_dir=None, pattern=None, keys_of_interest=None):
+    def __init__(self, filter_bbox, download_pool=None, pattern=None, keys_of_interest=None):
         osmium.SimpleHandler.__init__(self)
         self.bbox = filter_bbox
         self.pattern = pattern
         self.keys_of_interest = keys_of_interest
-        self.osc_output_dir = osc_output_dir
-        self.last_timestamp = datetime.datetime.utcnow()
-        self.count = 0
-
-    def reset(self):
-        self.count = 0
+        self.download_pool = download_pool
 
     def _output(self, changeset):
-        if self.osc_output_dir is None:
+        if self.download_pool is None:
             sys.stdout.write("{}\n".format(changeset.id))
         else:
-            self._download_osc(changeset.id)
-
-    def _download_osc(self, cs_id):
-        file_name = "c{}.osc".format(cs_id)
-        dest_file_path = os.path.join(self.osc_output_dir, file_name)
-        try:
-            changeset_data = download_changeset(cs_id)
-        except requests.exceptions.HTTPError as err:
-            sys.stderr.write("Failed to fetch the contents of changeset {}: {}\n".format(cs_id, err))
-            exit(1)
-        except requests.exceptions.Timeout as err:
-            sys.stderr.write("Failed to fetch the contents of changeset {}: {}\n".format(cs_id, err))
-        try:
-            with open(dest_file_path, "wb") as oscfile:
-                oscfile.write(changeset_data)
-        except Exception as err:
-            sys.stderr.write("Failed to write OSC file: {}\n".format(err))
-            exit(1)
+            self.download_pool.submit(changeset.id)
 
     def changeset(self, cs):
-        self.count += 1
-        self.last_timestamp = cs.created_at
+        self.handle(ChangesetRecord(cs))
+
+    def handle(self, record):
         # check bounding box first
-        if not self.bbox.intersects_osm_box(cs.bounds):
+        if not self.bbox.intersects_or_invalid(record.box):
             return
         if self.pattern is None:
             # no filter
-            self._output(cs)
+            self._output(record)
             return
         for key in self.keys_of_interest:
-            comment = cs.tags.get(key, "")
+            comment = record.tags.get(key, "")
             result = re.search(self.pattern, comment)
             if (not args.invert and result is not None) or (args.invert and result is None):
-                self._output(cs)
+                self._output(record)
                 break
 
 
+class PageDownloadError(Exception):
+    """A page of the changeset list could not be downloaded."""
+    pass
+
+
 class CSDownloader():
-    def __init__(self, user, uid, since, to, handler, bbox):
+    """Page through the changeset list of the API.
+
+    Fetching the pages and filtering them (including the download of the OSC files) are separate
+    stages connected by a bounded queue. The next page is fetched by a background thread while the
+    changesets of the previous page are being handled. Changesets are handed over to the handler in
+    the order returned by the API and every changeset only once. If a page cannot be fetched, the
+    error is passed through the queue and raised by run().
+    """
+    def __init__(self, user, uid, since, to, handler, bbox, rate_limiter, queue_size=2):
         if user is not None and uid is not None:
             raise Exception("You must not specify both the user name and the UID")
         if user is None and uid is None:
@@ -100,6 +115,9 @@ class CSDownloader():
         self.handler = handler
         self.date_to = datetime.datetime.strptime(to, DATE_FORMAT)
         self.bbox = bbox
+        self.rate_limiter = rate_limiter
+        self.pages = queue.Queue(maxsize=queue_size)
+        self.seen = set()
 
     def _query_string(self):
         params = []
@@ -112,18 +130,46 @@ class CSDownloader():
         params.append("time={},{}".format(self.since.strftime(DATE_FORMAT), self.date_to.strftime(DATE_FORMAT)))
         return "&".join(params)
 
-    def next(self):
-        self.handler.reset()
-        sys.stderr.write("downloading changeset list, changesets before {}\n".format(self.since.strftime(DATE_FORMAT)))
+    def _fetch_page(self):
+        sys.stderr.write("downloading changeset list, changesets before {}\n".format(self.date_to.strftime(DATE_FORMAT)))
         url = "{}changesets?{}".format(API_URL, self._query_string())
-        sys.stderr.write("{} ...".format(url))
         header = {"user-agent": USER_AGENT}
-        r = requests.get(url, headers=header)
-        sys.stderr.write(" {}\n".format(r.status_code))
-        if r.status_code == 200:
-            self.handler.apply_buffer(r.content, "osm")
-            self.date_to = self.handler.last_timestamp
-        return self.handler.count > 0
+        r = send_with_retry(lambda: requests.get(url, headers=header), url, self.rate_limiter)
+        if r.status_code != 200:
+            raise PageDownloadError("Failed to fetch {}: HTTP status {}".format(url, r.status_code))
+        page_handler = PageHandler()
+        page_handler.apply_buffer(r.content, "osm")
+        return page_handler.records
+
+    def _produce(self):
+        try:
+            while True:
+                records = self._fetch_page()
+                # the oldest changeset of a page might be returned again on the next page
+                new_records = [r for r in records if r.id not in self.seen]
+                if len(new_records) == 0:
+                    break
+                self.seen.update(r.id for r in new_records)
+                self.date_to = min(r.created_at for r in records)
+                self.pages.put(new_records)
+        except Exception as err:
+            self.pages.put(err)
+        finally:
+            self.pages.put(None)
+
+    def run(self):
+        producer = threading.Thread(target=self._produce, daemon=True)
+        producer.start()
+        while True:
+            page = self.pages.get()
+            if page is None:
+                break
+            if isinstance(page, Exception):
+                producer.join()
+                raise page
+            for record in page:
+                self.handler.handle(record)
+        producer.join()
 
 
 class CSBox():
@@ -140,11 +186,10 @@ class CSBox():
         self.max_lon = float(max_lon)
         self.max_lat = float(max_lat)
 
-    def intersects_osm_box(self, osm_box):
-        if not osm_box.valid():
+    def intersects_or_invalid(self, other):
+        if other is None:
             return args.ignore_invalid_bbox
-        other_box = CSBox(osm_box.bottom_left.lon, osm_box.bottom_left.lat, osm_box.top_right.lon, osm_box.top_right.lat)
-        return self.intersects(other_box)
+        return self.intersects(other)
 
     def intersects(self, other):
         x_overlap = max(self.min_lon, other.min_lon) <= min(self.max_lon, other.max_lon)
@@ -171,27 +216,41 @@ parser.add_argument("--download-to", help="newest timestamp for changesets to be
 parser.add_argument("-b", "--bbox", help="only download changeset (meta)data if the bounding box intersects with the bbox given", type=str, metavar="min_lon,min_lat,max_lon,max_lat", default="-180,-90,180,90")
 parser.add_argument("--ignore-invalid-bbox", help="skip changesets with invalid/missing bounding boxes and check all other filters to apply", action="store_true")
 parser.add_argument("-o", "--osc-output-dir", help="output directory for downloaded content of the changesets (OSC format)", type=str, default=None)
+parser.add_argument("-w", "--workers", help="number of concurrent downloads of OSC files", type=int, default=4)
+parser.add_argument("--rate", help="maximum number of requests per second to the API (changeset list and OSC files together), 0 for unlimited", type=float, default=2.0)
 parser.add_argument("-f", "--input-file", help="XML file containing changeset metadata", type=str, default=None)
 args = parser.parse_args()
 
 filter_bbox = CSBox.from_coord_string(args.bbox)
+# the changeset list and the OSC files are fetched from the same host
+rate_limiter = HostRateLimiter(args.rate, burst=args.workers)
+download_pool = None
+if args.osc_output_dir is not None:
+    download_pool = ChangesetDownloadPool(args.osc_output_dir, args.workers, rate_limiter=rate_limiter)
 
 if args.regex:
     flags = re.IGNORECASE if args.ignore_case else 0
     pattern = re.compile(args.regex, flags)
     keys_to_search = args.keys.split(",")
-    handler = CSHandler(filter_bbox, args.osc_output_dir, pattern, keys_to_search)
+    handler = CSHandler(filter_bbox, download_pool, pattern, keys_to_search)
 else:
-    handler = CSHandler(filter_bbox, args.osc_output_dir)
+    handler = CSHandler(filter_bbox, download_pool)
 
 
 if args.download_list:
-    downloader = CSDownloader(args.download_user, args.download_uid, args.download_since, args.download_to, handler, filter_bbox)
-    while True:
-        if not downloader.next():
-            break
+    downloader = CSDownloader(args.download_user, args.download_uid, args.download_since, args.download_to, handler, filter_bbox, rate_limiter)
+    try:
+        downloader.run()
+    except (PageDownloadError, requests.exceptions.RequestException) as err:
+        sys.stderr.write("ERROR: {}\n".format(err))
+        if download_pool is not None:
+            download_pool.close()
+        exit(1)
 elif args.input_file:
     handler.apply_file(args.input_file)
 else:
     sys.stderr.write("ERROR: no input given\n")
     exit(1)
+
+if download_pool is not None and download_pool.close():
+    exit(1)
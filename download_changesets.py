@@ -20,11 +20,8 @@ along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import sys
-import os.path
 import argparse
-import requests
-import urllib.parse
-from machina_reparanda.utils import download_changeset
+from machina_reparanda.changeset_download import ChangesetDownloadPool
 
 
 def split_row(row):
@@ -33,35 +30,23 @@ def split_row(row):
     for elem in splitted_by_space:
         splitted_by_comma = elem.split(",")
         for el in splitted_by_comma:
+            if el == "":
+                continue
             parsed_id = int(el)
             ids.append(parsed_id)
     return ids
 
 
-def download_and_write(changeset_id, path):
-    try:
-        changeset_data = download_changeset(changeset_id)
-    except requests.exceptions.HTTPError as err:
-        sys.stderr.write("Failed to fetch the contents of changeset {}: {}\n".format(cs_id, r.raise_for_status()))
-        exit(1)
-    except requests.exceptions.Timeout as err:
-        sys.stderr.write("Failed to fetch the contents of changeset {}: {}\n".format(cs_id, err))
-    try:
-        with open(dest_file_path, "wb") as oscfile:
-            oscfile.write(changeset_data)
-    except Exception as err:
-        sys.stderr.write("Failed to write OSC file: {}\n".format(err))
-        exit(1)
-
-
 parser = argparse.ArgumentParser(description="Download a list of changesets from the API. Reads list separated by space, comma or newline from standard input.")
-parser.add_argument("-o", "--osc-output-dir", help="output directory for downloaded content of the changesets (OSC format)", type=str, default=None)
+parser.add_argument("-o", "--osc-output-dir", help="output directory for downloaded content of the changesets (OSC format)", type=str, required=True)
+parser.add_argument("-w", "--workers", help="number of concurrent downloads", type=int, default=4)
+parser.add_argument("--rate", help="maximum number of requests per second to the API, 0 for unlimited", type=float, default=2.0)
+parser.add_argument("--retries", help="maximum number of retries of a failing download", type=int, default=5)
 args = parser.parse_args()
 
+pool = ChangesetDownloadPool(args.osc_output_dir, args.workers, args.rate, args.retries)
 for row in sys.stdin:
-    current_ids = split_row(row)
-    for cs_id in current_ids:
-        file_name = "c{}.osc".format(cs_id)
-        dest_file_path = os.path.join(args.osc_output_dir, file_name)
-        download_and_write(cs_id, dest_file_path)
-        #sys.stderr.write("{}\n".format(cs_id))
+    for cs_id in split_row(row):
+        pool.submit(cs_id)
+if pool.close():
+    exit(1)
@@ -22,6 +22,7 @@ import sys
 from machina_reparanda.abstract_revert_implementation import AbstractRevertImplementation
 from machina_reparanda.sort_functions import obj_to_str
 from machina_reparanda.osm_api_functions import OsmApiResponse
+from machina_reparanda.tag_rules import TagRuleSet
 
 
 def get_next_greater_or_equal_element(the_list, current_value):
@@ -31,6 +32,13 @@ def get_next_greater_or_equal_element(the_list, current_value):
     return len(the_list)
 
 
+#: keys whose deletion is reverted, can be replaced by tag_rules in the configuration file
+DEFAULT_TAG_RULES = {
+    "keys": ["wikipedia", "wikidata", "source", "source:geometry"],
+    "prefixes": ["wikipedia:", "wikidata:", "source:", "source:geometry:"]
+}
+
+
 class RevertImplementation(AbstractRevertImplementation):
     """
     This implementation was used to revert the deletions of the following tags which were spread over
@@ -44,46 +52,41 @@ class RevertImplementation(AbstractRevertImplementation):
 
     def __init__(self, configuration, api_client):
         super().__init__(configuration, api_client)
+        self.tag_rules = TagRuleSet.from_config(configuration.tag_rules or DEFAULT_TAG_RULES)
+
+    def prefilter(self, objects):
+        # objects created by the reverted changesets are ignored by handle_v1_object
+        if len(objects) == 1 and objects[0].version == 1:
+            return False
+        # The input lacks the keys whose removal is reverted, i.e. they cannot be looked for in it.
+        # A single modification is only reverted if it removed a key of the tag rules from the
+        # previous version. Drop the object if that version is available without a request
+        # (full-history file, memo, version cache) and no such key was removed.
+        if len(objects) == 1:
+            obj = objects[0]
+            prev_version = self.api_client.get_local_version(obj_to_str(obj), obj.id, obj.version - 1)
+            if prev_version is not None:
+                return self.is_malicious_change(prev_version, obj)
+        return True
 
     def handle_v1_object(self, obj):
         sys.stderr.write("Ignoring {} {} version {} because it is the only version available.\n".format(obj_to_str(obj), obj.id, obj.version))
         return None, None
 
     def is_malicious_change(self, prev_version, this_version):
-        for k in ["wikipedia", "wikidata", "source", "source:geometry"]:
-            if k in prev_version.tags and k not in this_version.tags:
-                # if one version does not contain a name tag, ignore the change
-                return True
-            for tk, tv in prev_version.tags.items():
-                if tk.startswith("{}:".format(k)) and tk not in this_version.tags:
-                    return True
-        return False
+        return len(self.tag_rules.diff(prev_version.tags, this_version.tags).removed) > 0
 
     def revert(self, v1, v2):
         sys.stderr.write("Reverting change of {} {} version {}\n".format(obj_to_str(v2), v2.id, v2.version))
-        for k in ["wikipedia", "wikidata", "source", "source:geometry"]:
-            if k in v1.tags and k not in v2.tags:
-                v2.tags[k] = v1.tags[k]
-            for tk, tv in v1.tags.items():
-                if tk.startswith("{}:".format(k)) and tk not in v2.tags:
-                    v2.tags[tk] = tv
+        for k, v in self.tag_rules.diff(v1.tags, v2.tags).removed.items():
+            v2.tags[k] = v
         return v2
 
     def do_changes(self, v1, v2, existing_changes):
-        for k in ["wikipedia", "wikidata", "source", "source:geometry"]:
-            if k in v1.tags and k not in v2.tags:
-                existing_changes[k] = v1.tags[k]
-            for tk, tv in v1.tags.items():
-                if tk.startswith("{}:".format(k)) and tk not in v2.tags:
-                    existing_changes[tk] = tv
+        existing_changes.update(self.tag_rules.diff(v1.tags, v2.tags).removed)
 
     def apply_good_changes(self, v1, v2, existing_changes):
-        for k in ["wikipedia", "wikidata", "source", "source:geometry"]:
-            if k in v2.tags:
-                existing_changes[k] = v2.tags[k]
-            for tk, tv in v2.tags.items():
-                if tk.startswith("{}:".format(k)):
-                    existing_changes[tk] = tv
+        existing_changes.update(self.tag_rules.select(v2.tags))
 
     def has_a_interesting_tag(self, taglist, keylist):
         """
@@ -103,7 +106,7 @@ class RevertImplementation(AbstractRevertImplementation):
     def handle_obj(self, obj):
         # get latest version
         obj_type = obj_to_str(obj)
-        response, latest_version = self.api_client.get_latest_version(obj_type, obj.id)
+        response, latest_version, is_latest = self.get_latest(obj)
         if response in [OsmApiResponse.DELETED, OsmApiResponse.NOT_FOUND, OsmApiResponse.ERROR]:
             return None, None
         # get previous version
@@ -115,7 +118,7 @@ class RevertImplementation(AbstractRevertImplementation):
             sys.stderr.write("Unable to revert {} {} version {} because no previous version available (deleted, not found or API error)\n".format(obj_to_str(obj), obj.id, obj.version))
             return None, None
         if self.is_malicious_change(prev_version, obj):
-            if latest_version.version > obj.version:
+            if not is_latest:
                 # conflict
                 sys.stderr.write("CONFLICT (will be solved automatically): {} {}, could provide version {}, got version {} from API\n".format(obj_to_str(obj), obj.id, obj.version, latest_version.version))
                 return self.solve_conflict(prev_version, latest_version, [obj.version])
@@ -208,7 +211,7 @@ class RevertImplementation(AbstractRevertImplementation):
     def handle_multiple_versions(self, objects):
         bad_versions = [x.version for x in objects]
         osm_type = obj_to_str(objects[0])
-        response, latest_version = self.api_client.get_latest_version(osm_type, objects[0].id)
+        response, latest_version, is_latest = self.get_latest(objects[-1])
         if response in [OsmApiResponse.DELETED, OsmApiResponse.NOT_FOUND, OsmApiResponse.ERROR]:
             return None, None
         if objects[0].version == 1:
@@ -16,6 +16,10 @@ class RevertImplementation(AbstractRevertImplementation):
     def __init__(self, configuration, api_client):
         super().__init__(configuration, api_client)
 
+    def prefilter(self, objects):
+        # single modifications are only reverted on highways, v1 objects are checked offline
+        return len(objects) > 1 or objects[0].version == 1 or self.is_interesting_object(objects[0])
+
     def handle_v1_object(self, obj):
         if "name" in obj.tags and self.name_has_bad_format(obj.tags.get("name", "")):
             sys.stdout.write("manual action necessary for {} {}\n".format(obj_to_str(obj), obj.version))
@@ -39,7 +43,7 @@ class RevertImplementation(AbstractRevertImplementation):
     def handle_obj(self, obj):
         # get latest version
         obj_type = obj_to_str(obj)
-        response, latest_version = self.api_client.get_latest_version(obj_type, obj.id)
+        response, latest_version, is_latest = self.get_latest(obj)
         if response in [OsmApiResponse.DELETED, OsmApiResponse.NOT_FOUND, OsmApiResponse.ERROR]:
             return None, None
         # check if this is the latest version
@@ -55,7 +59,7 @@ class RevertImplementation(AbstractRevertImplementation):
             return None, None
         name_changed, new_value = self.has_tag_changed(prev_version, obj, "name")
         if self.is_interesting_object(prev_version) and self.is_interesting_object(obj) and name_changed:
-            if latest_version.version > obj.version:
+            if not is_latest:
                 # conflict
                 sys.stderr.write("CONFLICT (will be solved automatically): {} {}, could provide version {}, got version {} from API\n".format(obj_to_str(obj), obj.id, obj.version, latest_version.version))
                 return self.solve_conflict(prev_version, latest_version, [obj.version])
@@ -164,7 +168,7 @@ class RevertImplementation(AbstractRevertImplementation):
         bad_versions = [x.version for x in objects]
         osm_type = obj_to_str(objects[0])
         bad_changesets = set()
-        response, latest_version = self.api_client.get_latest_version(osm_type, objects[0].id)
+        response, latest_version, is_latest = self.get_latest(objects[-1])
         if response in [OsmApiResponse.DELETED, OsmApiResponse.NOT_FOUND, OsmApiResponse.ERROR]:
             return None, None
         if objects[0].version == 1:
@@ -173,4 +177,4 @@ class RevertImplementation(AbstractRevertImplementation):
         response, prev_version = self.api_client.get_version(osm_type, objects[0].id, objects[0].version - 1)
         if response in [OsmApiResponse.DELETED, OsmApiResponse.NOT_FOUND, OsmApiResponse.ERROR]:
             return None, None
-        return solve_conflict(previous_version, latest_version, bad_versions)
+        return self.solve_conflict(prev_version, latest_version, bad_versions)
@@ -32,6 +32,61 @@ class AbstractRevertImplementation:
     def __init__(self, configuration, api_client):
         self.configuration = configuration
         self.api_client = api_client
+        #: latest versions checked by the worker in advance, (OsmApiResponse, object) indexed by (type, ID)
+        self.latest_versions = {}
+
+    def set_latest_versions(self, results):
+        """
+        Provide the latest versions of upcoming objects, e.g. fetched with one multi-fetch request.
+
+        Args:
+            results (dict): tuples of OsmApiResponse and object (or None) indexed by (type, ID)
+        """
+        self.latest_versions.update(results)
+
+    def forget_latest_version(self, osm_type, osm_id):
+        self.latest_versions.pop((osm_type, osm_id), None)
+
+    def _latest_result(self, obj, response, latest_version):
+        is_latest = response == OsmApiResponse.EXISTS and latest_version.version == obj.version
+        return response, latest_version, is_latest
+
+    def get_latest(self, obj):
+        """
+        Get the latest version of an object and check if obj is the latest version.
+
+        A result provided by the worker in advance is used if available, otherwise the latest
+        version is requested from the API. The result is handed out only once because the
+        implementation may modify the returned object.
+
+        Args:
+            obj (osmium.osm.mutable.OSMObject): version of the object from the input
+
+        Returns:
+            OsmApiResponse: response code
+            osmium.osm.mutable.OSMObject: latest version or None
+            bool: True if obj is the latest version
+        """
+        result = self.latest_versions.pop((obj_to_str(obj), obj.id), None)
+        if result is None:
+            result = self.api_client.get_latest_version(obj_to_str(obj), obj.id)
+        return self._latest_result(obj, *result)
+
+    def prefilter(self, objects):
+        """
+        Decide whether a type/ID group might need a revert before any request is sent.
+
+        The worker drops all groups this method returns False for. It is called for every group of
+        the input, i.e. it should only look at the objects themselves. The default implementation
+        keeps all groups.
+
+        Args:
+            objects (list): versions of the same object from the input
+
+        Returns:
+            bool: False if decide_and_do() would certainly return ``None, None``
+        """
+        return True
 
     def decide_and_do(self, objects):
         if len(objects) == 1:
@@ -43,3 +98,29 @@ class AbstractRevertImplementation:
         if obj.version == 1:
             return self.handle_v1_object(obj)
         return self.handle_obj(obj)
+
+
+class AbstractAsyncRevertImplementation(AbstractRevertImplementation):
+    """
+    Base class for revert implementations whose callbacks are coroutines
+
+    Implementations derived from this class are run by AsyncWorker which works on many objects
+    concurrently. The API client is an AsyncOsmApiClient, i.e. its methods have to be awaited.
+    """
+
+    async def get_latest(self, obj):
+        result = self.latest_versions.pop((obj_to_str(obj), obj.id), None)
+        if result is None:
+            result = await self.api_client.get_latest_version(obj_to_str(obj), obj.id)
+        return self._latest_result(obj, *result)
+
+    async def decide_and_do(self, objects):
+        if len(objects) == 1:
+            return await self.work_on_single_object(objects[0])
+        elif len(objects) > 1:
+            return await self.handle_multiple_versions(objects)
+
+    async def work_on_single_object(self, obj):
+        if obj.version == 1:
+            return await self.handle_v1_object(obj)
+        return await self.handle_obj(obj)
@@ -0,0 +1,317 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import logging
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .instrumentation import endpoint_name
+from .osm_api_functions import ApiClientProxy, ObjectCopyHandler, OsmApiClient, OsmApiResponse
+from .rate_limit import HostRateLimiter, RETRY_STATUS_CODES, THROTTLE_STATUS_CODES, backoff_delay, parse_retry_after
+from .sort_functions import type_id_version
+
+
+def parse_objects(data):
+    handler = ObjectCopyHandler()
+    handler.apply_buffer(data, ".osm")
+    return handler.objects
+
+
+class AsyncOsmApiClient:
+    """
+    OsmApiClient whose methods are coroutines.
+
+    The methods return the same values as the ones of OsmApiClient. All requests share one pool of
+    at most ``async_connections`` keep-alive connections, i.e. any number of coroutines can wait
+    for responses while no more than this number of requests are in flight. Requests respect the
+    rate limit and are retried after transient errors like the ones of HttpSession.
+
+    The client has to be used by coroutines running in one event loop. Call close() before the
+    loop is closed.
+
+    Args:
+        configuration (Configuration): configuration
+        cache (VersionCache): cache of object versions or None
+        rate_limiter (HostRateLimiter): rate limiter, e.g. the one of the HttpSession used for
+            uploads. A new one is created if None.
+        metrics (Metrics): instrumentation or None
+
+    Raises:
+        ImportError: if aiohttp is not installed
+    """
+
+    def __init__(self, configuration, cache=None, rate_limiter=None, metrics=None):
+        if aiohttp is None:
+            raise ImportError("The asynchronous API client requires aiohttp.")
+        self.api_url = configuration.api_url
+        self.headers = {'user-agent': configuration.user_agent}
+        self.cache = cache #: instance of VersionCache or None
+        self.batch_size = configuration.batch_size #: maximum number of objects per multi-fetch request
+        self.max_url_length = configuration.max_url_length #: maximum length of URLs of multi-fetch requests
+        self.connections = configuration.async_connections #: maximum number of concurrent requests
+        self.keep_alive = configuration.http_keep_alive
+        self.timeout = configuration.http_timeout
+        self.max_retries = configuration.http_max_retries
+        self.retry_base_delay = configuration.http_retry_base_delay
+        if rate_limiter is None:
+            rate_limiter = HostRateLimiter(configuration.http_rate, min_rate=configuration.http_min_rate)
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.requests = 0 #: number of requests sent
+        self.retries = 0 #: number of requests sent again after a transient error
+        self.session = None #: aiohttp.ClientSession, created by the first request
+
+    def _get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.connections, force_close=not self.keep_alive)
+            self.session = aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.session
+
+    def object_uploaded(self, osm_type, osm_id, version):
+        """
+        Forget the latest version of an object after it has been uploaded. See
+        OsmApiClient.object_uploaded().
+        """
+        if self.cache is not None:
+            self.cache.invalidate_latest(osm_type, osm_id)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _wait_for_rate_limit(self, url):
+        while True:
+            wait = self.rate_limiter.try_acquire(url)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _get(self, url):
+        """
+        Send a GET request and retry it if it fails temporarily.
+
+        Returns:
+            int: HTTP status code of the last attempt
+            bytes: body of the response
+
+        Raises:
+            aiohttp.ClientError: if the last attempt failed without a response
+            asyncio.TimeoutError: if the last attempt timed out
+        """
+        session = self._get_session()
+        attempt = 0
+        while True:
+            attempt += 1
+            await self._wait_for_rate_limit(url)
+            self.requests += 1
+            start = time.perf_counter()
+            try:
+                async with session.get(url) as response:
+                    content = await response.read()
+                    status = response.status
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                if attempt > self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, self.retry_base_delay)
+                logging.warning("Request to {} failed ({}), retrying in {:.1f} s".format(url, str(err) or type(err).__name__, delay))
+            else:
+                if self.metrics is not None:
+                    self.metrics.observe("http", endpoint_name("GET", url), time.perf_counter() - start, 0, len(content))
+                logging.debug("GET {} {}".format(url, status))
+                delay = backoff_delay(attempt, self.retry_base_delay, retry_after=retry_after)
+                if status in THROTTLE_STATUS_CODES:
+                    self.rate_limiter.throttled(url, delay)
+                elif status < 500:
+                    self.rate_limiter.succeeded(url)
+                if status not in RETRY_STATUS_CODES or attempt > self.max_retries:
+                    return status, content
+                logging.warning("Request to {} failed with HTTP status {}, retrying in {:.1f} s".format(url, status, delay))
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def get_history(self, osm_type, osm_id):
+        """
+        Get all versions of an object. See OsmApiClient.get_history().
+        """
+        url = "{}/{}/{}/history".format(self.api_url, osm_type, osm_id)
+        status, content = await self._get(url)
+        if status == 403:  # forbidden – redacted
+            logging.warning("Manual action necessary because the history of {} {} is redacted".format(osm_type, osm_id))
+            return OsmApiResponse.REDACTED, None
+        elif status == 404:
+            return OsmApiResponse.NOT_FOUND, None
+        elif status != 200:  # other error
+            return OsmApiResponse.ERROR, None
+        objects = parse_objects(content)
+        objects.sort(key=type_id_version)
+        if self.cache is not None:
+            self.cache.put_many(osm_type, objects)
+        return OsmApiResponse.EXISTS, objects
+
+    def get_local_version(self, osm_type, osm_id, version):
+        """
+        Get a version of an object from the cache without sending a request.
+
+        Returns:
+            osmium.osm.mutable.OSMObject: the version or None
+        """
+        if self.cache is None:
+            return None
+        return self.cache.get(osm_type, osm_id, version)
+
+    async def get_version(self, osm_type, osm_id, version, fallback_if_redacted=True):
+        if self.cache is not None:
+            obj = self.cache.get(osm_type, osm_id, version)
+            if obj is not None:
+                return OsmApiResponse.EXISTS, obj
+        url = "{}/{}/{}/{}".format(self.api_url, osm_type, osm_id, version)
+        status, content = await self._get(url)
+        if status == 403:  # forbidden – redacted version
+            if version > 1 and fallback_if_redacted:
+                response, obj = await self.get_version(osm_type, osm_id, version - 1, fallback_if_redacted)
+                if response in [OsmApiResponse.EXISTS, OsmApiResponse.REDACTED_FALLBACK]:
+                    return OsmApiResponse.REDACTED_FALLBACK, obj
+                return response, obj
+            else:
+                logging.warning("Manual action necessary because all previous versions are redacted for {} {}".format(osm_type, osm_id))
+                return OsmApiResponse.REDACTED, None
+        elif status != 200:  # other error
+            return OsmApiResponse.ERROR, None
+        obj = parse_objects(content)[0]
+        if self.cache is not None:
+            self.cache.put(osm_type, obj)
+        return OsmApiResponse.EXISTS, obj
+
+    async def get_latest_version(self, osm_type, osm_id):
+        if self.cache is not None:
+            obj = self.cache.get_latest(osm_type, osm_id)
+            if obj is not None and obj.visible:
+                return OsmApiResponse.EXISTS, obj
+            elif obj is not None:
+                return OsmApiResponse.DELETED, None
+        url = "{}/{}/{}".format(self.api_url, osm_type, osm_id)
+        status, content = await self._get(url)
+        if status == 404:
+            return OsmApiResponse.NOT_FOUND, None
+        elif status == 410:
+            return OsmApiResponse.DELETED, None
+        elif status != 200:
+            return OsmApiResponse.ERROR, None
+        obj = parse_objects(content)[0]
+        if self.cache is not None:
+            self.cache.put_latest(osm_type, obj)
+        return OsmApiResponse.EXISTS, obj
+
+    # the chunks depend on api_url, batch_size and max_url_length only
+    _split_into_chunks = OsmApiClient._split_into_chunks
+
+    async def _get_multiple(self, osm_type, elements, result, latest=False):
+        """
+        Fetch a chunk of elements with the multi-fetch API. See OsmApiClient._get_multiple(). The
+        halves of a refused chunk are requested concurrently.
+        """
+        url = "{}/{}s?{}s={}".format(self.api_url, osm_type, osm_type, ",".join(elements))
+        status, content = await self._get(url)
+        if status != 200:
+            if len(elements) > 1:
+                middle = len(elements) // 2
+                await asyncio.gather(self._get_multiple(osm_type, elements[:middle], result, latest),
+                                     self._get_multiple(osm_type, elements[middle:], result, latest))
+            return
+        for obj in parse_objects(content):
+            if self.cache is not None and latest:
+                self.cache.put_latest(osm_type, obj)
+            elif self.cache is not None:
+                self.cache.put(osm_type, obj)
+            result[(osm_type, obj.id, obj.version)] = obj
+
+    async def get_latest_versions(self, osm_type, osm_ids):
+        """
+        Get the latest versions of many objects of the same type. See
+        OsmApiClient.get_latest_versions().
+        """
+        result = {}
+        missing = []
+        for osm_id in osm_ids:
+            obj = self.cache.get_latest(osm_type, osm_id) if self.cache is not None else None
+            if obj is None:
+                missing.append(str(osm_id))
+            else:
+                result[(osm_type, obj.id, obj.version)] = obj
+        await asyncio.gather(*[self._get_multiple(osm_type, chunk, result, True) for chunk in self._split_into_chunks(osm_type, missing)])
+        return result
+
+    async def get_versions(self, osm_type, id_versions):
+        """
+        Get specific versions of many objects of the same type. See OsmApiClient.get_versions().
+        """
+        result = {}
+        missing = []
+        for osm_id, version in id_versions:
+            obj = self.cache.get(osm_type, osm_id, version) if self.cache is not None else None
+            if obj is None:
+                missing.append("{}v{}".format(osm_id, version))
+            else:
+                result[(osm_type, osm_id, version)] = obj
+        await asyncio.gather(*[self._get_multiple(osm_type, chunk, result) for chunk in self._split_into_chunks(osm_type, missing)])
+        return result
+
+
+class SyncApiClientAdapter(ApiClientProxy):
+    """
+    Synchronous interface of an AsyncOsmApiClient for revert implementations which are not
+    coroutines.
+
+    The implementation runs in a thread other than the one of the event loop. Every call submits
+    the coroutine to the loop and blocks until it has finished.
+
+    Args:
+        client (AsyncOsmApiClient): client to fetch the data with
+        loop (asyncio.AbstractEventLoop): event loop the client is used in, can be set later
+    """
+
+    def __init__(self, client, loop=None):
+        super().__init__(client)
+        self.loop = loop #: event loop running the requests
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def get_history(self, osm_type, osm_id):
+        return self._run(self.client.get_history(osm_type, osm_id))
+
+    def get_version(self, osm_type, osm_id, version, fallback_if_redacted=True):
+        return self._run(self.client.get_version(osm_type, osm_id, version, fallback_if_redacted))
+
+    def get_latest_version(self, osm_type, osm_id):
+        return self._run(self.client.get_latest_version(osm_type, osm_id))
+
+    def get_latest_versions(self, osm_type, osm_ids):
+        return self._run(self.client.get_latest_versions(osm_type, osm_ids))
+
+    def get_versions(self, osm_type, id_versions):
+        return self._run(self.client.get_versions(osm_type, id_versions))
@@ -0,0 +1,149 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import async_api
+from .async_api import AsyncOsmApiClient, SyncApiClientAdapter
+from .osm_api_functions import OsmApiResponse
+from .sort_functions import obj_to_str
+from .worker import Worker
+
+
+def is_async_implementation(implementation_class):
+    return asyncio.iscoroutinefunction(implementation_class.decide_and_do)
+
+
+def blocks(iterable, size):
+    block = []
+    for item in iterable:
+        block.append(item)
+        if len(block) >= size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+class AsyncWorker(Worker):
+    """
+    Worker which reverts up to ``async_concurrency`` type/ID groups concurrently using asynchronous
+    I/O.
+
+    Implementations derived from AbstractAsyncRevertImplementation run as coroutines in the event
+    loop and use an AsyncOsmApiClient. Other implementations run in a pool of ``async_threads``
+    threads and get a SyncApiClientAdapter, their requests are sent by the event loop as well.
+
+    Before the groups are scheduled, the latest versions of blocks of ``batch_size`` groups are
+    fetched with multi-fetch requests and handed to the implementation (see
+    AbstractRevertImplementation.get_latest()).
+
+    The results are handed over to the uploader in the order of the input, i.e. the upload does
+    not differ from the one of Worker. Uploads run in a separate thread while the next groups are
+    being reverted.
+    """
+
+    def __init__(self, objects, configuration, metrics=None):
+        if async_api.aiohttp is None:
+            logging.critical("Asynchronous I/O requires aiohttp. Install it (e.g. pip install aiohttp) or disable async_io.")
+            exit(1)
+        self.async_client = None
+        super().__init__(objects, configuration, metrics)
+
+    def create_api_client(self, implementation_class):
+        if self.configuration.use_history:
+            logging.info("Asynchronous I/O does not download histories, use_history is ignored.")
+        if self.configuration.history_file is not None:
+            logging.warning("Asynchronous I/O does not read full-history files, history_file is ignored.")
+        self.async_client = AsyncOsmApiClient(self.configuration, self.cache, self.session.rate_limiter, self.metrics)
+        if is_async_implementation(implementation_class):
+            return self.async_client
+        return SyncApiClientAdapter(self.async_client)
+
+    async def check_currency(self, block):
+        """
+        Fetch the latest versions of a block of type/ID groups and provide them to the revert
+        implementation.
+        """
+        if self.configuration.batch_size <= 0 or len(block) < 2:
+            return
+        by_type = collections.defaultdict(list)
+        for objects in block:
+            by_type[obj_to_str(objects[0])].append(objects[0].id)
+        results = {}
+        for latest_versions in await asyncio.gather(*[self.async_client.get_latest_versions(t, ids) for t, ids in by_type.items()]):
+            for (osm_type, osm_id, version), obj in latest_versions.items():
+                if obj.visible:
+                    results[(osm_type, osm_id)] = (OsmApiResponse.EXISTS, obj)
+                else:
+                    results[(osm_type, osm_id)] = (OsmApiResponse.DELETED, None)
+        self.revert_impl.set_latest_versions(results)
+
+    def _work(self):
+        reverted_changesets = asyncio.run(self._revert_all())
+        self.finish(reverted_changesets)
+
+    async def _revert_all(self):
+        loop = asyncio.get_running_loop()
+        run_async = asyncio.iscoroutinefunction(self.revert_impl.decide_and_do)
+        executor = None
+        if not run_async:
+            self.api_client.loop = loop
+            executor = ThreadPoolExecutor(max_workers=self.configuration.async_threads)
+        upload_executor = ThreadPoolExecutor(max_workers=1)
+        reverted_changesets = self.previously_reverted_changesets()
+        self._last_metrics_write = time.monotonic()
+        window = collections.deque()
+
+        async def complete(objects, future):
+            new_object, changesets = await future
+            self.revert_impl.forget_latest_version(obj_to_str(objects[0]), objects[0].id)
+            return await loop.run_in_executor(upload_executor, self.handle_result, objects, new_object, changesets)
+
+        try:
+            for block in blocks(self.pending_groups(), max(1, self.configuration.batch_size)):
+                await self.check_currency(block)
+                for objects in block:
+                    self.write_metrics_periodically()
+                    if run_async:
+                        future = asyncio.ensure_future(self.revert_impl.decide_and_do(objects))
+                    else:
+                        future = loop.run_in_executor(executor, self.revert_impl.decide_and_do, objects)
+                    window.append((objects, future))
+                    if len(window) >= self.configuration.async_concurrency:
+                        reverted_changesets = reverted_changesets | await complete(*window.popleft())
+                    else:
+                        # let the new task start before the next group is scheduled
+                        await asyncio.sleep(0)
+            while window:
+                reverted_changesets = reverted_changesets | await complete(*window.popleft())
+        finally:
+            for objects, future in window:
+                future.cancel()
+            if executor is not None:
+                # threads still running after an error may wait for this loop, don't join them
+                executor.shutdown(wait=False, cancel_futures=True)
+            upload_executor.shutdown(wait=True)
+            await self.async_client.close()
+        logging.info("Asynchronous API client: {} requests, {} retries".format(self.async_client.requests, self.async_client.retries))
+        return reverted_changesets
@@ -0,0 +1,168 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .rate_limit import HostRateLimiter, send_with_retry
+from .utils import api_url, changeset_download_url, user_agent
+
+
+def is_complete_osc(path):
+    """
+    Check if a file exists and ends with the closing tag of an OSC document.
+    """
+    try:
+        with open(path, "rb") as osc_file:
+            osc_file.seek(0, os.SEEK_END)
+            size = osc_file.tell()
+            osc_file.seek(max(0, size - 64))
+            return osc_file.read().rstrip().endswith(b"</osmChange>")
+    except OSError:
+        return False
+
+
+def write_atomically(path, data):
+    """
+    Write data to a temporary file and move it to path afterwards. Readers never see a partially
+    written file.
+    """
+    tmp_path = "{}.part".format(path)
+    with open(tmp_path, "wb") as out_file:
+        out_file.write(data)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+    os.replace(tmp_path, path)
+
+
+class ChangesetDownloadPool:
+    """
+    Download the OSC files of many changesets concurrently.
+
+    The downloads are done by a bounded pool of threads. The number of requests per second per
+    host is limited. Downloads failing with status 429, 509 or 5xx or due to network errors are
+    retried with exponential backoff. Files are written atomically as ``c<ID>.osc``; complete files
+    which exist already are not downloaded again.
+
+    Args:
+        output_dir (str): directory to write the files to
+        workers (int): number of concurrent downloads
+        rate (float): maximum number of requests per second per host, 0 disables the limit
+        max_retries (int): maximum number of retries of a failing download
+        base_url (str): URL of the API ending with a slash
+        rate_limiter (HostRateLimiter): rate limiter shared with other requests to the same hosts,
+            a new one with the given rate is created if None
+    """
+
+    def __init__(self, output_dir, workers=4, rate=2.0, max_retries=5, base_url=api_url, rate_limiter=None):
+        self.output_dir = output_dir
+        self.base_url = base_url
+        self.max_retries = max_retries
+        if rate_limiter is None:
+            rate_limiter = HostRateLimiter(rate, burst=workers)
+        self.rate_limiter = rate_limiter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = user_agent
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # bound the number of queued downloads
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self._lock = threading.Lock()
+        self.submitted = 0 #: number of changesets to be downloaded
+        self.downloaded = 0 #: number of changesets downloaded successfully
+        self.skipped = 0 #: number of changesets whose files existed already
+        self.failed = [] #: IDs of changesets whose download failed
+        self.bytes = 0 #: number of bytes downloaded
+        self.start = time.monotonic()
+
+    def path(self, cs_id):
+        return os.path.join(self.output_dir, "c{}.osc".format(cs_id))
+
+    def submit(self, cs_id):
+        """
+        Schedule the download of a changeset. Blocks if too many downloads are queued.
+        """
+        if is_complete_osc(self.path(cs_id)):
+            with self._lock:
+                self.skipped += 1
+            return
+        self.slots.acquire()
+        with self._lock:
+            self.submitted += 1
+        future = self.executor.submit(self._download, cs_id)
+        future.add_done_callback(lambda f: self.slots.release())
+
+    def _fetch(self, cs_id):
+        """
+        Download a changeset and retry on transient errors.
+
+        Returns:
+            bytes: content of the OSC file or None
+        """
+        url = changeset_download_url(cs_id, self.base_url)
+        try:
+            r = send_with_retry(lambda: self.session.get(url, timeout=300), url, self.rate_limiter, self.max_retries)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as err:
+            sys.stderr.write("Failed to fetch the contents of changeset {}: {}\n".format(cs_id, err))
+            return None
+        if r.status_code != 200:
+            sys.stderr.write("Failed to fetch the contents of changeset {}: HTTP status {}\n".format(cs_id, r.status_code))
+            return None
+        return r.content
+
+    def _download(self, cs_id):
+        data = self._fetch(cs_id)
+        if data is not None:
+            try:
+                write_atomically(self.path(cs_id), data)
+            except OSError as err:
+                sys.stderr.write("Failed to write OSC file: {}\n".format(err))
+                data = None
+        with self._lock:
+            if data is None:
+                self.failed.append(cs_id)
+            else:
+                self.downloaded += 1
+                self.bytes += len(data)
+            self._progress()
+
+    def _progress(self, end="\r"):
+        duration = max(time.monotonic() - self.start, 0.001)
+        done = self.downloaded + len(self.failed)
+        sys.stderr.write("{}/{} changesets downloaded, {} skipped, {} failed, {:.1f} changesets/s, {:.2f} MB/s{}".format(done, self.submitted, self.skipped, len(self.failed), self.downloaded / duration, self.bytes / duration / 1024 / 1024, end))
+
+    def close(self):
+        """
+        Wait for all downloads to finish.
+
+        Returns:
+            list: IDs of the changesets whose download failed
+        """
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            self._progress("\n")
+        return self.failed
@@ -34,6 +34,70 @@ class Configuration:
         self.user_agent = config.get("user_agent", "machina_reparanda")
 
         self.api_url = config.get("api_url", "https://master.apis.dev.openstreetmap.org/api/0.6")
+        # defaults of the command line options of revert_tag_changes.py
+        self.automatic_conflict_solution = False
+        self.dryrun = False
+        self.comment_reverted = True
+        self.comment = ""
+        self.reuse_changeset = 0
+        # upload mode: "single" uploads every object with its own PUT request, "diff" uploads
+        # diff_upload_size objects at once as osmChange document
+        self.upload_mode = config.get("upload_mode", "diff")
+        self.diff_upload_size = config.get("diff_upload_size", 500)
+        # HTTP connection pooling
+        self.http_pool_connections = config.get("http_pool_connections", 4)
+        self.http_pool_maxsize = config.get("http_pool_maxsize", 10)
+        self.http_pool_block = config.get("http_pool_block", False)
+        self.http_keep_alive = config.get("http_keep_alive", True)
+        self.http_timeout = config.get("http_timeout", 300)
+        self.http_rate = config.get("http_rate", 10.0)
+        self.http_min_rate = config.get("http_min_rate", 0.5)
+        self.http_max_retries = config.get("http_max_retries", 5)
+        self.http_retry_base_delay = config.get("http_retry_base_delay", 1.0)
+        # number of type/ID groups whose versions are downloaded in advance and number of threads
+        # doing this, multi-fetch requests contain at most prefetch_groups objects
+        self.prefetch_groups = config.get("prefetch_groups", 100)
+        self.prefetch_workers = config.get("prefetch_workers", 4)
+        # multi-fetch requests (batch_size 0 disables their use by the worker)
+        self.batch_size = config.get("batch_size", 100)
+        self.max_url_length = config.get("max_url_length", 4000)
+        # persistent cache of object versions (disabled if cache_path is None)
+        self.cache_path = config.get("cache_path", None)
+        self.cache_max_size = config.get("cache_max_size", 1024)  # MB
+        self.cache_latest_ttl = config.get("cache_latest_ttl", 0)  # seconds
+        # asynchronous I/O (requires aiohttp): number of type/ID groups worked on concurrently,
+        # maximum number of concurrent requests and number of threads running implementations which
+        # are not coroutines
+        self.async_io = config.get("async_io", False)
+        self.async_concurrency = config.get("async_concurrency", 200)
+        self.async_connections = config.get("async_connections", 16)
+        self.async_threads = config.get("async_threads", 32)
+        # number of processes working on disjoint ranges of the input
+        self.shards = config.get("shards", 1)
+        # keys of interest of revert implementations using a TagRuleSet, dictionary with the
+        # optional entries "keys", "prefixes" and "patterns" (None: default of the implementation)
+        self.tag_rules = config.get("tag_rules", None)
+        # number of object versions kept in memory during a run (0 disables the memo). The memo is
+        # the only in-process store of versions, the history provider keeps its versions there too.
+        self.memo_size = config.get("memo_size", 10000)
+        # serve old versions from the history of the object (one request per object)
+        self.use_history = config.get("use_history", True)
+        # number of objects whose history version numbers are remembered
+        self.history_cache_size = config.get("history_cache_size", 128)
+        # full-history file (e.g. .osh.pbf) old versions are read from instead of the API and the
+        # path of its index (None: next to the file)
+        self.history_file = config.get("history_file", None)
+        self.history_index = config.get("history_index", None)
+        # journal of the progress of the revert (disabled if journal_path is None) and whether an
+        # existing journal should be continued
+        self.journal_path = config.get("journal_path", None)
+        self.resume = False
+        # write the results to this osmChange file instead of uploading them (disabled if None)
+        self.osc_output = config.get("osc_output", None)
+        # file the instrumentation is written to every metrics_interval seconds (JSON if the name
+        # ends with .json, text format of Prometheus otherwise)
+        self.metrics_file = config.get("metrics_file", None)
+        self.metrics_interval = config.get("metrics_interval", 10)
         if "password" in config:
             self.password = config["password"]
         else:
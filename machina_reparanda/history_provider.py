@@ -0,0 +1,121 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import logging
+import threading
+
+from .osm_api_functions import ApiClientProxy, OsmApiResponse
+from .version_memo import VersionMemo
+
+
+class HistoryVersionProvider(ApiClientProxy):
+    """
+    API client which serves get_version() from the history of the object.
+
+    The first request for any version of an object downloads its full history with a single
+    request. The versions are stored as snapshots in the VersionMemo of the wrapped client (or
+    in an own one if the client has none), all further versions of this object are taken from
+    there. Which versions the histories of the last ``history_cache_size`` objects contain is
+    kept in memory.
+
+    Versions which are missing in the history have been redacted. They are handled like the
+    API client does: If fallback_if_redacted is set, the next older available version is
+    returned with the response code REDACTED_FALLBACK.
+
+    Args:
+        client (OsmApiClient): client to fetch the data with
+        configuration (Configuration): configuration
+    """
+
+    def __init__(self, client, configuration):
+        super().__init__(client)
+        self.max_objects = configuration.history_cache_size #: number of histories whose version numbers are kept
+        memo = getattr(client, "memo", None)
+        self.memo = memo if memo is not None else VersionMemo(configuration.memo_size) #: versions of the histories
+        self._histories = collections.OrderedDict() #: version numbers of the histories indexed by (type, ID)
+        self._lock = threading.Lock()
+
+    def _download(self, osm_type, osm_id):
+        """
+        Download the history of an object and remember its versions.
+
+        Returns:
+            OsmApiResponse: response code of the request
+            list: versions of the object or None if the request failed
+        """
+        response, versions = self.client.get_history(osm_type, osm_id)
+        if response != OsmApiResponse.EXISTS:
+            return response, None
+        for obj in versions:
+            self.memo.put(osm_type, obj)
+        with self._lock:
+            self._histories[(osm_type, osm_id)] = frozenset(obj.version for obj in versions)
+            while len(self._histories) > self.max_objects:
+                self._histories.popitem(last=False)
+        return response, versions
+
+    def _history(self, osm_type, osm_id, version):
+        """
+        Get the version numbers of the history of an object which is new enough to contain the
+        requested version.
+
+        Returns:
+            frozenset: version numbers or None if the history could not be retrieved
+        """
+        with self._lock:
+            history = self._histories.get((osm_type, osm_id))
+            if history is not None:
+                self._histories.move_to_end((osm_type, osm_id))
+        if history is None or version > max(history, default=0):
+            # unknown object or the object has been edited since its history was retrieved
+            response, versions = self._download(osm_type, osm_id)
+            history = frozenset(obj.version for obj in versions) if versions is not None else None
+        return history
+
+    def get_history(self, osm_type, osm_id):
+        return self._download(osm_type, osm_id)
+
+    def get_version(self, osm_type, osm_id, version, fallback_if_redacted=True):
+        obj = self.memo.get(osm_type, osm_id, version)
+        if obj is not None:
+            return OsmApiResponse.EXISTS, obj
+        cache = getattr(self.client, "cache", None)
+        if cache is not None and (osm_type, osm_id) not in self._histories:
+            # avoid downloading the history if the version is cached on disk
+            obj = cache.get(osm_type, osm_id, version)
+            if obj is not None:
+                return OsmApiResponse.EXISTS, obj
+        history = self._history(osm_type, osm_id, version)
+        if history is None or version > max(history, default=0):
+            return self.client.get_version(osm_type, osm_id, version, fallback_if_redacted)
+        if version in history:
+            obj = self.memo.get(osm_type, osm_id, version)
+            if obj is not None:
+                return OsmApiResponse.EXISTS, obj
+            # evicted from the memo in the meantime
+            return self.client.get_version(osm_type, osm_id, version, fallback_if_redacted)
+        # version is missing in the history because it is redacted
+        if version > 1 and fallback_if_redacted:
+            response, obj = self.get_version(osm_type, osm_id, version - 1, fallback_if_redacted)
+            if response in [OsmApiResponse.EXISTS, OsmApiResponse.REDACTED_FALLBACK]:
+                return OsmApiResponse.REDACTED_FALLBACK, obj
+            return response, obj
+        logging.warning("Manual action necessary because all previous versions are redacted for {} {}".format(osm_type, osm_id))
+        return OsmApiResponse.REDACTED, None
@@ -0,0 +1,175 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .instrumentation import endpoint_name, payload_size
+from .rate_limit import HostRateLimiter, RETRY_STATUS_CODES, THROTTLE_STATUS_CODES, send_with_retry
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"} #: methods which can be retried after any transient error
+
+
+class ConnectionStatistics:
+    """
+    Thread-safe counters of HTTP requests and of the TCP connections opened to serve them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0 #: number of requests sent
+        self.connections = 0 #: number of new connections opened
+        self.retries = 0 #: number of requests sent again after a transient error
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def count_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def reused(self):
+        """
+        Number of requests which were sent over an already open connection.
+        """
+        return max(0, self.requests - self.connections)
+
+    def __str__(self):
+        return "{} requests, {} connections opened, {} reused, {} retries".format(self.requests, self.connections, self.reused(), self.retries)
+
+
+def _counting_pool_class(base, statistics):
+    class CountingConnection(base.ConnectionCls):
+        def connect(self):
+            statistics.count_connection()
+            base.ConnectionCls.connect(self)
+
+    class CountingConnectionPool(base):
+        ConnectionCls = CountingConnection
+    return CountingConnectionPool
+
+
+class PoolingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter which counts the number of connections opened by its connection pools.
+    """
+
+    def __init__(self, statistics, **kwargs):
+        self.statistics = statistics
+        HTTPAdapter.__init__(self, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self.statistics),
+            "https": _counting_pool_class(HTTPSConnectionPool, self.statistics)
+        }
+
+
+class HttpSession:
+    """
+    Connection-pooled HTTP session shared by all classes talking to the OSM API.
+
+    Connections are kept alive and reused for subsequent requests to the same host. The size of
+    the pools is read from the configuration:
+
+    * ``http_pool_connections``: number of hosts whose connection pools are kept
+    * ``http_pool_maxsize``: maximum number of connections kept open per host
+    * ``http_pool_block``: block if all connections to a host are in use instead of opening an
+      additional, non-pooled connection
+    * ``http_keep_alive``: keep connections open after a request
+
+    All requests pass an adaptive rate limiter shared by all users of the session:
+
+    * ``http_rate``: maximum number of requests per second per host, 0 disables the limit
+    * ``http_min_rate``: lower limit of the rate if the API throttles requests (status 429 or 509)
+    * ``http_max_retries``: number of retries of a request after a transient error
+    * ``http_retry_base_delay``: delay before the first retry unless the API sends a Retry-After
+      header. The delay grows exponentially with every retry.
+
+    GET requests are retried after network errors, timeouts, throttling and 5xx errors. All other
+    methods are not idempotent and retried only if the API throttled them or the connection could
+    not be established, i.e. if they have not been processed for sure.
+
+    Args:
+        configuration (Configuration): configuration
+        session (requests.Session): session to send the requests with, a new one will be created
+            if it is None
+        metrics (Metrics): instrumentation recording the latency and the transferred bytes of
+            every request per endpoint or None
+    """
+
+    def __init__(self, configuration, session=None, metrics=None):
+        self.statistics = ConnectionStatistics() #: connection reuse counters
+        self.timeout = configuration.http_timeout #: timeout of requests in seconds
+        self.session = session if session is not None else requests.Session()
+        adapter = PoolingAdapter(self.statistics, pool_connections=configuration.http_pool_connections,
+                                 pool_maxsize=configuration.http_pool_maxsize,
+                                 pool_block=configuration.http_pool_block)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if not configuration.http_keep_alive:
+            self.session.headers["Connection"] = "close"
+        self.rate_limiter = HostRateLimiter(configuration.http_rate, burst=configuration.http_pool_maxsize,
+                                            min_rate=configuration.http_min_rate)
+        self.max_retries = configuration.http_max_retries
+        self.retry_base_delay = configuration.http_retry_base_delay
+        self.metrics = metrics
+
+    def _send(self, method, url, kwargs):
+        self.statistics.count_request()
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
+        start = time.perf_counter()
+        response = self.session.request(method, url, **kwargs)
+        self.metrics.observe("http", endpoint_name(method, url), time.perf_counter() - start,
+                             payload_size(kwargs.get("data")), len(response.content))
+        return response
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if method in IDEMPOTENT_METHODS:
+            retry_status_codes = RETRY_STATUS_CODES
+            retry_exceptions = (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+        else:
+            retry_status_codes = THROTTLE_STATUS_CODES
+            retry_exceptions = (requests.exceptions.ConnectTimeout,)
+        return send_with_retry(lambda: self._send(method, url, kwargs), url, self.rate_limiter, self.max_retries,
+                               retry_status_codes, retry_exceptions, self.retry_base_delay,
+                               self.statistics.count_retry)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
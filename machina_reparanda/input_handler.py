@@ -17,9 +17,8 @@ You should have received a copy of the GNU General Public License
 along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
 """
 
-import copy
 import osmium
-from machina_reparanda.mutable_osm_objects import MutableTagList, MutableRelationMemberList, MutableWayNodeList, MutableLocation
+from machina_reparanda.mutable_osm_objects import detached_node, detached_way, detached_relation
 
 
 class InputHandler(osmium.SimpleHandler):
@@ -28,14 +27,13 @@ class InputHandler(osmium.SimpleHandler):
         self.object_list = object_list
 
     def add_to_list(self, mutable_object):
-        self.object_list.append(copy.deepcopy(mutable_object))
-        #self.object_list.append(mutable_object)
+        self.object_list.append(mutable_object)
 
     def node(self, node):
-        self.add_to_list(osmium.osm.mutable.Node(node, tags=MutableTagList(node.tags), location=MutableLocation(node.location)))
+        self.add_to_list(detached_node(node))
 
     def way(self, way):
-        self.add_to_list(osmium.osm.mutable.Way(way, tags=MutableTagList(way.tags), nodes=MutableWayNodeList(way.nodes)))
+        self.add_to_list(detached_way(way))
 
     def relation(self, relation):
-        self.add_to_list(osmium.osm.mutable.Relation(relation, tags=MutableTagList(relation.tags), members=MutableRelationMemberList(relation.members)))
+        self.add_to_list(detached_relation(relation))
@@ -0,0 +1,243 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import bisect
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+#: upper bounds of the histogram buckets in seconds (0.1 ms to about 52 s)
+BUCKETS = [0.0001 * 2 ** i for i in range(20)]
+
+OSM_TYPES = {"node", "way", "relation", "changeset"}
+
+
+def endpoint_name(method, url):
+    """
+    Get a name for an API endpoint which does not contain IDs, e.g. ``GET /way/{id}/{version}``.
+    """
+    path = urllib.parse.urlparse(url).path
+    index = path.find("/api/0.6")
+    if index >= 0:
+        path = path[index + len("/api/0.6"):]
+    segments = []
+    for segment in path.split("/"):
+        if segment.isdigit():
+            segment = "{id}" if segments and segments[-1] in OSM_TYPES else "{version}"
+        segments.append(segment)
+    return "{} {}".format(method, "/".join(segments))
+
+
+def payload_size(data):
+    if data is None:
+        return 0
+    if isinstance(data, (bytes, str)):
+        return len(data)
+    return len(urllib.parse.urlencode(data))
+
+
+class Histogram:
+    """
+    Number and duration of observations with their distribution over BUCKETS.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def observe(self, seconds, bytes_sent=0, bytes_received=0):
+        self.count += 1
+        self.sum += seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+
+    def merge(self, other):
+        """
+        Add the observations of another histogram.
+        """
+        self.count += other.count
+        self.sum += other.sum
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+
+    def quantile(self, fraction):
+        """
+        Estimate a quantile by the upper bound of the bucket it falls into.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = fraction * self.count
+        cumulative = 0
+        for i, count in enumerate(self.buckets):
+            cumulative += count
+            if cumulative >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return float("inf")
+
+
+class Metrics:
+    """
+    Thread-safe collection of latency histograms, counters and transferred bytes.
+
+    Every observation belongs to a category (e.g. ``http``, ``callback``, ``phase``) and a name
+    (e.g. the API endpoint or the name of the callback).
+    """
+
+    def __init__(self):
+        self.histograms = {} #: instances of Histogram indexed by (category, name)
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def observe(self, category, name, seconds, bytes_sent=0, bytes_received=0):
+        with self._lock:
+            histogram = self.histograms.get((category, name))
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[(category, name)] = histogram
+            histogram.observe(seconds, bytes_sent, bytes_received)
+
+    @contextlib.contextmanager
+    def timer(self, category, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(category, name, time.perf_counter() - start)
+
+    def wrap(self, category, name, function):
+        """
+        Get a function which measures the duration of every call of function. If function is a
+        coroutine function, the time until the coroutine has finished is measured.
+        """
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def coroutine_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self.observe(category, name, time.perf_counter() - start)
+            return coroutine_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.observe(category, name, time.perf_counter() - start)
+        return wrapper
+
+    def instrument(self, instance, category, method_names):
+        """
+        Measure the calls of the given methods of an object.
+        """
+        for name in method_names:
+            method = getattr(instance, name, None)
+            if method is not None:
+                setattr(instance, name, self.wrap(category, name, method))
+
+    def merge(self, histograms):
+        """
+        Add the observations of other histograms, e.g. the histograms of another process.
+
+        Args:
+            histograms (dict): instances of Histogram indexed by (category, name)
+        """
+        with self._lock:
+            for key, other in histograms.items():
+                self.histograms.setdefault(key, Histogram()).merge(other)
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted((key, copy_histogram(h)) for key, h in self.histograms.items())
+
+    def table(self):
+        """
+        Format all histograms as human-readable table.
+        """
+        lines = ["{:10s} {:36s} {:>8s} {:>9s} {:>9s} {:>9s} {:>9s} {:>10s} {:>10s}".format("category", "name", "count", "total s", "mean ms", "p50 ms", "p99 ms", "sent KB", "recv KB")]
+        for (category, name), h in self._snapshot():
+            lines.append("{:10s} {:36s} {:8d} {:9.2f} {:9.2f} {:9.2f} {:9.2f} {:10.1f} {:10.1f}".format(category, name, h.count, h.sum, h.sum / h.count * 1000, h.quantile(0.5) * 1000, h.quantile(0.99) * 1000, h.bytes_sent / 1024, h.bytes_received / 1024))
+        return "\n".join(lines)
+
+    def to_json(self):
+        result = {"elapsed_seconds": time.monotonic() - self.start, "metrics": []}
+        for (category, name), h in self._snapshot():
+            result["metrics"].append({"category": category, "name": name, "count": h.count, "sum_seconds": h.sum,
+                                      "p50_seconds": h.quantile(0.5), "p99_seconds": h.quantile(0.99),
+                                      "bytes_sent": h.bytes_sent, "bytes_received": h.bytes_received,
+                                      "buckets": {str(le): c for le, c in zip(BUCKETS + ["+Inf"], h.buckets)}})
+        return json.dumps(result, indent=1)
+
+    def to_prometheus(self):
+        """
+        Format all histograms in the text exposition format of Prometheus.
+        """
+        snapshot = self._snapshot()
+        lines = ["# TYPE machina_reparanda_duration_seconds histogram"]
+        for (category, name), h in snapshot:
+            labels = "category=\"{}\",name=\"{}\"".format(escape_label(category), escape_label(name))
+            cumulative = 0
+            for le, count in zip(BUCKETS + ["+Inf"], h.buckets):
+                cumulative += count
+                lines.append("machina_reparanda_duration_seconds_bucket{{{},le=\"{}\"}} {}".format(labels, le, cumulative))
+            lines.append("machina_reparanda_duration_seconds_sum{{{}}} {}".format(labels, h.sum))
+            lines.append("machina_reparanda_duration_seconds_count{{{}}} {}".format(labels, h.count))
+        for metric in ["bytes_sent", "bytes_received"]:
+            lines.append("# TYPE machina_reparanda_{}_total counter".format(metric))
+            for (category, name), h in snapshot:
+                if category == "http":
+                    lines.append("machina_reparanda_{}_total{{category=\"{}\",name=\"{}\"}} {}".format(metric, escape_label(category), escape_label(name), getattr(h, metric)))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the metrics to a file atomically. The format is JSON if the name of the file ends
+        with .json and the text format of Prometheus otherwise.
+        """
+        content = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(content)
+        os.replace(tmp_path, path)
+
+
+def copy_histogram(histogram):
+    result = Histogram()
+    result.count = histogram.count
+    result.sum = histogram.sum
+    result.buckets = list(histogram.buckets)
+    result.bytes_sent = histogram.bytes_sent
+    result.bytes_received = histogram.bytes_received
+    return result
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,181 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+class Journal:
+    """
+    Durable log of the progress of a revert which allows to resume an interrupted run.
+
+    Every event is written as one JSON object per line. The following events are recorded:
+
+    * ``changeset_opened``, ``changeset_closed``: changesets of this run
+    * ``uploaded``: the API confirmed the upload of the new version of an object
+    * ``skipped``: the revert implementation decided not to modify an object
+    * ``failed``: the upload of an object was rejected
+    * ``commented``: a changeset comment was posted
+
+    Events about changesets, uploads and comments are synced to disk before the method returns.
+    ``skipped`` and ``failed`` events are written once per input object and are only flushed to
+    the operating system. They are synced together with the next event of the other kinds or at
+    least every SYNC_INTERVAL seconds. Losing them in a crash only means that these objects are
+    processed again.
+
+    Objects waiting in the buffer of the diff upload (see OsmApiUploader) are not recorded until
+    the API confirmed their upload. After a crash they are processed again by a resumed run, which
+    is correct because they have not been uploaded.
+
+    If resume is set, the events of an existing journal are read and new events are appended.
+    Objects which have been uploaded or skipped are completed and need not be processed again.
+    Failed objects are processed again. Otherwise an existing journal is overwritten.
+
+    Args:
+        path (str): path to the journal file
+        resume (bool): read an existing journal and continue it
+    """
+
+    SYNC_INTERVAL = 1.0 #: maximum number of seconds events are not synced to disk
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = set() #: (type, ID) of objects which have been uploaded or skipped
+        self.failed = set() #: (type, ID) of objects whose upload failed
+        self.open_changesets = [] #: IDs of changesets opened but not closed yet
+        self.closed_changesets = set() #: IDs of changesets which have been closed
+        self.changeset_objects = {} #: number of objects uploaded into a changeset indexed by changeset ID
+        self.changeset_reverted = {} #: reverted changesets indexed by the ID of the changeset reverting them
+        self.commented = set() #: IDs of changesets which have been commented on
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        if resume and os.path.exists(path):
+            self._replay()
+            self.file = open(path, "a", encoding="utf-8")
+        else:
+            self.file = open(path, "w", encoding="utf-8")
+
+    def _replay(self):
+        valid_length = 0
+        count = 0
+        with open(self.path, "rb") as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    # the last record is incomplete if the program crashed while writing it
+                    logging.warning("Ignoring incomplete record at the end of journal {}".format(self.path))
+                    break
+                self._apply(record)
+                valid_length += len(line)
+                count += 1
+        # remove the incomplete record before appending new ones
+        os.truncate(self.path, valid_length)
+        logging.info("Resuming from journal {}: {} objects completed, {} failed, open changeset: {}".format(self.path, len(self.completed), len(self.failed), self.open_changeset() or "none"))
+
+    def _apply(self, record):
+        event = record["event"]
+        if event == "changeset_opened":
+            self.open_changesets.append(record["changeset"])
+        elif event == "changeset_closed":
+            if record["changeset"] in self.open_changesets:
+                self.open_changesets.remove(record["changeset"])
+            self.closed_changesets.add(record["changeset"])
+        elif event == "uploaded":
+            key = (record["type"], record["id"])
+            self.completed.add(key)
+            self.failed.discard(key)
+            cs_id = record["changeset"]
+            self.changeset_objects[cs_id] = self.changeset_objects.get(cs_id, 0) + 1
+            self.changeset_reverted.setdefault(cs_id, set()).update(record["reverted"])
+        elif event == "skipped":
+            self.completed.add((record["type"], record["id"]))
+        elif event == "failed":
+            self.failed.add((record["type"], record["id"]))
+        elif event == "commented":
+            self.commented.add(record["changeset"])
+
+    def _write(self, *records, sync=True):
+        with self._lock:
+            for record in records:
+                self._apply(record)
+                self.file.write(json.dumps(record, separators=(",", ":")))
+                self.file.write("\n")
+            self.file.flush()
+            now = time.monotonic()
+            if sync or now - self._last_sync >= self.SYNC_INTERVAL:
+                os.fsync(self.file.fileno())
+                self._last_sync = now
+
+    def is_completed(self, osm_type, osm_id):
+        return (osm_type, osm_id) in self.completed
+
+    def open_changeset(self):
+        """
+        Get the ID of the changeset which was open when the journal was written the last time.
+
+        Returns:
+            int: changeset ID or 0
+        """
+        if len(self.open_changesets) == 0:
+            return 0
+        return self.open_changesets[-1]
+
+    def reverted_changesets(self):
+        """
+        Get the IDs of all changesets which have been reverted (fully or in part).
+        """
+        result = set()
+        for reverted in self.changeset_reverted.values():
+            result |= reverted
+        return result
+
+    def changeset_opened(self, cs_id):
+        self._write({"event": "changeset_opened", "changeset": cs_id})
+
+    def changeset_closed(self, cs_id):
+        self._write({"event": "changeset_closed", "changeset": cs_id})
+
+    def uploaded(self, uploads):
+        """
+        Record successful uploads.
+
+        Args:
+            uploads (list of tuple): (type, ID, new version, changeset ID, set of reverted
+                changeset IDs) of every uploaded object
+        """
+        self._write(*[{"event": "uploaded", "type": t, "id": i, "version": v, "changeset": cs, "reverted": sorted(reverted)} for t, i, v, cs, reverted in uploads])
+
+    def skipped(self, osm_type, osm_id):
+        self._write({"event": "skipped", "type": osm_type, "id": osm_id}, sync=False)
+
+    def failed_upload(self, osm_type, osm_id, reason):
+        self._write({"event": "failed", "type": osm_type, "id": osm_id, "reason": reason}, sync=False)
+
+    def comment_posted(self, cs_id):
+        self._write({"event": "commented", "changeset": cs_id})
+
+    def close(self):
+        with self._lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
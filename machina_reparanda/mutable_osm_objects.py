@@ -17,17 +17,35 @@ You should have received a copy of the GNU General Public License
 along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import sys
+from array import array
+
+import osmium
+
+UNDEFINED_COORDINATE = 2147483647 #: fixed-point coordinate of an invalid location (same as Osmium)
+
+
 class MutableLocation:
-    def __init__(self, base):
-        self._valid = base.valid()
-        self.x = base.x
-        self.y = base.y
+    __slots__ = ("x", "y")
+
+    def __init__(self, base=None, x=UNDEFINED_COORDINATE, y=UNDEFINED_COORDINATE):
+        if base is not None:
+            x = base.x
+            y = base.y
         # TODO add checks to lat and lon
-        self.lat = base.lat_without_check()
-        self.lon = base.lon_without_check()
+        self.x = x #: longitude as fixed-point integer (degree * 10^7)
+        self.y = y #: latitude as fixed-point integer (degree * 10^7)
 
     def valid(self):
-        return self._valid
+        return self.x != UNDEFINED_COORDINATE and self.y != UNDEFINED_COORDINATE and -1800000000 <= self.x <= 1800000000 and -900000000 <= self.y <= 900000000
+
+    @property
+    def lat(self):
+        return self.y / 10000000
+
+    @property
+    def lon(self):
+        return self.x / 10000000
 
     def lat_without_check(self):
         return self.lat
@@ -35,55 +53,200 @@ class MutableLocation:
     def lon_without_check(self):
         return self.lon
 
+    def __eq__(self, other):
+        return isinstance(other, MutableLocation) and self.x == other.x and self.y == other.y
+
     def __str__(self):
         return "lat: {} lon: {}".format(self.lat, self.lon)
 
 
+class UndefinedLocation(MutableLocation):
+    """
+    Location of node references without coordinates.
+
+    A single instance (UNDEFINED_LOCATION) is shared by all these node references. Therefore it
+    cannot be modified, a new MutableLocation has to be assigned to the node reference instead.
+    """
+    __slots__ = ()
+
+    def __init__(self):
+        object.__setattr__(self, "x", UNDEFINED_COORDINATE)
+        object.__setattr__(self, "y", UNDEFINED_COORDINATE)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The shared undefined location cannot be modified, assign a new MutableLocation instead.")
+
+    def __reduce__(self):
+        # copies and unpickled instances are the shared instance
+        return "UNDEFINED_LOCATION"
+
+
+UNDEFINED_LOCATION = UndefinedLocation() #: shared location of node references without coordinates
+
+
 class MutableNodeRef:
-    def __init__(self, base):
-        self.location = MutableLocation(base.location)
-        self.ref = base.ref
+    __slots__ = ("ref", "location")
+
+    def __init__(self, base=None, ref=0, location=UNDEFINED_LOCATION):
+        if base is not None:
+            ref = base.ref
+            location = MutableLocation(base.location)
+        self.ref = ref
+        self.location = location
+
+    def __eq__(self, other):
+        return isinstance(other, MutableNodeRef) and self.ref == other.ref and self.location == other.location
 
     def __str__(self):
-        if self.location is not None:
+        if self.location is not None and self.location.valid():
             return "nd: {} @ {}".format(self.ref, self.location)
         return "nd: {}".format(self.ref)
 
 
 class MutableNodeRefList():
-    def __init__(self, base):
-        # TODO imitate correct interface
-        self._nodes = []
+    """
+    Compact list of node references.
+
+    The IDs are stored in an ``array('q')``. Coordinates are only stored (as two parallel arrays of
+    fixed-point integers) if at least one node reference has a valid location. Ways read from OSC
+    files or from the API don't have locations. Iteration and indexing yield MutableNodeRef
+    instances which are created on the fly. They are copies: modifying them does not change the
+    list, a modified node reference has to be assigned to its index (``nodes[i] = node_ref``).
+
+    Args:
+        base (iterable): osmium.osm.NodeRefList, MutableNodeRef instances or node IDs
+    """
+    __slots__ = ("_refs", "_x", "_y")
+
+    def __init__(self, base=()):
+        self._refs = array("q")
+        self._x = None
+        self._y = None
+        if isinstance(base, osmium.osm.NodeRefList):
+            self._copy_from_osmium(base)
+        else:
+            for n in base:
+                self.append(n)
+
+    def _copy_from_osmium(self, base):
+        refs = self._refs
         for n in base:
-            self._nodes.append(MutableNodeRef(n))
+            location = n.location
+            if self._x is None and not location.valid():
+                # common case: way from an OSC file or the API without locations
+                refs.append(n.ref)
+            else:
+                self.append(MutableNodeRef(ref=n.ref, location=MutableLocation(location)))
+
+    def _store_location(self, index, location):
+        if location is None or not location.valid():
+            if self._x is not None:
+                self._x[index] = UNDEFINED_COORDINATE
+                self._y[index] = UNDEFINED_COORDINATE
+            return
+        if self._x is None:
+            self._x = array("i", [UNDEFINED_COORDINATE]) * len(self._refs)
+            self._y = array("i", [UNDEFINED_COORDINATE]) * len(self._refs)
+        self._x[index] = location.x
+        self._y[index] = location.y
+
+    def _location(self, index):
+        if self._x is None:
+            return UNDEFINED_LOCATION
+        return MutableLocation(x=self._x[index], y=self._y[index])
+
+    @classmethod
+    def from_arrays(cls, refs, x=None, y=None):
+        """
+        Create a list from arrays as returned by refs() and location_arrays(). The arrays are
+        used without copying them.
+        """
+        result = cls()
+        result._refs = refs
+        result._x = x
+        result._y = y
+        return result
+
+    def refs(self):
+        """
+        Get the node IDs.
+
+        Returns:
+            array: array of node IDs, must not be modified
+        """
+        return self._refs
+
+    def location_arrays(self):
+        """
+        Get the coordinates of the node references.
+
+        Returns:
+            tuple: arrays of the x and y coordinates (fixed-point integers) or ``(None, None)`` if
+            no node reference has a location, must not be modified
+        """
+        return self._x, self._y
+
+    def __len__(self):
+        return len(self._refs)
 
     def __iter__(self):
-        return self._nodes.__iter__()
+        if self._x is None:
+            for ref in self._refs:
+                yield MutableNodeRef(ref=ref)
+        else:
+            for i, ref in enumerate(self._refs):
+                yield MutableNodeRef(ref=ref, location=self._location(i))
+
+    def __getitem__(self, index):
+        return MutableNodeRef(ref=self._refs[index], location=self._location(index))
 
     def __setitem__(self, index, value):
-        self._nodes[index] = value
+        if isinstance(value, int):
+            self._refs[index] = value
+            self._store_location(index, None)
+        else:
+            self._refs[index] = value.ref
+            self._store_location(index, value.location)
+
+    def __eq__(self, other):
+        if not isinstance(other, MutableNodeRefList):
+            return NotImplemented
+        return self._refs == other._refs and self._x == other._x and self._y == other._y
 
     def append(self, value):
-        self._nodes.append(value)
+        if isinstance(value, int):
+            self._refs.append(value)
+            location = None
+        else:
+            self._refs.append(value.ref)
+            location = value.location
+        if self._x is not None:
+            self._x.append(UNDEFINED_COORDINATE)
+            self._y.append(UNDEFINED_COORDINATE)
+        self._store_location(len(self._refs) - 1, location)
 
     def __str__(self):
         result = "  nodes:\n"
-        for n in self._nodes:
+        for n in self:
             result += "    {}\n".format(n.__str__())
         return result
 
 
 class MutableWayNodeList(MutableNodeRefList):
-    def __init__(self, base):
+    __slots__ = ()
+
+    def __init__(self, base=()):
         MutableNodeRefList.__init__(self, base)
 
 
 class MutableTagList():
+    __slots__ = ("_tags",)
+
     def __init__(self, base):
         # TODO imitate correct interface
         self._tags = dict()
         for t in base:
-            self._tags[t.k] = t.v
+            self._tags[sys.intern(t.k)] = t.v
 
     def __iter__(self):
         return self._tags.__iter__()
@@ -92,11 +255,14 @@ class MutableTagList():
         return self._tags[key]
 
     def __setitem__(self, key, value):
-        self._tags[key] = value
+        self._tags[sys.intern(key)] = value
 
     def __contains__(self, item):
         return item in self._tags
 
+    def __len__(self):
+        return len(self._tags)
+
     def __str__(self):
         result = "  tags:\n"
         for tk, tv in self._tags.items():
@@ -114,16 +280,20 @@ class MutableTagList():
 
 
 class MutableRelationMember():
+    __slots__ = ("ref", "type", "role")
+
     def __init__(self, base):
         self.ref = base.ref
-        self.type = base.type
-        self.role = base.role
+        self.type = sys.intern(base.type)
+        self.role = sys.intern(base.role)
 
     def __str__(self):
         return "    {} {} as {}\n".format(self.type, self.ref, self.role)
 
 
 class MutableRelationMemberList():
+    __slots__ = ("members",)
+
     def __init__(self, base):
         # TODO imitate correct interface
         self.members = []
@@ -133,7 +303,60 @@ class MutableRelationMemberList():
     def __iter__(self):
         return self.members.__iter__()
 
+    def __len__(self):
+        return len(self.members)
+
     def __str__(self):
-        result = "  tags:\n"
+        result = "  members:\n"
         for m in self.members:
             result += m.__str__()
+        return result
+
+
+def detached_node(node):
+    """
+    Create a mutable copy of a node which does not refer to the buffers of Osmium.
+
+    All attributes are copied exactly once. The result can be kept after the handler callback has
+    returned.
+
+    Args:
+        node (osmium.osm.Node): node provided by Osmium
+
+    Returns:
+        osmium.osm.mutable.Node
+    """
+    return osmium.osm.mutable.Node(id=node.id, version=node.version, visible=node.visible, changeset=node.changeset,
+                                   timestamp=node.timestamp, uid=node.uid, user=node.user,
+                                   tags=MutableTagList(node.tags), location=MutableLocation(node.location))
+
+
+def detached_way(way):
+    """
+    Create a mutable copy of a way which does not refer to the buffers of Osmium.
+
+    Args:
+        way (osmium.osm.Way): way provided by Osmium
+
+    Returns:
+        osmium.osm.mutable.Way
+    """
+    return osmium.osm.mutable.Way(id=way.id, version=way.version, visible=way.visible, changeset=way.changeset,
+                                  timestamp=way.timestamp, uid=way.uid, user=way.user,
+                                  tags=MutableTagList(way.tags), nodes=MutableWayNodeList(way.nodes))
+
+
+def detached_relation(relation):
+    """
+    Create a mutable copy of a relation which does not refer to the buffers of Osmium.
+
+    Args:
+        relation (osmium.osm.Relation): relation provided by Osmium
+
+    Returns:
+        osmium.osm.mutable.Relation
+    """
+    return osmium.osm.mutable.Relation(id=relation.id, version=relation.version, visible=relation.visible,
+                                       changeset=relation.changeset, timestamp=relation.timestamp, uid=relation.uid,
+                                       user=relation.user, tags=MutableTagList(relation.tags),
+                                       members=MutableRelationMemberList(relation.members))
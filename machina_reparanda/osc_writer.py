@@ -0,0 +1,165 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+import os
+
+from .osm_xml_builder import OsmXmlBuilder
+from .sort_functions import obj_to_str
+
+
+def sidecar_path(path):
+    """
+    Get the path of the file listing the changesets reverted by the objects of an OSC file.
+    """
+    return "{}.json".format(path)
+
+
+#: closing tags of the objects written by OsmChangeWriter
+OBJECT_END_TAGS = (b"  </node>\n", b"  </way>\n", b"  </relation>\n")
+
+
+def object_key(osm_type, osm_id):
+    return "{}/{}".format(osm_type, osm_id)
+
+
+class OsmChangeWriter:
+    """
+    Write the results of a revert to an osmChange file instead of uploading them.
+
+    Every object is serialized and written as soon as it is handed over, the objects are not kept
+    in memory. The file can be reviewed (e.g. in JOSM) and uploaded later using upload_osc.py.
+    Which changesets are reverted by which object is written to a file next to it (see
+    sidecar_path()) with one JSON document per line. Both files are flushed after every object,
+    i.e. the sidecar of an interrupted run lists all objects written to the osmChange file so far.
+    Such an osmChange file lacks the closing ``</modify></osmChange>`` tags and might end with an
+    incomplete object. apply_osc() reads it nevertheless.
+
+    The writer provides the methods of OsmApiUploader used by the worker and can be used instead
+    of it.
+
+    Args:
+        path (str): path of the output file
+        configuration (Configuration): configuration
+    """
+
+    def __init__(self, path, configuration):
+        self.path = path
+        self.comment = configuration.comment
+        self.xml_builder = OsmXmlBuilder(configuration)
+        self.used_changesets = set() #: always empty because nothing is uploaded
+        self.object_count = 0 #: number of objects written
+        self.upload_listeners = [] #: never called because nothing is uploaded
+        self.file = open(path, "wb")
+        self.file.write(self.xml_builder.osm_change_header().encode("utf-8"))
+        self.sidecar = open(sidecar_path(path), "w", encoding="utf-8")
+        self._write_sidecar({"comment": self.comment})
+
+    def _write_sidecar(self, record):
+        self.sidecar.write(json.dumps(record))
+        self.sidecar.write("\n")
+        self.sidecar.flush()
+
+    def handle_object(self, new_object, changesets):
+        if new_object is None or self.file is None:
+            return
+        # the sidecar is written first, it must not miss any object of the osmChange file
+        self._write_sidecar({"object": object_key(obj_to_str(new_object), new_object.id), "changesets": sorted(changesets)})
+        self.file.write(self.xml_builder.fragment(new_object))
+        self.file.flush()
+        self.object_count += 1
+
+    def close_changeset(self):
+        """
+        Complete the osmChange file and write the list of reverted changesets.
+        """
+        if self.file is None:
+            return
+        self.file.write(self.xml_builder.osm_change_footer().encode("utf-8"))
+        self.file.close()
+        self.file = None
+        self.sidecar.close()
+        logging.info("Wrote {} objects to {}".format(self.object_count, self.path))
+
+    def comment_reverted_changesets(self, changesets):
+        """
+        Do nothing because the reverted changesets are commented when the file is uploaded.
+        """
+        pass
+
+
+def apply_osc(handler, path):
+    """
+    Let an Osmium handler read an osmChange file written by OsmChangeWriter.
+
+    The file of an interrupted run lacks the closing tags and might end with an incomplete object.
+    Then the objects up to the last complete one are read.
+
+    Args:
+        handler (osmium.SimpleHandler): handler
+        path (str): path of the osmChange file
+    """
+    footer = OsmXmlBuilder.osm_change_footer().encode("utf-8")
+    with open(path, "rb") as osc_file:
+        osc_file.seek(max(0, os.path.getsize(path) - len(footer)))
+        complete = osc_file.read() == footer
+        if not complete:
+            osc_file.seek(0)
+            data = osc_file.read()
+    if complete:
+        handler.apply_file(path)
+        return
+    header_end = data.find(b"<modify>\n")
+    if header_end < 0:
+        logging.warning("{} contains no objects".format(path))
+        return
+    end = max([header_end + len(b"<modify>\n")] + [data.rfind(tag) + len(tag) for tag in OBJECT_END_TAGS if tag in data])
+    logging.warning("{} is incomplete, reading the objects in its first {} bytes".format(path, end))
+    handler.apply_buffer(data[:end] + footer, "osc")
+
+
+def read_sidecar(path):
+    """
+    Read the list of changesets reverted by the objects of an OSC file written by
+    OsmChangeWriter.
+
+    A truncated last line, e.g. written by an interrupted run, is ignored.
+
+    Returns:
+        tuple: changeset comment (str) and dictionary of reverted changesets (set of int) indexed
+        by (type, ID)
+    """
+    comment = ""
+    object_changesets = {}
+    with open(sidecar_path(path), "r", encoding="utf-8") as sidecar:
+        for line in sidecar:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning("Ignoring incomplete line in {}".format(sidecar_path(path)))
+                continue
+            comment = record.get("comment", comment)
+            if "object" in record:
+                object_changesets[record["object"]] = record["changesets"]
+    objects = {}
+    for key, changesets in object_changesets.items():
+        osm_type, osm_id = key.split("/")
+        objects[(osm_type, int(osm_id))] = set(changesets)
+    return comment, objects
@@ -0,0 +1,443 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import datetime
+import heapq
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from collections import namedtuple
+
+import osmium
+
+from .mutable_osm_objects import MutableTagList, MutableWayNodeList, MutableRelationMemberList, MutableLocation
+from .mutable_osm_objects import detached_node, detached_way, detached_relation
+from .osm_api_functions import ApiClientProxy, OsmApiResponse
+
+MAGIC = b"MRHIDX02"
+#: magic number, size and modification time (ns) of the source file, number of entries, offset of the entries
+HEADER = struct.Struct("<8sQqQQ")
+#: type code, ID, version, offset and length of the encoded object
+ENTRY = struct.Struct("<BqIQI")
+TYPE_CODES = {"node": 1, "way": 2, "relation": 3}
+#: type code, ID, version, changeset, timestamp (seconds since the epoch), uid and visibility of an encoded object
+OBJECT = struct.Struct("<BqIqqI?")
+#: length of an encoded string (UTF-8)
+STRING = struct.Struct("<H")
+#: number of tags, node references or members
+COUNT = struct.Struct("<I")
+#: fixed-point coordinates of a node
+LOCATION = struct.Struct("<ii")
+#: type and ID of a relation member, followed by its role
+MEMBER = struct.Struct("<cq")
+
+Member = namedtuple("Member", ["ref", "type", "role"])
+
+
+def default_index_path(source):
+    return "{}.idx".format(source)
+
+
+def _encode_string(parts, text):
+    data = text.encode("utf-8")
+    parts.append(STRING.pack(len(data)))
+    parts.append(data)
+
+
+def _decode_string(data, offset):
+    length, = STRING.unpack_from(data, offset)
+    offset += STRING.size
+    return str(data[offset:offset + length], "utf-8"), offset + length
+
+
+def _encode_array(parts, values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    parts.append(values.tobytes())
+
+
+def _decode_array(typecode, data, offset, count):
+    values = array(typecode)
+    end = offset + count * values.itemsize
+    values.frombytes(data[offset:end])
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values, end
+
+
+def encode_object(type_code, obj):
+    """
+    Encode a version of an object in the compact binary format of the index file.
+
+    Args:
+        type_code (int): type code of the object (see TYPE_CODES)
+        obj (osmium.osm.mutable.OSMObject): object created by detached_node(), detached_way() or
+            detached_relation()
+
+    Returns:
+        bytes
+    """
+    parts = [OBJECT.pack(type_code, obj.id, obj.version, obj.changeset, int(obj.timestamp.timestamp()), obj.uid, obj.visible)]
+    _encode_string(parts, obj.user)
+    parts.append(COUNT.pack(len(obj.tags)))
+    for key, value in obj.tags.items():
+        _encode_string(parts, key)
+        _encode_string(parts, value)
+    if type_code == TYPE_CODES["node"]:
+        parts.append(LOCATION.pack(obj.location.x, obj.location.y))
+    elif type_code == TYPE_CODES["way"]:
+        x, y = obj.nodes.location_arrays()
+        parts.append(COUNT.pack(len(obj.nodes)))
+        parts.append(b"\x01" if x is not None else b"\x00")
+        _encode_array(parts, obj.nodes.refs())
+        if x is not None:
+            _encode_array(parts, x)
+            _encode_array(parts, y)
+    else:
+        parts.append(COUNT.pack(len(obj.members)))
+        for member in obj.members:
+            parts.append(MEMBER.pack(member.type.encode("ascii"), member.ref))
+            _encode_string(parts, member.role)
+    return b"".join(parts)
+
+
+def decode_object(data):
+    """
+    Decode a version of an object encoded by encode_object().
+
+    Args:
+        data (bytes-like): encoded object
+
+    Returns:
+        osmium.osm.mutable.OSMObject: the same object as detached_node(), detached_way() or
+        detached_relation() would create
+    """
+    type_code, osm_id, version, changeset, timestamp, uid, visible = OBJECT.unpack_from(data, 0)
+    user, offset = _decode_string(data, OBJECT.size)
+    attributes = {"id": osm_id, "version": version, "visible": visible, "changeset": changeset, "uid": uid, "user": user,
+                  "timestamp": datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)}
+    count, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    tags = MutableTagList(())
+    for i in range(count):
+        key, offset = _decode_string(data, offset)
+        tags[key], offset = _decode_string(data, offset)
+    if type_code == TYPE_CODES["node"]:
+        x, y = LOCATION.unpack_from(data, offset)
+        return osmium.osm.mutable.Node(tags=tags, location=MutableLocation(x=x, y=y), **attributes)
+    count, = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    if type_code == TYPE_CODES["way"]:
+        has_locations = data[offset]
+        refs, offset = _decode_array("q", data, offset + 1, count)
+        x = y = None
+        if has_locations:
+            x, offset = _decode_array("i", data, offset, count)
+            y, offset = _decode_array("i", data, offset, count)
+        return osmium.osm.mutable.Way(tags=tags, nodes=MutableWayNodeList.from_arrays(refs, x, y), **attributes)
+    members = []
+    for i in range(count):
+        member_type, ref = MEMBER.unpack_from(data, offset)
+        role, offset = _decode_string(data, offset + MEMBER.size)
+        members.append(Member(ref, member_type.decode("ascii"), role))
+    return osmium.osm.mutable.Relation(tags=tags, members=MutableRelationMemberList(members), **attributes)
+
+
+def _read_entries(chunk):
+    chunk.seek(0)
+    while True:
+        data = chunk.read(ENTRY.size * 65536)
+        if not data:
+            break
+        yield from ENTRY.iter_unpack(data)
+
+
+class HistoryIndexBuilder(osmium.SimpleHandler):
+    """
+    Handler which writes every version of a full-history file in the compact encoding of
+    encode_object() to an output file and collects the index entries of the versions.
+
+    The entries are written to temporary files in sorted chunks of CHUNK_SIZE entries, i.e. the
+    memory usage does not depend on the size of the full-history file. Full-history files are
+    usually sorted by type, ID and version. Then the chunks are concatenated, otherwise they are
+    merged.
+
+    Args:
+        output (file): output file
+        offset (int): offset of the first object in the output file
+        tmp_dir (str): directory for the temporary chunk files
+    """
+
+    CHUNK_SIZE = 1000000 #: number of index entries kept in memory
+
+    def __init__(self, output, offset, tmp_dir=None):
+        osmium.SimpleHandler.__init__(self)
+        self.output = output
+        self.offset = offset #: offset of the next object in the output file
+        self.tmp_dir = tmp_dir
+        self.entries = bytearray() #: packed index entries of the current chunk
+        self.chunks = [] #: temporary files of the complete chunks
+        self.count = 0
+        self.is_sorted = True #: all entries have been added in sorted order
+        self.chunk_sorted = True #: the entries of the current chunk have been added in sorted order
+        self._last = (0, 0, 0)
+
+    def _add(self, type_code, obj):
+        data = encode_object(type_code, obj)
+        self.output.write(data)
+        key = (type_code, obj.id, obj.version)
+        if key < self._last:
+            self.is_sorted = False
+            self.chunk_sorted = False
+        self._last = key
+        self.entries += ENTRY.pack(type_code, obj.id, obj.version, self.offset, len(data))
+        self.offset += len(data)
+        self.count += 1
+        if len(self.entries) >= self.CHUNK_SIZE * ENTRY.size:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if not self.entries:
+            return
+        chunk = tempfile.TemporaryFile(dir=self.tmp_dir)
+        if self.chunk_sorted:
+            chunk.write(self.entries)
+        else:
+            chunk.write(b"".join(ENTRY.pack(*e) for e in sorted(ENTRY.iter_unpack(self.entries))))
+        self.chunks.append(chunk)
+        self.entries = bytearray()
+        self.chunk_sorted = True
+
+    def node(self, node):
+        self._add(TYPE_CODES["node"], detached_node(node))
+
+    def way(self, way):
+        self._add(TYPE_CODES["way"], detached_way(way))
+
+    def relation(self, relation):
+        self._add(TYPE_CODES["relation"], detached_relation(relation))
+
+    def write_entries(self, output):
+        """
+        Write all index entries sorted by type, ID and version to the output file and remove the
+        temporary files.
+        """
+        self._write_chunk()
+        try:
+            if self.is_sorted:
+                for chunk in self.chunks:
+                    chunk.seek(0)
+                    shutil.copyfileobj(chunk, output)
+                return
+            buf = bytearray()
+            for entry in heapq.merge(*[_read_entries(c) for c in self.chunks]):
+                buf += ENTRY.pack(*entry)
+                if len(buf) >= ENTRY.size * 65536:
+                    output.write(buf)
+                    buf = bytearray()
+            output.write(buf)
+        finally:
+            for chunk in self.chunks:
+                chunk.close()
+            self.chunks = []
+
+
+def build_history_index(source, index_path):
+    """
+    Read a full-history file (e.g. .osh.pbf) and write all its versions and a sorted index of
+    them to index_path.
+    """
+    logging.info("Building index {} of full-history file {}, this happens only once".format(index_path, source))
+    stat = os.stat(source)
+    tmp_path = "{}.tmp".format(index_path)
+    with open(tmp_path, "wb") as output:
+        output.write(HEADER.pack(MAGIC, 0, 0, 0, 0))
+        builder = HistoryIndexBuilder(output, HEADER.size, os.path.dirname(os.path.abspath(index_path)))
+        builder.apply_file(source)
+        builder.write_entries(output)
+        output.seek(0)
+        output.write(HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, builder.count, builder.offset))
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(tmp_path, index_path)
+    logging.info("Indexed {} versions".format(builder.count))
+
+
+class HistoryFile:
+    """
+    Random access to all versions of a full-history file.
+
+    The versions are read once and stored together with an index sorted by type, ID and version in
+    a file next to the source (or at index_path). The versions are stored in a compact binary
+    encoding (see encode_object()), not as pickles, i.e. reading a manipulated index file cannot
+    execute code. The index file is memory-mapped, i.e. it is shared by all processes and only the
+    pages accessed are read from disk. It is rebuilt if the size or modification time of the
+    source file have changed.
+
+    Args:
+        source (str): path of the full-history file
+        index_path (str): path of the index file, defaults to the source path with suffix .idx
+    """
+
+    def __init__(self, source, index_path=None):
+        self.source = source
+        self.index_path = index_path if index_path is not None else default_index_path(source)
+        if not self.is_up_to_date():
+            build_history_index(source, self.index_path)
+        with open(self.index_path, "rb") as index_file:
+            self.map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size, mtime, self.count, self.entries_offset = HEADER.unpack_from(self.map, 0)
+
+    def is_up_to_date(self):
+        """
+        Check if the index file exists and has been built from the current source file.
+        """
+        try:
+            with open(self.index_path, "rb") as index_file:
+                header = index_file.read(HEADER.size)
+        except FileNotFoundError:
+            return False
+        if len(header) < HEADER.size:
+            return False
+        magic, size, mtime, count, entries_offset = HEADER.unpack(header)
+        stat = os.stat(self.source)
+        return magic == MAGIC and size == stat.st_size and mtime == stat.st_mtime_ns
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self.map, self.entries_offset + i * ENTRY.size)
+
+    def versions(self, osm_type, osm_id):
+        """
+        Find the versions of an object.
+
+        Returns:
+            dict: tuples of offset and length of the encoded versions indexed by version number
+        """
+        type_code = TYPE_CODES[osm_type]
+        key = (type_code, osm_id)
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[:2] < key:
+                low = middle + 1
+            else:
+                high = middle
+        result = {}
+        while low < self.count:
+            t, i, version, offset, length = self._entry(low)
+            if (t, i) != key:
+                break
+            result[version] = (offset, length)
+            low += 1
+        return result
+
+    def load(self, location):
+        offset, length = location
+        return decode_object(self.map[offset:offset + length])
+
+    def close(self):
+        self.map.close()
+
+
+class OshHistoryProvider(ApiClientProxy):
+    """
+    API client which serves old versions from a full-history file instead of the API.
+
+    Versions newer than the file and objects missing in it (e.g. outside of the extract) are
+    requested from the wrapped client. Versions missing between two versions in the file are
+    reported as not found: they might have been redacted but in a regional extract the object was
+    usually outside of the region. The latest version is always requested from the wrapped client
+    because the file might be outdated.
+
+    Args:
+        client (OsmApiClient): client to fetch everything else with
+        history_file (HistoryFile): full-history file
+    """
+
+    def __init__(self, client, history_file):
+        super().__init__(client)
+        self.history_file = history_file
+        self.hits = 0 #: number of versions served from the file
+        self.misses = 0 #: number of requests forwarded to the client
+        self._lock = threading.Lock()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_history(self, osm_type, osm_id):
+        """
+        Get all versions of an object contained in the file. Versions created after the file was
+        written are missing.
+        """
+        versions = self.history_file.versions(osm_type, osm_id)
+        if not versions:
+            self._count(False)
+            return self.client.get_history(osm_type, osm_id)
+        self._count(True)
+        return OsmApiResponse.EXISTS, [self.history_file.load(versions[v]) for v in sorted(versions)]
+
+    def get_version(self, osm_type, osm_id, version, fallback_if_redacted=True):
+        versions = self.history_file.versions(osm_type, osm_id)
+        if version > max(versions, default=0):
+            self._count(False)
+            return self.client.get_version(osm_type, osm_id, version, fallback_if_redacted)
+        self._count(True)
+        if version in versions:
+            return OsmApiResponse.EXISTS, self.history_file.load(versions[version])
+        # Versions missing in the file are not necessarily redacted. In a regional extract, the
+        # object was usually outside of the region at that time.
+        return OsmApiResponse.NOT_FOUND, None
+
+    def get_local_version(self, osm_type, osm_id, version):
+        location = self.history_file.versions(osm_type, osm_id).get(version)
+        if location is None:
+            return self.client.get_local_version(osm_type, osm_id, version)
+        self._count(True)
+        return self.history_file.load(location)
+
+    def get_versions(self, osm_type, id_versions):
+        result = {}
+        missing = []
+        for osm_id, version in id_versions:
+            location = self.history_file.versions(osm_type, osm_id).get(version)
+            if location is None:
+                missing.append((osm_id, version))
+            else:
+                result[(osm_type, osm_id, version)] = self.history_file.load(location)
+        with self._lock:
+            self.hits += len(result)
+            self.misses += len(missing)
+        if missing:
+            result.update(self.client.get_versions(osm_type, missing))
+        return result
+
+    def __str__(self):
+        return "{} versions read from {}, {} requested from the API".format(self.hits, self.history_file.source, self.misses)
@@ -18,12 +18,12 @@ along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import logging
-import requests
-import copy
 import osmium
 from enum import Enum
-from machina_reparanda.mutable_osm_objects import MutableTagList, MutableWayNodeList, MutableRelationMemberList, MutableLocation
-from machina_reparanda.sort_functions import type_to_int
+from machina_reparanda.mutable_osm_objects import detached_node, detached_way, detached_relation
+from machina_reparanda.sort_functions import type_id_version
+from machina_reparanda.http_session import HttpSession
+from machina_reparanda.version_memo import VersionMemo
 
 
 class ObjectCopyHandler(osmium.SimpleHandler):
@@ -35,13 +35,13 @@ class ObjectCopyHandler(osmium.SimpleHandler):
         return self.objects[0]
 
     def node(self, node):
-        self.objects.append(copy.deepcopy(osmium.osm.mutable.Node(node, tags=MutableTagList(node.tags), location=MutableLocation(node.location))))
+        self.objects.append(detached_node(node))
 
     def way(self, way):
-        self.objects.append(copy.deepcopy(osmium.osm.mutable.Way(way, tags=MutableTagList(way.tags), nodes=MutableWayNodeList(way.nodes))))
+        self.objects.append(detached_way(way))
 
     def relation(self, relation):
-        self.objects.append(copy.deepcopy(osmium.osm.mutable.Relation(relation, tags=MutableTagList(relation.tags), members=MutableRelationMemberList(relation.members))))
+        self.objects.append(detached_relation(relation))
 
 
 class OsmApiResponse(Enum):
@@ -55,20 +55,56 @@ class OsmApiResponse(Enum):
 
 
 class OsmApiClient:
-    def __init__(self, configuration):
+    def __init__(self, configuration, session=None, cache=None):
         self.api_url = configuration.api_url
         self.headers = {'user-agent': configuration.user_agent}
+        self.session = session if session is not None else HttpSession(configuration) #: instance of HttpSession
+        self.cache = cache #: instance of VersionCache or None
+        self.batch_size = configuration.batch_size #: maximum number of objects per multi-fetch request
+        self.max_url_length = configuration.max_url_length #: maximum length of URLs of multi-fetch requests
+        self.memo = VersionMemo(configuration.memo_size) if configuration.memo_size > 0 else None #: instance of VersionMemo or None
+
+    def _remember(self, osm_type, obj, latest=False):
+        if self.memo is not None:
+            self.memo.put(osm_type, obj, latest)
+
+    def object_uploaded(self, osm_type, osm_id, version):
+        """
+        Forget the latest version of an object after it has been uploaded.
+
+        Args:
+            osm_type (str): object type (node, way or relation)
+            osm_id (int): object ID
+            version (int): new version number
+        """
+        if self.memo is not None:
+            self.memo.invalidate_latest(osm_type, osm_id)
+        if self.cache is not None:
+            self.cache.invalidate_latest(osm_type, osm_id)
 
     def get_history(self, osm_type, osm_id):
+        """
+        Get all versions of an object.
+
+        Redacted versions are not part of the history returned by the API, i.e. the returned list
+        has gaps if some versions are redacted.
+
+        Args:
+            osm_type (str): object type (node, way or relation)
+            osm_id (int): object ID
+
+        Returns:
+            OsmApiResponse: response code
+            list: versions of the object sorted by version or None
+        """
         url = "{}/{}/{}/history".format(self.api_url, osm_type, osm_id)
-        r = requests.get(url, headers=self.headers)
+        r = self.session.get(url, headers=self.headers)
         logging.debug("GET {} {}".format(url, r.status_code))
-        if r.status_code == 403:  # forbidden – redacted version
-            if version > 1 and fallback_if_redacted:
-                return OsmApiResponse.REDACTED_FALLBACK, self.get_version(osm_type, osm_id, version - 1, fallback_if_redacted)
-            else:
-                logging.warning("Manual action necessary because all previous versions are redacted for {} {}".format(osm_type, osm_id))
-                return OsmApiResponse.REDACTED, None
+        if r.status_code == 403:  # forbidden – redacted
+            logging.warning("Manual action necessary because the history of {} {} is redacted".format(osm_type, osm_id))
+            return OsmApiResponse.REDACTED, None
+        elif r.status_code == 404:
+            return OsmApiResponse.NOT_FOUND, None
         elif r.status_code != 200:  # other error
             return OsmApiResponse.ERROR, None
 
@@ -76,16 +112,39 @@ class OsmApiClient:
         data = r.content
         handler = ObjectCopyHandler()
         handler.apply_buffer(data, ".osm")
-        handler.objects.sort(key=lambda obj: (type_to_int(obj), obj.id, obj.version))
+        handler.objects.sort(key=type_id_version)
+        if self.cache is not None:
+            self.cache.put_many(osm_type, handler.objects)
         return OsmApiResponse.EXISTS, handler.objects
 
+    def get_local_version(self, osm_type, osm_id, version):
+        """
+        Get a version of an object if it is available without sending a request, e.g. for
+        AbstractRevertImplementation.prefilter().
+
+        Returns:
+            osmium.osm.mutable.OSMObject: the version or None
+        """
+        obj = None
+        if self.memo is not None:
+            obj = self.memo.get(osm_type, osm_id, version)
+        if obj is None and self.cache is not None:
+            obj = self.cache.get(osm_type, osm_id, version)
+        return obj
+
     def get_version(self, osm_type, osm_id, version, fallback_if_redacted=True):
+        obj = self.get_local_version(osm_type, osm_id, version)
+        if obj is not None:
+            return OsmApiResponse.EXISTS, obj
         url = "{}/{}/{}/{}".format(self.api_url, osm_type, osm_id, version)
-        r = requests.get(url, headers=self.headers)
+        r = self.session.get(url, headers=self.headers)
         logging.debug("GET {} {}".format(url, r.status_code))
         if r.status_code == 403:  # forbidden – redacted version
             if version > 1 and fallback_if_redacted:
-                return OsmApiResponse.REDACTED_FALLBACK, self.get_version(osm_type, osm_id, version - 1, fallback_if_redacted)
+                response, obj = self.get_version(osm_type, osm_id, version - 1, fallback_if_redacted)
+                if response in [OsmApiResponse.EXISTS, OsmApiResponse.REDACTED_FALLBACK]:
+                    return OsmApiResponse.REDACTED_FALLBACK, obj
+                return response, obj
             else:
                 logging.warning("Manual action necessary because all previous versions are redacted for {} {}".format(osm_type, osm_id))
                 return OsmApiResponse.REDACTED, None
@@ -96,11 +155,26 @@ class OsmApiClient:
         data = r.content
         handler = ObjectCopyHandler()
         handler.apply_buffer(data, ".osm")
+        if self.cache is not None:
+            self.cache.put(osm_type, handler.get_object())
+        self._remember(osm_type, handler.get_object())
         return OsmApiResponse.EXISTS, handler.get_object()
 
     def get_latest_version(self, osm_type, osm_id):
+        if self.memo is not None:
+            obj = self.memo.get_latest(osm_type, osm_id)
+            if obj is not None and obj.visible:
+                return OsmApiResponse.EXISTS, obj
+            elif obj is not None:
+                return OsmApiResponse.DELETED, None
+        if self.cache is not None:
+            obj = self.cache.get_latest(osm_type, osm_id)
+            if obj is not None and obj.visible:
+                return OsmApiResponse.EXISTS, obj
+            elif obj is not None:
+                return OsmApiResponse.DELETED, None
         url = "{}/{}/{}".format(self.api_url, osm_type, osm_id)
-        r = requests.get(url, headers=self.headers)
+        r = self.session.get(url, headers=self.headers)
         logging.debug("GET {} {}".format(url, r.status_code))
         if r.status_code == 404:
             return OsmApiResponse.NOT_FOUND, None
@@ -112,4 +186,126 @@ class OsmApiClient:
             data = r.content
             handler = ObjectCopyHandler()
             handler.apply_buffer(data, ".osm")
+            if self.cache is not None:
+                self.cache.put_latest(osm_type, handler.get_object())
+            self._remember(osm_type, handler.get_object(), True)
             return OsmApiResponse.EXISTS, handler.get_object()
+
+    def _split_into_chunks(self, osm_type, elements):
+        """
+        Split a list of elements (IDs or IDs with version suffix) into chunks which fit into the
+        URL of a multi-fetch request.
+        """
+        base_length = len("{}/{}s?{}s=".format(self.api_url, osm_type, osm_type))
+        chunks = []
+        chunk = []
+        length = base_length
+        for element in elements:
+            if chunk and (len(chunk) >= self.batch_size or length + len(element) + 1 > self.max_url_length):
+                chunks.append(chunk)
+                chunk = []
+                length = base_length
+            chunk.append(element)
+            length += len(element) + 1
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _get_multiple(self, osm_type, elements, result, latest=False):
+        """
+        Fetch a chunk of elements with one request of the multi-fetch API and add them to result.
+
+        The API refuses the whole request if one of the elements does not exist or is redacted. The
+        chunk is bisected in this case to get all other elements. Elements which cannot be
+        retrieved are missing in the result.
+        """
+        url = "{}/{}s?{}s={}".format(self.api_url, osm_type, osm_type, ",".join(elements))
+        r = self.session.get(url, headers=self.headers)
+        logging.debug("GET {} {}".format(url, r.status_code))
+        if r.status_code != 200:
+            if len(elements) > 1:
+                middle = len(elements) // 2
+                self._get_multiple(osm_type, elements[:middle], result, latest)
+                self._get_multiple(osm_type, elements[middle:], result, latest)
+            return
+        handler = ObjectCopyHandler()
+        handler.apply_buffer(r.content, ".osm")
+        for obj in handler.objects:
+            if self.cache is not None and latest:
+                self.cache.put_latest(osm_type, obj)
+            elif self.cache is not None:
+                self.cache.put(osm_type, obj)
+            self._remember(osm_type, obj, latest)
+            result[(osm_type, obj.id, obj.version)] = obj
+
+    def get_latest_versions(self, osm_type, osm_ids):
+        """
+        Get the latest versions of many objects of the same type.
+
+        Deleted objects are returned with visible set to False.
+
+        Args:
+            osm_type (str): object type (node, way or relation)
+            osm_ids (iterable of int): object IDs
+
+        Returns:
+            dict: objects indexed by (type, ID, version). Objects which could not be retrieved are
+            missing.
+        """
+        result = {}
+        missing = []
+        for osm_id in osm_ids:
+            obj = self.memo.get_latest(osm_type, osm_id) if self.memo is not None else None
+            if obj is None and self.cache is not None:
+                obj = self.cache.get_latest(osm_type, osm_id)
+            if obj is None:
+                missing.append(str(osm_id))
+            else:
+                result[(osm_type, obj.id, obj.version)] = obj
+        for chunk in self._split_into_chunks(osm_type, missing):
+            self._get_multiple(osm_type, chunk, result, True)
+        return result
+
+    def get_versions(self, osm_type, id_versions):
+        """
+        Get specific versions of many objects of the same type.
+
+        Args:
+            osm_type (str): object type (node, way or relation)
+            id_versions (iterable of tuple): pairs of object ID and version
+
+        Returns:
+            dict: objects indexed by (type, ID, version). Objects which could not be retrieved,
+            e.g. because they are redacted, are missing.
+        """
+        result = {}
+        missing = []
+        for osm_id, version in id_versions:
+            obj = self.memo.get(osm_type, osm_id, version) if self.memo is not None else None
+            if obj is None and self.cache is not None:
+                obj = self.cache.get(osm_type, osm_id, version)
+            if obj is None:
+                missing.append("{}v{}".format(osm_id, version))
+            else:
+                result[(osm_type, osm_id, version)] = obj
+        for chunk in self._split_into_chunks(osm_type, missing):
+            self._get_multiple(osm_type, chunk, result)
+        return result
+
+
+class ApiClientProxy:
+    """
+    Base class for wrappers around an OsmApiClient.
+
+    Subclasses override the methods they want to speed up. All other attributes and methods are
+    looked up at the wrapped client.
+    """
+
+    def __init__(self, client):
+        self.client = client #: wrapped API client
+
+    def __getattr__(self, name):
+        if name == "client":
+            # not initialised yet, e.g. while unpickling
+            raise AttributeError(name)
+        return getattr(self.client, name)
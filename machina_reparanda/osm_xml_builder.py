@@ -17,33 +17,63 @@ You should have received a copy of the GNU General Public License
 along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import re
 from xml.sax import saxutils
 
 from .revert_exceptions import TagInvalidException, ProgrammingError
+from .sort_functions import type_to_int
+
+#: characters which have to be escaped in attribute values
+NEEDS_ESCAPING = re.compile("[&<>\"\n\r\t]")
+
+MEMBER_TYPES = {"n": "node", "w": "way", "r": "relation"} #: long names of member types
+
+
+def quote_attribute(data):
+    """
+    Escape a string for use as XML attribute value and surround it by quotes.
+
+    Most keys, values and roles contain no characters which have to be escaped. They are returned
+    without running the escaping routines of saxutils.
+    """
+    if NEEDS_ESCAPING.search(data) is None:
+        return "\"" + data + "\""
+    return saxutils.quoteattr(data)
 
 
 class OsmXmlBuilder:
+    """
+    Serialize OSM objects and changesets as XML for the API.
+
+    The document is collected as a list of string fragments which are joined and encoded as UTF-8
+    once when it is complete, i.e. all documents are returned as bytes ready to be uploaded.
+    Integers (IDs, versions, node references) are inserted without escaping.
+    """
+
     def __init__(self, configuration):
-        self.buffer = ""
+        self.parts = [] #: fragments of the document being built
         self.user = configuration.user
         self.user_agent = configuration.user_agent
         self.changeset_id = 0
         self.configuration = configuration
 
+    @property
+    def buffer(self):
+        return "".join(self.parts).encode("utf-8")
+
     def set_changeset(self, changeset):
         self.changeset_id = changeset
 
     def reset(self):
-        self.buffer = ""
+        self.parts = []
         if self.changeset_id == 0:
             raise ProgrammingError("When cleaning the buffer to create a new object, the changeset ID must not be 0.")
 
     def add_header(self):
-        self.buffer = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
-        self.buffer += "<osm version=\"0.6\">\n"
+        self.parts = ["<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<osm version=\"0.6\">\n"]
 
     def finalize(self):
-        self.buffer += "</osm>\n"
+        self.parts.append("</osm>\n")
 
     def check_and_escape(self, data):
         """
@@ -62,51 +92,45 @@ class OsmXmlBuilder:
         """
         if len(data) > 255:
             raise TagInvalidException(data, "Key or value is too long.")
-        return saxutils.quoteattr(data)
+        return quote_attribute(data)
 
     def add_key_value(self, key, value):
-        k = self.check_and_escape(key)
-        v = self.check_and_escape(value)
-        self.buffer += "    <tag k={} v={}/>\n".format(k, v)
+        self.parts.append("    <tag k={} v={}/>\n".format(self.check_and_escape(key), self.check_and_escape(value)))
 
     def add_tag(self, tag):
         self.add_key_value(tag.k, tag.v)
 
     def add_tags(self, tag_list):
-        for key, value in tag_list.items():
-            self.add_key_value(key, value)
+        check_and_escape = self.check_and_escape
+        self.parts.extend(["    <tag k={} v={}/>\n".format(check_and_escape(k), check_and_escape(v)) for k, v in tag_list.items()])
 
     def add_node_ref(self, node_ref):
-        ndr = saxutils.quoteattr(str(node_ref.ref))
-        self.buffer += "    <nd ref={}/>\n".format(ndr)
+        self.parts.append("    <nd ref=\"{}\"/>\n".format(node_ref.ref))
 
     def add_way_node_list(self, way_node_list):
-        for nd_ref in way_node_list:
-            self.add_node_ref(nd_ref)
+        if hasattr(way_node_list, "refs"):
+            refs = way_node_list.refs()
+        else:
+            refs = [nd_ref.ref for nd_ref in way_node_list]
+        self.parts.extend(["    <nd ref=\"{}\"/>\n".format(ref) for ref in refs])
 
     def member_type_to_long_string(self, mtype):
-        if mtype == "n":
-            return "node"
-        elif mtype == "w":
-            return "way"
-        elif mtype == "r":
-            return "relation"
-        raise RuntimeError("Unknown OSM object type")
+        try:
+            return MEMBER_TYPES[mtype]
+        except KeyError:
+            raise RuntimeError("Unknown OSM object type")
 
     def add_relation_member(self, member):
-        mtype = saxutils.quoteattr(self.member_type_to_long_string(member.type))
-        mref = saxutils.quoteattr(str(member.ref))
-        mrole = saxutils.quoteattr(member.role)
-        self.buffer += "    <member type={} ref={} role={}/>\n".format(mtype, mref, mrole)
+        self.parts.append("    <member type=\"{}\" ref=\"{}\" role={}/>\n".format(self.member_type_to_long_string(member.type), member.ref, quote_attribute(member.role)))
 
     def add_relation_member_list(self, relation_members):
         for member in relation_members:
             self.add_relation_member(member)
 
     def changeset(self, comment):
-        self.buffer = ""
+        self.parts = []
         self.add_header()
-        self.buffer += "  <changeset>\n"
+        self.parts.append("  <changeset>\n")
         self.add_key_value("created_by", self.user_agent)
         #TODO shorten comment
         if len(comment) >= 254:
@@ -117,7 +141,7 @@ class OsmXmlBuilder:
         self.add_key_value("reverting", "yes")
         if self.configuration.automatic_conflict_solution:
             self.add_key_value("automatic_conflict_solution", "yes")
-        self.buffer += "  </changeset>\n"
+        self.parts.append("  </changeset>\n")
         self.finalize()
         return self.buffer
 
@@ -135,37 +159,86 @@ class OsmXmlBuilder:
             return "\"true\""
         return "\"false\""
 
+    def _start_object(self, name, obj, extra=""):
+        self.parts.append("  <{} id=\"{}\" changeset=\"{}\" version=\"{}\" visible={} user={}{}>\n".format(name, obj.id, self.changeset_id, obj.version, self._visible_to_str(obj.visible), quote_attribute(self.user), extra))
+
     def node(self, node, one_object_upload=True):
         if one_object_upload:
             self.reset()
             self.add_header()
-        self.buffer += "  <node id=\"{}\" changeset=\"{}\" version=\"{}\" visible={} user=\"{}\" lat=\"{}\" lon=\"{}\">\n".format(node.id, self.changeset_id, node.version, self._visible_to_str(node.visible), self.user, node.location.lat, node.location.lon)
+        self._start_object("node", node, " lat=\"{}\" lon=\"{}\"".format(node.location.lat, node.location.lon))
         self.add_tags(node.tags)
-        self.buffer += "  </node>\n"
+        self.parts.append("  </node>\n")
         if one_object_upload:
             self.finalize()
-        return self.buffer
+            return self.buffer
 
     def way(self, way, one_object_upload=True):
         if one_object_upload:
             self.reset()
             self.add_header()
-        self.buffer += "  <way id=\"{}\" changeset=\"{}\" version=\"{}\" visible={} user=\"{}\">\n".format(way.id, self.changeset_id, way.version, self._visible_to_str(way.visible), self.user)
+        self._start_object("way", way)
         self.add_way_node_list(way.nodes)
         self.add_tags(way.tags)
-        self.buffer += "  </way>\n"
+        self.parts.append("  </way>\n")
         if one_object_upload:
             self.finalize()
-        return self.buffer
+            return self.buffer
 
-    def relation(self, relation):
+    def relation(self, relation, one_object_upload=True):
         if one_object_upload:
             self.reset()
             self.add_header()
-        self.buffer += "  <relation id=\"{}\" changeset=\"{}\" version=\"{}\" visible={} user=\"{}\">\n".format(relation.id, self.changeset_id, relation.version, self._visible_to_str(relation.visible), self.user)
+        self._start_object("relation", relation)
         self.add_relation_member_list(relation.members)
         self.add_tags(relation.tags)
-        self.buffer += "  </relation>\n"
+        self.parts.append("  </relation>\n")
         if one_object_upload:
             self.finalize()
+            return self.buffer
+
+    def object_fragment(self, obj):
+        """
+        Append the XML element of an object to the document being built.
+        """
+        type_id = type_to_int(obj)
+        if type_id == 1:
+            self.node(obj, False)
+        elif type_id == 2:
+            self.way(obj, False)
+        elif type_id == 3:
+            self.relation(obj, False)
+        else:
+            raise ProgrammingError("Unknown OSM object type {}".format(type(obj)))
+
+    def fragment(self, obj):
+        """
+        Get the XML element of an object without document header and footer.
+        """
+        self.parts = []
+        self.object_fragment(obj)
+        return self.buffer
+
+    def osm_change_header(self):
+        return "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<osmChange version=\"0.6\" generator={}>\n<modify>\n".format(quote_attribute(self.user_agent))
+
+    @staticmethod
+    def osm_change_footer():
+        return "</modify>\n</osmChange>\n"
+
+    def osm_change(self, objects):
+        """
+        Create an osmChange document which modifies the given objects.
+
+        Args:
+            objects (list of osmium.osm.mutable.OSMObject): objects to be uploaded
+
+        Returns:
+            bytes: osmChange document encoded as UTF-8
+        """
+        self.reset()
+        self.parts.append(self.osm_change_header())
+        for obj in objects:
+            self.object_fragment(obj)
+        self.parts.append(self.osm_change_footer())
         return self.buffer
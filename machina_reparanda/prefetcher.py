@@ -0,0 +1,163 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from .osm_api_functions import ApiClientProxy, OsmApiResponse
+from .sort_functions import obj_to_str
+
+
+class PrefetchingApiClient(ApiClientProxy):
+    """
+    API client which fetches the latest and the previous version of upcoming objects in the
+    background.
+
+    The worker passes the stream of type/ID groups through prefetch(). While the revert
+    implementation works on one group, the versions required by the next ``prefetch_groups``
+    groups are downloaded by a pool of ``prefetch_workers`` threads. If ``batch_size`` is greater
+    than 0, blocks of that many groups are fetched with the multi-fetch API. A block is never
+    larger than ``prefetch_groups``, i.e. a small lookahead results in small blocks. Calls of
+    get_latest_version() and get_version() are served from these downloads if possible and are
+    forwarded to the wrapped client otherwise. The groups are yielded in their original order,
+    i.e. the order of reverts and uploads does not change.
+
+    Args:
+        client (OsmApiClient): client to fetch the data with
+        configuration (Configuration): configuration
+    """
+
+    def __init__(self, client, configuration):
+        super().__init__(client)
+        self.lookahead = configuration.prefetch_groups #: number of groups to fetch in advance
+        self.block_size = max(1, configuration.batch_size) #: number of groups fetched together
+        self.executor = None
+        if self.lookahead > 0:
+            self.block_size = min(self.block_size, self.lookahead)
+            self.executor = ThreadPoolExecutor(max_workers=configuration.prefetch_workers)
+        self._pending = {} #: futures of running or finished downloads
+
+    def _fetch_single(self, osm_type, osm_id, prev_version):
+        result = {("latest", osm_type, osm_id): self.client.get_latest_version(osm_type, osm_id)}
+        if prev_version > 0:
+            result[(osm_type, osm_id, prev_version)] = self.client.get_version(osm_type, osm_id, prev_version)
+        return result
+
+    def _fetch_block(self, osm_type, id_versions):
+        result = {}
+        for obj in self.client.get_latest_versions(osm_type, [osm_id for osm_id, v in id_versions]).values():
+            if obj.visible:
+                result[("latest", osm_type, obj.id)] = (OsmApiResponse.EXISTS, obj)
+            else:
+                result[("latest", osm_type, obj.id)] = (OsmApiResponse.DELETED, None)
+        id_versions = [(osm_id, v) for osm_id, v in id_versions if v > 0]
+        for (t, osm_id, version), obj in self.client.get_versions(osm_type, id_versions).items():
+            result[(osm_type, osm_id, version)] = (OsmApiResponse.EXISTS, obj)
+        return result
+
+    def _submit(self, block):
+        """
+        Start the downloads for a block of groups.
+
+        Returns:
+            list: tuples of the group and the keys of its downloads
+        """
+        entries = []
+        by_type = collections.defaultdict(list)
+        for objects in block:
+            osm_type = obj_to_str(objects[0])
+            osm_id = objects[0].id
+            prev_version = objects[0].version - 1
+            keys = [("latest", osm_type, osm_id)]
+            if prev_version > 0:
+                keys.append((osm_type, osm_id, prev_version))
+            entries.append((objects, keys))
+            by_type[osm_type].append((osm_id, prev_version))
+        for osm_type, id_versions in by_type.items():
+            if len(block) == 1:
+                osm_id, prev_version = id_versions[0]
+                future = self.executor.submit(self._fetch_single, osm_type, osm_id, prev_version)
+            else:
+                future = self.executor.submit(self._fetch_block, osm_type, id_versions)
+            for osm_id, prev_version in id_versions:
+                self._pending[("latest", osm_type, osm_id)] = future
+                if prev_version > 0:
+                    self._pending[(osm_type, osm_id, prev_version)] = future
+        return entries
+
+    def _discard(self, keys):
+        """
+        Forget downloads which have not been used by the revert implementation.
+        """
+        for key in keys:
+            self._pending.pop(key, None)
+
+    def _take(self, key):
+        future = self._pending.pop(key, None)
+        if future is None:
+            return None
+        return future.result().get(key)
+
+    def prefetch(self, groups):
+        """
+        Start downloading the objects of the upcoming groups while the groups are processed.
+
+        Args:
+            groups (iterable): lists of versions of the same object
+
+        Yields:
+            list: the groups in the order they were provided
+        """
+        if self.executor is None:
+            yield from groups
+            return
+        window = collections.deque()
+        block = []
+        for objects in groups:
+            block.append(objects)
+            if len(block) >= self.block_size:
+                window.extend(self._submit(block))
+                block = []
+            while len(window) > self.lookahead:
+                objects, keys = window.popleft()
+                yield objects
+                self._discard(keys)
+        if block:
+            window.extend(self._submit(block))
+        while window:
+            objects, keys = window.popleft()
+            yield objects
+            self._discard(keys)
+
+    def get_version(self, osm_type, osm_id, version, fallback_if_redacted=True):
+        result = self._take((osm_type, osm_id, version))
+        if result is not None and (fallback_if_redacted or result[0] != OsmApiResponse.REDACTED_FALLBACK):
+            return result
+        return self.client.get_version(osm_type, osm_id, version, fallback_if_redacted)
+
+    def get_latest_version(self, osm_type, osm_id):
+        result = self._take(("latest", osm_type, osm_id))
+        if result is not None:
+            return result
+        return self.client.get_latest_version(osm_type, osm_id)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        self._pending = {}
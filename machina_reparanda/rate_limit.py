@@ -0,0 +1,254 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+
+THROTTLE_STATUS_CODES = {429, 509} #: HTTP status codes telling the client to slow down
+RETRY_STATUS_CODES = THROTTLE_STATUS_CODES | {500, 502, 503, 504} #: HTTP status codes of transient errors
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket which limits the rate of requests.
+
+    Args:
+        rate (float): number of requests per second, 0 disables the limit
+        burst (int): maximum number of requests which can be sent at once after a pause
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def try_acquire(self):
+        """
+        Take a token if one is available.
+
+        Returns:
+            float: 0 if a request may be sent now, otherwise the number of seconds to wait before
+            trying again
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """
+        Block until a request may be sent.
+        """
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    Token bucket which slows down if the server asks for it.
+
+    If a request is throttled, the rate is halved (but not below min_rate) and no request is sent
+    until the delay requested by the server has passed. Every successful request increases the rate
+    by a hundredth of the configured rate until it is reached again.
+
+    Args:
+        rate (float): maximum number of requests per second, 0 disables the limit
+        burst (int): maximum number of requests which can be sent at once after a pause
+        min_rate (float): lower limit of the rate after throttling
+    """
+
+    def __init__(self, rate, burst=1, min_rate=0.1):
+        super().__init__(rate, burst)
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.paused_until = 0.0
+
+    def try_acquire(self):
+        with self._lock:
+            wait = self.paused_until - time.monotonic()
+        if wait > 0:
+            return wait
+        return super().try_acquire()
+
+    def throttled(self, delay):
+        """
+        Slow down after the server rejected a request because too many requests were sent.
+
+        Args:
+            delay (float): number of seconds to send no requests at all
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + delay)
+            if self.max_rate > 0:
+                self._refill(now)
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = 0
+        logging.warning("Server throttled requests, pausing for {:.1f} s, rate limit is {:.2f} requests/s now".format(delay, self.rate))
+
+    def succeeded(self):
+        """
+        Speed up again after a successful request.
+        """
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+
+class HostRateLimiter:
+    """
+    Adaptive token buckets with the same rate for every host.
+    """
+
+    def __init__(self, rate, burst=1, min_rate=0.1):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self._lock:
+            if host not in self.buckets:
+                self.buckets[host] = AdaptiveTokenBucket(self.rate, self.burst, self.min_rate)
+            return self.buckets[host]
+
+    def acquire(self, url):
+        self.bucket(url).acquire()
+
+    def try_acquire(self, url):
+        return self.bucket(url).try_acquire()
+
+    def throttled(self, url, delay):
+        self.bucket(url).throttled(delay)
+
+    def succeeded(self, url):
+        self.bucket(url).succeeded()
+
+
+def backoff_delay(attempt, base=1.0, maximum=300.0, retry_after=None):
+    """
+    Get the time to wait before the next attempt of a failed request.
+
+    The delay grows exponentially with the number of attempts and is randomised (full jitter) to
+    avoid that many clients retry at the same time. A delay requested by the server with a
+    Retry-After header takes precedence.
+
+    Args:
+        attempt (int): number of failed attempts so far (starting at 1)
+        base (float): delay after the first attempt in seconds
+        maximum (float): upper limit of the delay in seconds
+        retry_after (float): delay requested by the server or None
+
+    Returns:
+        float: delay in seconds
+    """
+    if retry_after is not None:
+        return min(maximum, retry_after)
+    return random.uniform(0, min(maximum, base * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value):
+    """
+    Parse the value of a Retry-After header given in seconds.
+
+    Returns:
+        float: number of seconds or None if the header is missing or invalid
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def send_with_retry(send, url, rate_limiter, max_retries=5, retry_status_codes=RETRY_STATUS_CODES,
+                    retry_exceptions=(requests.exceptions.Timeout, requests.exceptions.ConnectionError),
+                    base_delay=1.0, on_retry=None):
+    """
+    Send a request respecting the rate limit and retry it if it fails temporarily.
+
+    Responses with a status code in THROTTLE_STATUS_CODES slow down the rate limiter of the host.
+    Retries are delayed by jittered exponential backoff or by the Retry-After header of the
+    response.
+
+    Args:
+        send (callable): function without arguments which sends the request and returns the
+            requests.Response
+        url (str): URL of the request, used to select the rate limit of the host
+        rate_limiter (HostRateLimiter): rate limiter
+        max_retries (int): maximum number of retries
+        retry_status_codes (set of int): status codes to retry the request on
+        retry_exceptions (tuple): exceptions to retry the request on
+        base_delay (float): delay before the first retry if the server did not request one
+        on_retry (callable): function without arguments called before every retry
+
+    Returns:
+        requests.Response: the response of the last attempt
+
+    Raises:
+        Exceptions of the last attempt
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        rate_limiter.acquire(url)
+        try:
+            response = send()
+        except retry_exceptions as err:
+            if attempt > max_retries:
+                raise
+            delay = backoff_delay(attempt, base_delay)
+            logging.warning("Request to {} failed ({}), retrying in {:.1f} s".format(url, err, delay))
+        else:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            delay = backoff_delay(attempt, base_delay, retry_after=retry_after)
+            if response.status_code in THROTTLE_STATUS_CODES:
+                rate_limiter.throttled(url, delay)
+            elif response.status_code < 500:
+                rate_limiter.succeeded(url)
+            if response.status_code not in retry_status_codes or attempt > max_retries:
+                return response
+            logging.warning("Request to {} failed with HTTP status {}, retrying in {:.1f} s".format(url, response.status_code, delay))
+        if on_retry is not None:
+            on_retry()
+        time.sleep(delay)
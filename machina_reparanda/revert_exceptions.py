@@ -34,4 +34,4 @@ class ProgrammingError(RuntimeError):
     def __init__(self, msg=None):
         if msg is None:
             msg = "Unknown programming error"
-        super(OSMException, self).__init__(msg)
+        super(ProgrammingError, self).__init__(msg)
@@ -0,0 +1,193 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import copy
+import glob
+import logging
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from .async_worker import AsyncWorker
+from .http_session import HttpSession
+from .instrumentation import Metrics
+from .journal import Journal
+from .osh_history import HistoryFile
+from .sort_functions import group_by_type_id
+from .sorted_input import read_run
+from .update_writer import OsmApiUploader
+from .worker import Worker
+
+
+def shard_path(path, index):
+    """
+    Get the path of the file (journal, osmChange output, metrics) of a shard.
+    """
+    if path is None:
+        return None
+    return "{}.shard{}".format(path, index)
+
+
+def existing_shard_paths(path):
+    """
+    Get the paths of the existing files of all shards (see shard_path()).
+    """
+    return sorted(glob.glob("{}.shard[0-9]*".format(glob.escape(path))))
+
+
+def shard_configuration(configuration, index, count):
+    """
+    Get the configuration of a shard. Every shard writes its own files and uses its own
+    changesets. The reverted changesets are commented on by the coordinator.
+
+    Every shard has its own rate limiter. The configured request rate is divided by the number of
+    shards, i.e. all shards together do not send more requests than a single process would.
+
+    Args:
+        configuration (Configuration): configuration of the whole revert
+        index (int): number of the shard
+        count (int): number of shards running at the same time
+    """
+    result = copy.copy(configuration)
+    result.http_rate = configuration.http_rate / count
+    result.http_min_rate = configuration.http_min_rate / count
+    result.journal_path = shard_path(configuration.journal_path, index)
+    result.osc_output = shard_path(configuration.osc_output, index)
+    result.metrics_file = shard_path(configuration.metrics_file, index)
+    result.comment_reverted = False
+    if index > 0:
+        # two processes cannot upload into the same changeset in order
+        result.reuse_changeset = 0
+    return result
+
+
+def run_shard(configuration, path, index):
+    """
+    Revert the objects of one shard. This function is executed by the worker processes of
+    ShardCoordinator.
+
+    Returns:
+        set: IDs of the reverted changesets
+        set: IDs of the changesets used for the upload
+        dict: histograms of the metrics of the shard indexed by (category, name)
+    """
+    worker_class = AsyncWorker if configuration.async_io else Worker
+    worker = worker_class(read_run(path), configuration)
+    worker.work()
+    logging.info("Shard {}: {} objects, {} dropped by the prefilter".format(index, worker.group_count, worker.filtered_count))
+    return worker.reverted_changesets, worker.uploader.used_changesets, worker.metrics.histograms
+
+
+def write_partitions(objects, count, directory):
+    """
+    Split a sorted stream of objects into count files with contiguous type/ID ranges of roughly
+    the same number of objects. All versions of an object end up in the same file.
+
+    Returns:
+        list: paths of the files, one per non-empty partition
+    """
+    spool_path = os.path.join(directory, "input.pickle")
+    group_count = 0
+    with open(spool_path, "wb") as spool:
+        for group in group_by_type_id(objects):
+            pickle.dump(group, spool, pickle.HIGHEST_PROTOCOL)
+            group_count += 1
+    groups_per_partition = max(1, -(-group_count // count))
+    paths = []
+    partition = None
+    for i, group in enumerate(read_run(spool_path)):
+        if i % groups_per_partition == 0:
+            if partition is not None:
+                partition.close()
+            paths.append(os.path.join(directory, "shard{}.pickle".format(len(paths))))
+            partition = open(paths[-1], "wb")
+        for obj in group:
+            pickle.dump(obj, partition, pickle.HIGHEST_PROTOCOL)
+    if partition is not None:
+        partition.close()
+    os.remove(spool_path)
+    logging.info("Split {} objects into {} shards".format(group_count, len(paths)))
+    return paths
+
+
+class ShardCoordinator:
+    """
+    Revert the input in ``shards`` processes which work on disjoint ranges of type/ID groups.
+
+    Every shard runs its own Worker with its own API client and connection pool and uploads into
+    its own changesets. The configured request rate is shared equally by the shards. Journals, osmChange output and metrics files of the shards get the suffix
+    ``.shard<N>``. After all shards have finished, the coordinator posts one comment to every
+    reverted changeset which lists the changesets of all shards. The metrics of all shards are
+    added to the metrics of the coordinator which are reported like those of a single Worker.
+
+    Args:
+        configuration (Configuration): configuration
+        shards (int): number of processes
+        tmp_dir (str): directory for the partitions of the input, the system default is used if
+            None
+        metrics (Metrics): metrics of the whole revert
+    """
+
+    def __init__(self, configuration, shards, tmp_dir=None, metrics=None):
+        self.configuration = configuration
+        self.shards = shards
+        self.tmp_dir = tmp_dir
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.reverted_changesets = set() #: IDs of the changesets reverted by all shards
+        self.used_changesets = set() #: IDs of the changesets uploaded by all shards
+
+    def prepare(self):
+        """
+        Do the work which must not be done by all shards at the same time.
+        """
+        if self.configuration.history_file is not None:
+            history_index = self.configuration.history_index
+            HistoryFile(os.path.expanduser(self.configuration.history_file), os.path.expanduser(history_index) if history_index is not None else None).close()
+
+    def work(self, objects):
+        """
+        Revert a sorted stream of objects.
+        """
+        self.prepare()
+        with tempfile.TemporaryDirectory(prefix="machina_reparanda_", dir=self.tmp_dir) as directory:
+            paths = write_partitions(objects, self.shards, directory)
+            with ProcessPoolExecutor(max_workers=len(paths) or 1) as executor:
+                futures = [executor.submit(run_shard, shard_configuration(self.configuration, i, len(paths)), path, i) for i, path in enumerate(paths)]
+                for future in futures:
+                    reverted_changesets, used_changesets, histograms = future.result()
+                    self.reverted_changesets |= reverted_changesets
+                    self.used_changesets |= used_changesets
+                    self.metrics.merge(histograms)
+        logging.info("{} shards uploaded {} changesets".format(len(paths), len(self.used_changesets)))
+        if self.configuration.comment_reverted and self.configuration.osc_output is None:
+            self.comment_reverted_changesets()
+        logging.info("Timing of all shards:\n{}".format(self.metrics.table()))
+        if self.configuration.metrics_file is not None:
+            self.metrics.write(os.path.expanduser(self.configuration.metrics_file))
+
+    def comment_reverted_changesets(self):
+        journal = None
+        if self.configuration.journal_path is not None:
+            journal = Journal(os.path.expanduser(self.configuration.journal_path), self.configuration.resume)
+        uploader = OsmApiUploader(self.configuration, HttpSession(self.configuration), journal)
+        uploader.used_changesets = self.used_changesets
+        uploader.comment_reverted_changesets(self.reverted_changesets)
+        if journal is not None:
+            journal.close()
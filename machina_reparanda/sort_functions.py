@@ -31,6 +31,13 @@ def type_to_int(osm_object):
     return 4
 
 
+def type_id_version(osm_object):
+    """
+    Sort key which orders OSM objects by type, ID and version.
+    """
+    return (type_to_int(osm_object), osm_object.id, osm_object.version)
+
+
 def equal_type_id(lhs, rhs):
     return type_to_int(lhs) == type_to_int(rhs) and lhs.id == rhs.id
 
@@ -44,3 +51,23 @@ def obj_to_str(osm_object):
     if type_id == 3:
         return "relation"
     raise OSMException("unknown type {}\n".format(str(type(osm_object))))
+
+
+def group_by_type_id(objects):
+    """
+    Split a sorted sequence of OSM objects into lists of objects with equal type and ID.
+
+    Args:
+        objects (iterable): OSM objects sorted by type, ID and version
+
+    Yields:
+        list: all versions of one object
+    """
+    group = []
+    for obj in objects:
+        if group and not equal_type_id(group[0], obj):
+            yield group
+            group = []
+        group.append(obj)
+    if group:
+        yield group
@@ -0,0 +1,173 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import heapq
+import logging
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from .input_handler import InputHandler
+from .sort_functions import type_id_version
+
+
+def write_run(objects, path):
+    """
+    Write a sorted list of objects to a run file.
+    """
+    with open(path, "wb") as run_file:
+        for obj in objects:
+            pickle.dump(obj, run_file, pickle.HIGHEST_PROTOCOL)
+
+
+def read_run(path):
+    """
+    Read the objects of a run file one by one.
+    """
+    with open(path, "rb") as run_file:
+        while True:
+            try:
+                yield pickle.load(run_file)
+            except EOFError:
+                return
+
+
+class RunBuffer:
+    """
+    List-like buffer for InputHandler which spills its content as sorted run to a temporary file
+    whenever it contains run_size objects.
+    """
+
+    def __init__(self, run_size, directory, prefix="run"):
+        self.run_size = run_size
+        self.directory = directory
+        self.prefix = prefix
+        self.objects = []
+        self.runs = [] #: paths of the run files written so far
+
+    def append(self, obj):
+        self.objects.append(obj)
+        if len(self.objects) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        if len(self.objects) == 0:
+            return
+        self.objects.sort(key=type_id_version)
+        path = os.path.join(self.directory, "{}_{}.pickle".format(self.prefix, len(self.runs)))
+        logging.debug("Writing {} objects to {}".format(len(self.objects), path))
+        write_run(self.objects, path)
+        self.runs.append(path)
+        self.objects = []
+
+
+def parse_to_runs(filenames, run_size, directory, prefix):
+    """
+    Read OSC files and write their objects to sorted run files.
+
+    This function is executed by the worker processes of ExternalSorter.
+
+    Returns:
+        list: paths of the run files
+    """
+    buffer = RunBuffer(run_size, directory, prefix)
+    input_handler = InputHandler(buffer)
+    for filename in filenames:
+        input_handler.apply_file(filename)
+    buffer.spill()
+    return buffer.runs
+
+
+def split_by_size(filenames, count):
+    """
+    Distribute files to count lists of roughly equal total file size.
+    """
+    batches = [[] for i in range(count)]
+    sizes = [0] * count
+    for filename in sorted(filenames, key=os.path.getsize, reverse=True):
+        i = sizes.index(min(sizes))
+        batches[i].append(filename)
+        sizes[i] += os.path.getsize(filename)
+    return [b for b in batches if b]
+
+
+class ExternalSorter:
+    """
+    Sort the objects of many OSC files by type, ID and version with bounded memory usage.
+
+    At most run_size objects are kept in memory while the files are read. If there are more
+    objects, they are written to temporary files in sorted runs which are merged while the sorted
+    objects are consumed. Inputs smaller than run_size are sorted in memory.
+
+    Args:
+        run_size (int): maximum number of objects kept in memory
+        tmp_dir (str): directory for the temporary files, the system default is used if None
+    """
+
+    def __init__(self, run_size, tmp_dir=None):
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix="machina_reparanda_", dir=tmp_dir)
+        self.buffer = RunBuffer(run_size, self.tmp_dir.name)
+
+    def add_files(self, filenames, workers=1):
+        """
+        Read OSC files.
+
+        Args:
+            filenames (list of str): paths of the files
+            workers (int): number of processes to parse the files with. If it is greater than 1,
+                every process reads a share of the files and writes them to sorted runs which are
+                merged later.
+        """
+        if workers <= 1:
+            input_handler = InputHandler(self.buffer)
+            for filename in filenames:
+                logging.debug("Reading {}".format(filename))
+                input_handler.apply_file(filename)
+            return
+        # several batches per process to balance the load
+        batches = split_by_size(filenames, workers * 4)
+        first_batch = len(self.buffer.runs)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(parse_to_runs, batch, self.buffer.run_size, self.tmp_dir.name, "batch{}".format(first_batch + i)) for i, batch in enumerate(batches)]
+            for future in futures:
+                self.buffer.runs.extend(future.result())
+        logging.debug("{} processes read {} files into {} runs".format(workers, len(filenames), len(self.buffer.runs)))
+
+    def sorted_objects(self):
+        """
+        Get all objects sorted by type, ID and version.
+
+        The temporary files are removed after the last object has been returned.
+
+        Yields:
+            osmium.osm.mutable.OSMObject
+        """
+        try:
+            if len(self.buffer.runs) == 0:
+                self.buffer.objects.sort(key=type_id_version)
+                objects = self.buffer.objects
+                self.buffer.objects = []
+                yield from objects
+                return
+            self.buffer.spill()
+            logging.info("Merging {} sorted runs ...".format(len(self.buffer.runs)))
+            yield from heapq.merge(*[read_run(path) for path in self.buffer.runs], key=type_id_version)
+        finally:
+            self.tmp_dir.cleanup()
@@ -0,0 +1,121 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+
+
+class TagDiff:
+    """
+    Differences of the keys of interest between two tag lists.
+    """
+
+    __slots__ = ("removed", "changed", "added")
+
+    def __init__(self):
+        self.removed = {} #: old values of keys which are missing in the new tag list
+        self.changed = {} #: tuples of old and new value indexed by key
+        self.added = {} #: values of keys which are missing in the old tag list
+
+    def __bool__(self):
+        return bool(self.removed or self.changed or self.added)
+
+    def __repr__(self):
+        return "TagDiff(removed={}, changed={}, added={})".format(self.removed, self.changed, self.added)
+
+
+class TagRuleSet:
+    """
+    Declarative description of the keys a revert implementation is interested in.
+
+    A key is of interest if it is one of ``keys``, starts with one of ``prefixes`` or fully
+    matches one of the regular expressions in ``patterns``. Prefixes and patterns are compiled into
+    a single regular expression once. Whether a key matches is remembered, i.e. every distinct key
+    is matched only once.
+
+    Args:
+        keys (iterable of str): keys matched exactly
+        prefixes (iterable of str): prefixes of keys, e.g. ``wikipedia:``
+        patterns (iterable of str): regular expressions matching the whole key
+    """
+
+    MAX_MEMO_SIZE = 100000 #: number of keys whose result is remembered
+
+    def __init__(self, keys=(), prefixes=(), patterns=()):
+        self.keys = frozenset(keys)
+        alternatives = ["{}.*".format(re.escape(prefix)) for prefix in sorted(set(prefixes))]
+        alternatives.extend("(?:{})".format(pattern) for pattern in patterns)
+        self.regex = re.compile("|".join(alternatives), re.DOTALL) if alternatives else None
+        self._memo = {}
+
+    @classmethod
+    def from_config(cls, rules):
+        """
+        Create a rule set from a dictionary with the optional entries ``keys``, ``prefixes`` and
+        ``patterns``, e.g. the value of ``tag_rules`` in the configuration file.
+        """
+        return cls(rules.get("keys", ()), rules.get("prefixes", ()), rules.get("patterns", ()))
+
+    def matches(self, key):
+        """
+        Check if a key is of interest.
+        """
+        result = self._memo.get(key)
+        if result is None:
+            result = key in self.keys or (self.regex is not None and self.regex.fullmatch(key) is not None)
+            if len(self._memo) >= self.MAX_MEMO_SIZE:
+                self._memo.clear()
+            self._memo[key] = result
+        return result
+
+    def select(self, tags):
+        """
+        Get the tags whose keys are of interest.
+
+        Args:
+            tags (MutableTagList): tags of an object
+
+        Returns:
+            dict: values indexed by key
+        """
+        return {k: v for k, v in tags.items() if self.matches(k)}
+
+    def diff(self, old_tags, new_tags):
+        """
+        Compare the keys of interest of two tag lists.
+
+        Args:
+            old_tags (MutableTagList): tags of the older version
+            new_tags (MutableTagList): tags of the newer version
+
+        Returns:
+            TagDiff: removed, changed and added keys of interest
+        """
+        result = TagDiff()
+        for k, v in old_tags.items():
+            if not self.matches(k):
+                continue
+            new_value = new_tags.get(k)
+            if new_value is None:
+                result.removed[k] = v
+            elif new_value != v:
+                result.changed[k] = (v, new_value)
+        for k, v in new_tags.items():
+            if k not in old_tags and self.matches(k):
+                result.added[k] = v
+        return result
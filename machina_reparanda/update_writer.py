@@ -18,19 +18,30 @@ along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import logging
-import requests
+import re
+import xml.etree.ElementTree as ElementTree
+from .http_session import HttpSession
 from .sort_functions import type_to_int, obj_to_str
 from .osm_xml_builder import OsmXmlBuilder
 
 
+def log_document(data):
+    """
+    Log an XML document built by OsmXmlBuilder. It is only decoded if debug messages are enabled.
+    """
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(data.decode("utf-8"))
+
+
 class OsmApiUploader():
-    def __init__(self, configuration):
+    def __init__(self, configuration, session=None, journal=None):
         self.user = configuration.user #: user to be used for upload
         self.password = configuration.password #: password to be used for upload
         self.comment = configuration.comment #: changeset comment to be used for upload
         self.api_url = configuration.api_url #: API endpoint to be used for upload
         self.dryrun = configuration.dryrun
         self.xml_builder = OsmXmlBuilder(configuration) #: instance of OsmXmlBuilder class
+        self.session = session if session is not None else HttpSession(configuration) #: instance of HttpSession
         self.changeset = 0 #: ID of currently open changeset
         self.used_changesets = set() #: IDs of changesets used by this instance
         self.object_count = 0 #: number of objects written to this changeset
@@ -39,37 +50,128 @@ class OsmApiUploader():
         self.headers_comments = {"User-Agent": configuration.user_agent, "Content-type": "application/x-www-form-urlencoded"} #: HTTP headers for changeset discussions API
         #TODO retriev size limit of changesets from the API capabilities
         self.max_object_count = 9999 #: maximum number of objects to be written into one changeset
+        self.upload_mode = configuration.upload_mode #: "single" (one PUT per object) or "diff" (osmChange uploads)
+        self.diff_upload_size = configuration.diff_upload_size #: number of objects per osmChange upload
+        self.pending = [] #: objects waiting for the next osmChange upload
+        self.uploaded_versions = {} #: new versions of uploaded objects indexed by (type, ID)
+        self.object_changesets = {} #: changesets reverted by objects not confirmed yet, indexed by (type, ID)
+        self.journal = journal #: instance of Journal or None
+        self.upload_listeners = [] #: functions called with type, ID and new version of every uploaded object
         if configuration.reuse_changeset > 0:
             self.changeset = configuration.reuse_changeset
             self.xml_builder.set_changeset(configuration.reuse_changeset)
+        elif journal is not None:
+            self.restore_from_journal()
+
+    def restore_from_journal(self):
+        """
+        Continue in the changeset which was open when the journal was written the last time.
+        """
+        self.used_changesets = set(self.journal.closed_changesets)
+        open_changeset = self.journal.open_changeset()
+        if open_changeset == 0:
+            return
+        logging.info("Continuing in changeset {}".format(open_changeset))
+        self.changeset = open_changeset
+        self.xml_builder.set_changeset(open_changeset)
+        self.object_count = self.journal.changeset_objects.get(open_changeset, 0)
+        self.reverted_changesets = set(self.journal.changeset_reverted.get(open_changeset, set()))
+
+    def confirm_uploads(self, uploads):
+        """
+        Record the new versions of successfully uploaded objects.
+
+        Args:
+            uploads (list of tuple): (type, ID, new version) of every uploaded object
+        """
+        records = []
+        for osm_type, osm_id, version in uploads:
+            self.uploaded_versions[(osm_type, osm_id)] = version
+            for listener in self.upload_listeners:
+                listener(osm_type, osm_id, version)
+            changesets = self.object_changesets.pop((osm_type, osm_id), set())
+            records.append((osm_type, osm_id, version, self.changeset, changesets))
+        if self.journal is not None and records:
+            self.journal.uploaded(records)
+
+    def upload_failed(self, osm_type, osm_id, reason):
+        self.object_changesets.pop((osm_type, osm_id), None)
+        if self.journal is not None:
+            self.journal.failed_upload(osm_type, osm_id, reason)
 
     def open_changeset(self):
-        xml = self.xml_builder.changeset(self.comment)
-        logging.debug(xml)
+        data = self.xml_builder.changeset(self.comment)
+        log_document(data)
         url = "{}/changeset/create".format(self.api_url)
-        data = xml.encode("utf-8")
         headers = self.headers.copy()
         headers["Content-Length"] = str(len(data))
-        r = requests.put(url, headers=headers, data=data, auth=(self.user, self.password), allow_redirects=True)
+        r = self.session.put(url, headers=headers, data=data, auth=(self.user, self.password), allow_redirects=True)
         logging.debug("PUT {} {}".format(url, r.status_code))
         if r.status_code == 200:
             self.changeset = int(r.text)
             logging.info("Changeset ID is {}".format(self.changeset))
             self.xml_builder.set_changeset(self.changeset)
+            if self.journal is not None:
+                self.journal.changeset_opened(self.changeset)
         elif r.status_code == 400:
             logging.critical("Programming ERROR: {}".format(r.text))
             exit(1)
         else:
             logging.error("Other ERROR: {}".format(r.text))
 
-    def put_object(self, osm_type, osm_id, xml):
-        logging.debug(xml)
+    def changeset_closed_by_api(self, response):
+        """
+        Check if a request failed because the API closed the changeset, e.g. because it was open
+        for too long.
+        """
+        return response.status_code == 409 and re.search(r"[Cc]hangeset [0-9]+ was closed", response.text) is not None
+
+    def replace_closed_changeset(self, remaining):
+        """
+        Open a new changeset after the API closed the current one.
+
+        Args:
+            remaining (list of tuple): (type, ID) of the objects which will be uploaded into the
+                new changeset
+
+        Returns:
+            bool: True if a new changeset has been opened
+        """
+        closed_changeset = self.changeset
+        logging.warning("Changeset {} has been closed by the API, opening a new one".format(closed_changeset))
+        self.used_changesets.add(closed_changeset)
+        if self.journal is not None:
+            self.journal.changeset_closed(closed_changeset)
+        # the remaining objects are the only content of the new changeset
+        self.object_count = len(remaining)
+        self.reverted_changesets = set()
+        for key in remaining:
+            self.reverted_changesets |= self.object_changesets.get(key, set())
+        self.open_changeset()
+        return self.changeset != closed_changeset
+
+    def put_object(self, osm_type, osm_id, data, retry_if_closed=False):
+        """
+        Upload a new version of an object with its own request.
+
+        Args:
+            osm_type (str): object type
+            osm_id (int): object ID
+            data (bytes): OSM XML document containing the object
+            retry_if_closed (bool): do not record a failure if the changeset was closed by the API
+                and a new one has been opened
+
+        Returns:
+            bool: True if the object has to be uploaded again into the new changeset
+        """
+        log_document(data)
         url = "{}/{}/{}".format(self.api_url, osm_type, osm_id)
-        data = xml.encode("utf-8")
         headers = self.headers.copy()
         headers["Content-Length"] = str(len(data))
-        r = requests.put(url, headers=headers, data=data, auth=(self.user, self.password))
+        r = self.session.put(url, headers=headers, data=data, auth=(self.user, self.password))
         logging.debug("PUT {} {}".format(url, r.status_code))
+        if retry_if_closed and self.changeset_closed_by_api(r) and self.replace_closed_changeset([(osm_type, osm_id)]):
+            return True
         if r.status_code == 400:
             logging.error("Programming ERROR (Bad Request): {}".format(r.text))
         elif r.status_code == 404:
@@ -80,18 +182,113 @@ class OsmApiUploader():
             logging.error("CONFLICT: {}".format(r.text))
         elif r.status_code != 200:
             logging.error("Other ERROR: {}".format(r.text))
+        if r.status_code == 200:
+            self.confirm_uploads([(osm_type, osm_id, int(r.text))])
+        else:
+            self.upload_failed(osm_type, osm_id, r.text)
+        return False
+
+    def find_element_in_error(self, message, objects):
+        """
+        Find the object an error message of the diff upload API refers to.
+
+        Args:
+            message (str): body of the error response, e.g.
+                "Version mismatch: Provided 2, server had: 3 of Node 1234"
+            objects (list): objects of the failed upload
+
+        Returns:
+            int: index of the object in objects or None
+        """
+        match = re.search(r"(Node|Way|Relation) (-?[0-9]+)", message)
+        if match is None:
+            return None
+        osm_type = match.group(1).lower()
+        osm_id = int(match.group(2))
+        for i, obj in enumerate(objects):
+            if obj_to_str(obj) == osm_type and obj.id == osm_id:
+                return i
+        return None
+
+    def parse_diff_result(self, data):
+        """
+        Read the new versions of the uploaded objects from a diffResult document.
+        """
+        root = ElementTree.fromstring(data)
+        uploads = []
+        for element in root:
+            if element.get("new_version") is not None:
+                uploads.append((element.tag, int(element.get("old_id")), int(element.get("new_version"))))
+        self.confirm_uploads(uploads)
+
+    def upload_diff(self):
+        """
+        Upload all pending objects as osmChange documents.
+
+        The API rejects an upload completely if one of the objects cannot be applied, e.g. due to a
+        version conflict, and names this object in the error message. This object is dropped and
+        the remaining objects are split into two halves which are uploaded separately. Each
+        further conflict only causes the upload of its half again, i.e. k conflicts among n
+        objects cost O(k log n) instead of k uploads of all objects.
+        """
+        # stack of batches still to be uploaded
+        batches = [self.pending] if self.pending else []
+        self.pending = []
+        while batches:
+            batch = batches.pop()
+            url = "{}/changeset/{}/upload".format(self.api_url, self.changeset)
+            data = self.xml_builder.osm_change(batch)
+            log_document(data)
+            headers = self.headers.copy()
+            headers["Content-Length"] = str(len(data))
+            r = self.session.post(url, headers=headers, data=data, auth=(self.user, self.password))
+            logging.debug("POST {} {} ({} objects)".format(url, r.status_code, len(batch)))
+            if r.status_code == 200:
+                self.parse_diff_result(r.content)
+                continue
+            if self.changeset_closed_by_api(r):
+                remaining = [(obj_to_str(obj), obj.id) for b in batches + [batch] for obj in b]
+                if self.replace_closed_changeset(remaining):
+                    batches.append(batch)
+                    continue
+            index = self.find_element_in_error(r.text, batch)
+            if index is None:
+                logging.error("Upload of {} objects failed with status {}: {}".format(len(batch), r.status_code, r.text))
+                for obj in batch:
+                    self.upload_failed(obj_to_str(obj), obj.id, r.text)
+                continue
+            obj = batch.pop(index)
+            self.upload_failed(obj_to_str(obj), obj.id, r.text)
+            if r.status_code == 409:
+                logging.error("CONFLICT on {} {}: {}".format(obj_to_str(obj), obj.id, r.text))
+            elif r.status_code == 412:
+                logging.error("PRECONDITION FAILED on {} {}: {}".format(obj_to_str(obj), obj.id, r.text))
+            else:
+                logging.error("Other ERROR on {} {}: {}".format(obj_to_str(obj), obj.id, r.text))
+            if len(batch) > 1:
+                middle = len(batch) // 2
+                # the first half is uploaded first
+                batches.append(batch[middle:])
+                batches.append(batch[:middle])
+            elif batch:
+                batches.append(batch)
+
+    def put_new_version(self, osm_type, obj, build_xml):
+        """
+        Upload a new version of an object with its own request. If the API closed the changeset,
+        the object is uploaded again into a new one.
+        """
+        if self.put_object(osm_type, obj.id, build_xml(obj), retry_if_closed=True):
+            self.put_object(osm_type, obj.id, build_xml(obj))
 
     def update_node(self, node):
-        xml = self.xml_builder.node(node)
-        self.put_object("node", node.id, xml)
+        self.put_new_version("node", node, self.xml_builder.node)
 
     def update_way(self, way):
-        xml = self.xml_builder.way(way)
-        self.put_object("way", way.id, xml)
+        self.put_new_version("way", way, self.xml_builder.way)
 
     def update_relation(self, relation):
-        xml = self.xml_builder.relation(relation)
-        self.put_object("relation", relation.id, xml)
+        self.put_new_version("relation", relation, self.xml_builder.relation)
 
     def handle_object(self, new_object, changesets):
         if new_object is None:
@@ -108,7 +305,13 @@ class OsmApiUploader():
             self.open_changeset()
         for cs in changesets:
             self.reverted_changesets.add(cs)
-        if type_to_int(new_object) == 1:
+        self.object_changesets[(obj_to_str(new_object), new_object.id)] = set(changesets)
+        self.object_count += 1
+        if self.upload_mode == "diff":
+            self.pending.append(new_object)
+            if len(self.pending) >= self.diff_upload_size:
+                self.upload_diff()
+        elif type_to_int(new_object) == 1:
             self.update_node(new_object)
         elif type_to_int(new_object) == 2:
             self.update_way(new_object)
@@ -130,9 +333,28 @@ class OsmApiUploader():
             return
         payload = {"text": comment}
         url = "{}/changeset/{}/comment".format(self.api_url, cs_id)
-        r = requests.post(url, data=payload, headers=self.headers_comments, auth=(self.user, self.password))
+        r = self.session.post(url, data=payload, headers=self.headers_comments, auth=(self.user, self.password))
         logging.debug("POST comment on {} {}".format(url, r.status_code))
         logging.debug(r.text)
+        if r.status_code == 200 and self.journal is not None:
+            self.journal.comment_posted(cs_id)
+
+    def comment_reverted_changesets(self, changesets):
+        """
+        Post a comment to all reverted changesets which links the changesets used by this instance.
+
+        Changesets already commented according to the journal are skipped.
+
+        Args:
+            changesets (set of int): IDs of the reverted changesets
+        """
+        text = "This changeset has been reverted fully or in part by one or multiple of the following changesets: "
+        text += ", ".join(str(cs_id) for cs_id in sorted(self.used_changesets))
+        text += "\n\nThe reason for the revert is: {}".format(self.comment)
+        for cs_id in sorted(changesets):
+            if self.journal is not None and cs_id in self.journal.commented:
+                continue
+            self.comment_changeset(cs_id, text)
 
     def make_changeset_comment_text(self):
         text = "This changeset reverts some or all edits made in the following changeset: "
@@ -143,9 +365,10 @@ class OsmApiUploader():
     def close_changeset(self):
         if self.changeset == 0 or self.dryrun:
             return
+        self.upload_diff()
         url = "{}/changeset/{}/close".format(self.api_url, self.changeset)
+        r = self.session.put(url, headers=self.headers, auth=(self.user, self.password))
         logging.debug("PUT {} {}".format(url, r.status_code))
-        r = requests.put(url, headers=self.headers, auth=(self.user, self.password))
         if r.status_code == 200:
             logging.info("Changeset {} was successfully closed.".format(self.changeset))
             self.xml_builder.set_changeset(self.changeset)
@@ -155,9 +378,12 @@ class OsmApiUploader():
             logging.error("CONFLICT: {}".format(r.text))
         else:
             logging.error("Other ERROR: {}".format(r.text))
+        if self.journal is not None:
+            self.journal.changeset_closed(self.changeset)
         # comment the changeset
         self.comment_changeset(self.changeset, self.make_changeset_comment_text())
         # reset
         self.used_changesets.add(self.changeset)
         self.changeset = 0
+        self.object_count = 0
         self.reverted_changesets = set()
@@ -1,18 +1,27 @@
 import requests
 import sys
 
+from .rate_limit import HostRateLimiter, send_with_retry
+
 api_url = "https://api.openstreetmap.org/api/0.6/"
 date_format = "%Y-%m-%dT%H:%M:%S"
 user_agent = "machina_reparanda"
+download_rate_limiter = HostRateLimiter(2.0)
+
+
+def changeset_download_url(changeset_id, base_url=api_url):
+    """Get the URL of the DIFF file of a changeset.
+    """
+    return "{}changeset/{}/download".format(base_url, changeset_id)
 
 
 def download_changeset(changeset_id):
     """Download a changeset DIFF file from the OSM API.
     """
-    url = "{}changeset/{}/download".format(api_url, changeset_id)
+    url = changeset_download_url(changeset_id)
     sys.stderr.write("fetching OSC file from {} ...".format(url))
     header = {"user-agent": user_agent}
-    r = requests.get("{}changeset/{}/download".format(api_url, changeset_id), timeout=300, stream=True, headers=header)
+    r = send_with_retry(lambda: requests.get(url, timeout=300, stream=True, headers=header), url, download_rate_limiter)
     sys.stderr.write(" {}\n".format(r.status_code))
     r.raise_for_status()
     return r.content
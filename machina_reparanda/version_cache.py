@@ -0,0 +1,169 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import pickle
+import sqlite3
+import threading
+import time
+
+
+class VersionCache:
+    """
+    Persistent cache of object versions stored in an SQLite database.
+
+    A version of an OSM object never changes once it has been uploaded. Therefore versions are
+    cached without expiry and are only evicted (least recently used first) if the total size of the
+    cache exceeds ``max_size`` bytes. Which version is the latest one can change at any time. It is
+    only cached for ``latest_ttl`` seconds; 0 disables caching of the latest version.
+
+    The versions are stored as pickles. Unpickling can execute arbitrary code, i.e. the database
+    file must be trusted.
+
+    Args:
+        path (str): path to the database file
+        max_size (int): maximum size of the cached data in bytes, 0 means unlimited
+        latest_ttl (float): number of seconds the latest version of an object is cached
+    """
+
+    COMMIT_INTERVAL = 100 #: number of modifications after which the changes are committed
+
+    def __init__(self, path, max_size=0, latest_ttl=0):
+        self.max_size = max_size
+        self.latest_ttl = latest_ttl
+        self.hits = 0 #: number of successful lookups
+        self.misses = 0 #: number of failed lookups
+        self.evictions = 0 #: number of versions evicted
+        self._lock = threading.Lock()
+        self._modifications = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS versions (type TEXT, id INTEGER, version INTEGER, data BLOB, size INTEGER, accessed INTEGER, PRIMARY KEY (type, id, version))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS versions_accessed ON versions (accessed)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS latest (type TEXT, id INTEGER, version INTEGER, fetched REAL, PRIMARY KEY (type, id))")
+        self.size, self._clock = self.connection.execute("SELECT COALESCE(SUM(size), 0), COALESCE(MAX(accessed), 0) FROM versions").fetchone()
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _modified(self):
+        self._modifications += 1
+        if self._modifications >= self.COMMIT_INTERVAL:
+            self.connection.commit()
+            self._modifications = 0
+
+    def get(self, osm_type, osm_id, version):
+        """
+        Get a version of an object.
+
+        Returns:
+            osmium.osm.mutable.OSMObject: a fresh copy of the cached object or None
+        """
+        with self._lock:
+            row = self.connection.execute("SELECT data FROM versions WHERE type = ? AND id = ? AND version = ?", (osm_type, osm_id, version)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE versions SET accessed = ? WHERE type = ? AND id = ? AND version = ?", (self._tick(), osm_type, osm_id, version))
+            self._modified()
+        return pickle.loads(row[0])
+
+    def put(self, osm_type, obj):
+        """
+        Add a version of an object to the cache.
+        """
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            old = self.connection.execute("SELECT size FROM versions WHERE type = ? AND id = ? AND version = ?", (osm_type, obj.id, obj.version)).fetchone()
+            if old is not None:
+                return
+            self.connection.execute("INSERT INTO versions (type, id, version, data, size, accessed) VALUES (?, ?, ?, ?, ?, ?)", (osm_type, obj.id, obj.version, data, len(data), self._tick()))
+            self.size += len(data)
+            self._modified()
+            if self.max_size > 0 and self.size > self.max_size:
+                self._evict()
+
+    def put_many(self, osm_type, objects):
+        for obj in objects:
+            self.put(osm_type, obj)
+
+    def _evict(self):
+        """
+        Remove the least recently used versions until the cache is at most 90 % full.
+        """
+        target = self.max_size * 0.9
+        while self.size > target:
+            rows = self.connection.execute("SELECT type, id, version, size FROM versions ORDER BY accessed LIMIT 100").fetchall()
+            if not rows:
+                break
+            for osm_type, osm_id, version, size in rows:
+                self.connection.execute("DELETE FROM versions WHERE type = ? AND id = ? AND version = ?", (osm_type, osm_id, version))
+                self.size -= size
+                self.evictions += 1
+                if self.size <= target:
+                    break
+        self.connection.commit()
+        self._modifications = 0
+
+    def get_latest(self, osm_type, osm_id):
+        """
+        Get the latest version of an object if it has been retrieved less than latest_ttl seconds
+        ago.
+
+        Returns:
+            osmium.osm.mutable.OSMObject: a fresh copy of the cached object or None
+        """
+        if self.latest_ttl <= 0:
+            return None
+        with self._lock:
+            row = self.connection.execute("SELECT version, fetched FROM latest WHERE type = ? AND id = ?", (osm_type, osm_id)).fetchone()
+        if row is None or row[1] + self.latest_ttl < time.time():
+            with self._lock:
+                self.misses += 1
+            return None
+        return self.get(osm_type, osm_id, row[0])
+
+    def put_latest(self, osm_type, obj):
+        """
+        Add the latest version of an object to the cache.
+        """
+        self.put(osm_type, obj)
+        if self.latest_ttl <= 0:
+            return
+        with self._lock:
+            self.connection.execute("INSERT OR REPLACE INTO latest (type, id, version, fetched) VALUES (?, ?, ?, ?)", (osm_type, obj.id, obj.version, time.time()))
+            self._modified()
+
+    def invalidate_latest(self, osm_type, osm_id):
+        """
+        Forget which version of an object is the latest one, e.g. after it has been modified.
+        """
+        with self._lock:
+            self.connection.execute("DELETE FROM latest WHERE type = ? AND id = ?", (osm_type, osm_id))
+            self._modified()
+
+    def close(self):
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def __str__(self):
+        return "{} hits, {} misses, {} evictions, {:.1f} MB cached".format(self.hits, self.misses, self.evictions, self.size / 1024 / 1024)
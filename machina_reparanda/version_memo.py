@@ -0,0 +1,119 @@
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import pickle
+import threading
+
+
+class VersionMemo:
+    """
+    Thread-safe in-memory memo of the object versions retrieved during a run.
+
+    At most ``max_size`` versions are kept, the least recently used ones are evicted first. Which
+    version is the latest one is remembered as long as this version is kept and has not been
+    invalidated, e.g. after the object was uploaded. Revert implementations modify the objects
+    they get, therefore the versions are stored as pickled snapshots and every lookup creates a
+    new object from the snapshot. This is much cheaper than a deep copy.
+
+    Args:
+        max_size (int): maximum number of versions
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0 #: number of successful lookups
+        self.misses = 0 #: number of failed lookups
+        self.evictions = 0 #: number of versions evicted
+        self.invalidations = 0 #: number of latest versions forgotten after an upload
+        self._versions = collections.OrderedDict() #: versions indexed by (type, ID, version)
+        self._latest = {} #: number of the latest version indexed by (type, ID)
+        self._lock = threading.Lock()
+
+    def get(self, osm_type, osm_id, version):
+        """
+        Get a version of an object.
+
+        Returns:
+            osmium.osm.mutable.OSMObject: a new copy of the version or None
+        """
+        with self._lock:
+            snapshot = self._versions.get((osm_type, osm_id, version))
+            if snapshot is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._versions.move_to_end((osm_type, osm_id, version))
+        return pickle.loads(snapshot)
+
+    def get_latest(self, osm_type, osm_id):
+        """
+        Get the latest version of an object. Deleted objects are returned with visible set to
+        False.
+
+        Returns:
+            osmium.osm.mutable.OSMObject: a new copy of the version or None
+        """
+        with self._lock:
+            version = self._latest.get((osm_type, osm_id))
+            snapshot = self._versions.get((osm_type, osm_id, version)) if version is not None else None
+            if snapshot is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._versions.move_to_end((osm_type, osm_id, version))
+        return pickle.loads(snapshot)
+
+    def put(self, osm_type, obj, latest=False):
+        """
+        Remember a version of an object.
+
+        Args:
+            osm_type (str): object type
+            obj (osmium.osm.mutable.OSMObject): the version, a snapshot of it is stored
+            latest (bool): obj is the latest version of the object
+        """
+        if self.max_size <= 0:
+            return
+        snapshot = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            key = (osm_type, obj.id, obj.version)
+            self._versions[key] = snapshot
+            self._versions.move_to_end(key)
+            if latest:
+                self._latest[(osm_type, obj.id)] = obj.version
+            while len(self._versions) > self.max_size:
+                (t, i, v), evicted = self._versions.popitem(last=False)
+                if self._latest.get((t, i)) == v:
+                    del self._latest[(t, i)]
+                self.evictions += 1
+
+    def invalidate_latest(self, osm_type, osm_id):
+        """
+        Forget which version of an object is the latest one.
+        """
+        with self._lock:
+            if self._latest.pop((osm_type, osm_id), None) is not None:
+                self.invalidations += 1
+
+    def __len__(self):
+        return len(self._versions)
+
+    def __str__(self):
+        return "{} hits, {} misses, {} evictions, {} invalidations, {} versions kept".format(self.hits, self.misses, self.evictions, self.invalidations, len(self._versions))
@@ -19,20 +19,79 @@ along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import sys
+import time
 import logging
 import importlib.util
 
-from .sort_functions import equal_type_id
+from .sort_functions import group_by_type_id, obj_to_str
+from .journal import Journal
+from .osc_writer import OsmChangeWriter
+from .instrumentation import Metrics
 from .update_writer import OsmApiUploader
 from .osm_api_functions import OsmApiClient
+from .http_session import HttpSession
+from .prefetcher import PrefetchingApiClient
+from .history_provider import HistoryVersionProvider
+from .osh_history import HistoryFile, OshHistoryProvider
+from .version_cache import VersionCache
+
+#: methods of revert implementations whose calls are measured
+IMPLEMENTATION_CALLBACKS = ["decide_and_do", "work_on_single_object", "handle_v1_object", "handle_obj", "handle_multiple_versions", "solve_conflict"]
 
 
 class Worker():
-    def __init__(self, objects, configuration):
+    def __init__(self, objects, configuration, metrics=None):
         self.objects = objects
         self.configuration = configuration
-        self.uploader = OsmApiUploader(self.configuration)
-        self.api_client = OsmApiClient(self.configuration)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.session = HttpSession(self.configuration, metrics=self.metrics)
+        self.journal = None
+        if self.configuration.journal_path is not None:
+            self.journal = Journal(os.path.expanduser(self.configuration.journal_path), self.configuration.resume)
+        if self.configuration.osc_output is not None:
+            self.uploader = OsmChangeWriter(os.path.expanduser(self.configuration.osc_output), self.configuration)
+        else:
+            self.uploader = OsmApiUploader(self.configuration, self.session, self.journal)
+        self.metrics.instrument(self.uploader, "upload", ["handle_object", "upload_diff", "close_changeset"])
+        self.metrics.instrument(self.uploader.xml_builder, "xml", ["osm_change", "fragment", "node", "way", "relation"])
+        self.history_provider = None
+        self.group_count = 0 #: number of type/ID groups in the input
+        self.filtered_count = 0 #: number of type/ID groups dropped by the prefilter
+        self.reverted_changesets = set() #: IDs of the changesets reverted, set when the work is done
+        self.cache = None
+        if self.configuration.cache_path is not None:
+            self.cache = VersionCache(os.path.expanduser(self.configuration.cache_path), self.configuration.cache_max_size * 1024 * 1024, self.configuration.cache_latest_ttl)
+        self.memo = None
+        implementation_class = self.load_implementation()
+        self.api_client = self.create_api_client(implementation_class)
+        object_uploaded = getattr(self.api_client, "object_uploaded", None)
+        if object_uploaded is not None:
+            self.uploader.upload_listeners.append(object_uploaded)
+        self.revert_impl = implementation_class(self.configuration, self.api_client)
+        self.metrics.instrument(self.revert_impl, "callback", IMPLEMENTATION_CALLBACKS)
+
+    def create_api_client(self, implementation_class):
+        """
+        Create the API client used by the revert implementation.
+        """
+        api_client = OsmApiClient(self.configuration, self.session, self.cache)
+        self.memo = api_client.memo
+        if self.configuration.use_history:
+            api_client = HistoryVersionProvider(api_client, self.configuration)
+        if self.configuration.history_file is not None:
+            history_index = self.configuration.history_index
+            history_file = HistoryFile(os.path.expanduser(self.configuration.history_file), os.path.expanduser(history_index) if history_index is not None else None)
+            self.history_provider = OshHistoryProvider(api_client, history_file)
+            api_client = self.history_provider
+        return PrefetchingApiClient(api_client, self.configuration)
+
+    def load_implementation(self):
+        """
+        Load the module of the revert implementation.
+
+        Returns:
+            type: the class RevertImplementation of the module
+        """
         abspath = os.path.abspath(self.configuration.implementation)
         path, name = os.path.split(abspath)
         module_name, ext = os.path.splitext(name)
@@ -44,40 +103,94 @@ class Worker():
             module = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(module)
             sys.modules[module_name] = module
-            self.revert_impl = module.RevertImplementation(self.configuration, self.api_client)
+            return module.RevertImplementation
         except ImportError as err:
             logging.critical("Error while loading revert implementation from {}: {}".format(abspath, err))
             exit(1)
 
     def comment_reverted_changesets(self, changesets):
-        text = "This changeset has been reverted fully or in part by one or multiple of the following changesets: "
-        ids = ", ".join(str(cs_id) for cs_id in self.uploader.used_changesets)
-        text += ids
-        text += "\n\nThe reason for the revert is: {}".format(self.configuration.comment)
-        for cs_id in changesets:
-            self.uploader.comment_changeset(cs_id, text)
+        self.uploader.comment_reverted_changesets(changesets)
 
-    def work(self):
-        current_idx = 0
-        next_idx = 1
-        reverted_changesets = set()
-        while current_idx < len(self.objects):
-            if next_idx >= len(self.objects):
-                new_object, changesets = self.revert_impl.decide_and_do(self.objects[current_idx:next_idx])
-                if new_object is not None and changesets is not None:
-                    self.uploader.handle_object(new_object, changesets)
-                    reverted_changesets = reverted_changesets | changesets
-                break
-            if equal_type_id(self.objects[current_idx], self.objects[next_idx]):
-                next_idx = next_idx + 1
+    def pending_groups(self):
+        """
+        Group the input objects by type and ID and drop the groups completed according to the
+        journal and the groups rejected by the prefilter of the revert implementation.
+        """
+        skipped = 0
+        prefilter = self.revert_impl.prefilter
+        for objects in group_by_type_id(self.objects):
+            self.group_count += 1
+            if self.journal is not None and self.journal.is_completed(obj_to_str(objects[0]), objects[0].id):
+                skipped += 1
+                continue
+            if not prefilter(objects):
+                self.filtered_count += 1
                 continue
-            else:
-                new_object, changesets = self.revert_impl.decide_and_do(self.objects[current_idx:next_idx])
-                current_idx = next_idx
-                next_idx = next_idx + 1
-                if new_object is not None and changesets is not None:
-                    self.uploader.handle_object(new_object, changesets)
-                    reverted_changesets = reverted_changesets | changesets
+            yield objects
+        if skipped > 0:
+            logging.info("Skipped {} objects completed in a previous run".format(skipped))
+        logging.info("Prefilter dropped {} of {} objects".format(self.filtered_count, self.group_count))
+
+    def write_metrics(self):
+        if self.configuration.metrics_file is not None:
+            self.metrics.write(os.path.expanduser(self.configuration.metrics_file))
+
+    def work(self):
+        with self.metrics.timer("phase", "work"):
+            self._work()
+        logging.info("Timing of this run:\n{}".format(self.metrics.table()))
+        self.write_metrics()
+
+    def previously_reverted_changesets(self):
+        if self.journal is not None:
+            return self.journal.reverted_changesets()
+        return set()
+
+    def write_metrics_periodically(self):
+        if self.configuration.metrics_file is not None and time.monotonic() - self._last_metrics_write > self.configuration.metrics_interval:
+            self.write_metrics()
+            self._last_metrics_write = time.monotonic()
+
+    def handle_result(self, objects, new_object, changesets):
+        """
+        Hand the result of the revert implementation for a type/ID group over to the uploader.
+
+        Returns:
+            set: the changesets reverted by the new object
+        """
+        if new_object is not None and changesets is not None:
+            self.uploader.handle_object(new_object, changesets)
+            return changesets
+        if self.journal is not None:
+            self.journal.skipped(obj_to_str(objects[0]), objects[0].id)
+        return set()
+
+    def _work(self):
+        reverted_changesets = self.previously_reverted_changesets()
+        self._last_metrics_write = time.monotonic()
+        for objects in self.api_client.prefetch(self.pending_groups()):
+            self.write_metrics_periodically()
+            new_object, changesets = self.revert_impl.decide_and_do(objects)
+            reverted_changesets = reverted_changesets | self.handle_result(objects, new_object, changesets)
+        self.api_client.close()
+        self.finish(reverted_changesets)
+
+    def finish(self, reverted_changesets):
+        """
+        Close the last changeset, comment on the reverted changesets and close all files.
+        """
+        self.reverted_changesets = reverted_changesets
         self.uploader.close_changeset()
         if self.configuration.comment_reverted:
             self.comment_reverted_changesets(reverted_changesets)
+        if self.journal is not None:
+            self.journal.close()
+        logging.info("HTTP connections: {}".format(self.session.statistics))
+        if self.memo is not None:
+            logging.info("Version memo: {}".format(self.memo))
+        if self.history_provider is not None:
+            logging.info("Full-history file: {}".format(self.history_provider))
+            self.history_provider.history_file.close()
+        if self.cache is not None:
+            logging.info("Version cache: {}".format(self.cache))
+            self.cache.close()
@@ -1,12 +1,16 @@
 #! /usr/bin/env python3
 
+import os
 import sys
 import argparse
 import json
 import logging
-from machina_reparanda.sort_functions import type_to_int
+import cProfile
 from machina_reparanda.worker import Worker
-from machina_reparanda.input_handler import InputHandler
+from machina_reparanda.async_worker import AsyncWorker
+from machina_reparanda.sharding import ShardCoordinator, existing_shard_paths
+from machina_reparanda.instrumentation import Metrics
+from machina_reparanda.sorted_input import ExternalSorter
 from machina_reparanda.configuration import Configuration
 
 parser = argparse.ArgumentParser()
@@ -17,6 +21,23 @@ parser.add_argument("-i", "--implementation", help="path to Python file where a
 parser.add_argument("-l", "--log-level", help="log level (DEBUG, INFO, WARNING, ERROR, CRITICAL)", default="INFO", type=str)
 parser.add_argument("-S", "--no-comment-reverted", help="don't post a changeset comment to all reverted changesets (e.g. to avoid email spamming)", action="store_true", default=False)
 parser.add_argument("-r", "--reuse-changeset", help="reuse changeset with the given ID", type=int, default=0)
+parser.add_argument("-p", "--prefetch", help="number of objects to download in advance, also the maximum size of multi-fetch requests (0 disables prefetching)", type=int, default=None)
+parser.add_argument("--prefetch-workers", help="number of threads downloading objects in advance", type=int, default=None)
+parser.add_argument("-u", "--upload-mode", help="upload every object with its own request (single) or many objects at once as osmChange (diff)", choices=["single", "diff"], default=None)
+parser.add_argument("--cache", help="path to a database file where downloaded object versions are cached across runs", type=str, default=None)
+parser.add_argument("--history-file", help="full-history file (e.g. .osh.pbf) to read old versions from instead of the API, it is indexed on first use", type=str, default=None)
+parser.add_argument("--no-history", help="download old versions one by one instead of downloading the history of the object", action="store_true", default=False)
+parser.add_argument("--async", dest="async_io", help="work on many objects concurrently using asynchronous I/O (requires aiohttp)", action="store_true", default=False)
+parser.add_argument("--concurrency", help="number of objects worked on concurrently if --async is used", type=int, default=None)
+parser.add_argument("--shards", help="number of processes reverting disjoint ranges of the input, each uploads its own changesets and gets an equal share of http_rate", type=int, default=None)
+parser.add_argument("--run-size", help="maximum number of input objects kept in memory, more objects are sorted using temporary files", type=int, default=1000000)
+parser.add_argument("-j", "--input-workers", help="number of processes reading the input files", type=int, default=1)
+parser.add_argument("--tmp-dir", help="directory for temporary files", type=str, default=None)
+parser.add_argument("--journal", help="path to a file where the progress of the revert is recorded", type=str, default=None)
+parser.add_argument("--resume", help="continue the interrupted revert recorded in the journal, objects completed already are skipped", action="store_true", default=False)
+parser.add_argument("-o", "--osc-output", help="write the results to an osmChange file instead of uploading them (upload it with upload_osc.py)", type=str, default=None)
+parser.add_argument("--metrics-file", help="write timing and traffic statistics to this file during the run (JSON if it ends with .json, Prometheus text format otherwise)", type=str, default=None)
+parser.add_argument("--profile", help="run the revert in cProfile and write the statistics (pstats format) to this file", type=str, default=None)
 parser.add_argument("comment", help="changeset comment")
 parser.add_argument("osc_files", help="OSC files", nargs="+")
 args = parser.parse_args()
@@ -43,6 +64,44 @@ configuration.dryrun = args.dryrun
 configuration.comment_reverted = not args.no_comment_reverted
 configuration.comment = args.comment
 configuration.reuse_changeset = args.reuse_changeset
+if args.prefetch is not None:
+    configuration.prefetch_groups = args.prefetch
+if args.prefetch_workers is not None:
+    configuration.prefetch_workers = args.prefetch_workers
+if args.upload_mode is not None:
+    configuration.upload_mode = args.upload_mode
+if args.cache is not None:
+    configuration.cache_path = args.cache
+if args.history_file is not None:
+    configuration.history_file = args.history_file
+if args.no_history:
+    configuration.use_history = False
+if args.async_io:
+    configuration.async_io = True
+if args.concurrency is not None:
+    configuration.async_concurrency = args.concurrency
+if args.shards is not None:
+    configuration.shards = args.shards
+if args.metrics_file is not None:
+    configuration.metrics_file = args.metrics_file
+if args.osc_output is not None:
+    configuration.osc_output = args.osc_output
+if args.journal is not None:
+    configuration.journal_path = args.journal
+configuration.resume = args.resume
+if configuration.resume and configuration.journal_path is None:
+    sys.stderr.write("ERROR: --resume requires a journal (--journal or journal_path in the configuration file).\n")
+    exit(1)
+if not configuration.resume and configuration.journal_path is not None:
+    # the journals of a sharded run have the suffix .shard<N>
+    journal_path = os.path.expanduser(configuration.journal_path)
+    for path in [journal_path] + existing_shard_paths(journal_path):
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            sys.stderr.write("ERROR: Journal {} exists. Use --resume to continue the revert or remove the file.\n".format(path))
+            exit(1)
+if args.profile is not None and configuration.shards > 1:
+    sys.stderr.write("ERROR: --profile cannot be used with --shards because the shards run in other processes. Profile a single process instead.\n")
+    exit(1)
 if not hasattr(configuration, "implementation") and args.implementation is None:
     sys.stderr.write("ERROR: No implementation was provided to be used for this revert.\n")
     sys.stderr.write("Please either provide a path in the configration file or use -i.\n")
@@ -51,17 +110,27 @@ if not hasattr(configuration, "implementation") and args.implementation is None:
 elif args.implementation is not None:
     configuration.implementation = args.implementation
 
-objects = []
-input_handler = InputHandler(objects)
-logging.info("Reading input files ...")
-for filename in input_files:
-    logging.debug("Reading {}".format(filename))
-    input_handler.apply_file(filename)
+profiler = None
+if args.profile is not None:
+    profiler = cProfile.Profile()
+    profiler.enable()
+metrics = Metrics()
 
-# sort by object type, ID and version
-logging.info("Sorting objects ...")
-objects.sort(key=lambda obj: (type_to_int(obj), obj.id, obj.version))
+# read the input and sort it by object type, ID and version
+sorter = ExternalSorter(args.run_size, args.tmp_dir)
+logging.info("Reading input files ...")
+with metrics.timer("phase", "read input"):
+    sorter.add_files(input_files, args.input_workers)
 
 # Now the main task begins.
-worker = Worker(objects, configuration)
-worker.work()
+if configuration.shards > 1:
+    ShardCoordinator(configuration, configuration.shards, args.tmp_dir, metrics).work(sorter.sorted_objects())
+elif configuration.async_io:
+    AsyncWorker(sorter.sorted_objects(), configuration, metrics).work()
+else:
+    Worker(sorter.sorted_objects(), configuration, metrics).work()
+
+if profiler is not None:
+    profiler.disable()
+    profiler.dump_stats(args.profile)
+    logging.info("Profile written to {}, view it with: python3 -m pstats {}".format(args.profile, args.profile))
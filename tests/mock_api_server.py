@@ -0,0 +1,338 @@
+"""
+Local HTTP stand-in for the OSM API 0.6 used by end-to-end tests and benchmarks.
+
+The server answers the requests sent by OsmApiClient and OsmApiUploader from an in-memory store of
+object versions. The store can be filled from a directory in the layout of tests/data
+(``<type>/<id>/<version>.osm``) or from XML strings. Uploads modify the store. Latency and errors
+can be injected.
+"""
+
+import copy
+import glob
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from xml.sax.saxutils import quoteattr
+
+OSM_TYPES = ("node", "way", "relation")
+
+
+class Conflict(Exception):
+    pass
+
+
+class FixtureStore:
+    """
+    Versions of OSM objects indexed by type, ID and version.
+    """
+
+    def __init__(self):
+        self.objects = {} #: dictionary of versions (dict of version to Element) indexed by (type, ID)
+        self._lock = threading.Lock()
+
+    def add(self, element):
+        key = (element.tag, int(element.get("id")))
+        with self._lock:
+            self.objects.setdefault(key, {})[int(element.get("version"))] = element
+
+    def add_xml(self, xml):
+        """
+        Add all objects of an OSM XML document.
+        """
+        for element in ElementTree.fromstring(xml):
+            if element.tag in OSM_TYPES:
+                self.add(element)
+
+    def load_directory(self, path):
+        for osm_type in OSM_TYPES:
+            for filename in glob.glob(os.path.join(path, osm_type, "*", "*.osm")):
+                with open(filename, "rb") as xml_file:
+                    self.add_xml(xml_file.read())
+
+    def history(self, osm_type, osm_id):
+        with self._lock:
+            versions = self.objects.get((osm_type, osm_id))
+            if versions is None:
+                return None
+            return [versions[v] for v in sorted(versions)]
+
+    def version(self, osm_type, osm_id, version=None):
+        """
+        Get a version of an object, the latest one if version is None.
+        """
+        with self._lock:
+            versions = self.objects.get((osm_type, osm_id))
+            if versions is None:
+                return None
+            if version is None:
+                return versions[max(versions)]
+            return versions.get(version)
+
+    def modify(self, element, changeset_id, user):
+        """
+        Store a new version of an object.
+
+        Returns:
+            int: new version number
+
+        Raises:
+            Conflict: if the version of the element is not the latest one
+            KeyError: if the object does not exist
+        """
+        osm_type = element.tag
+        osm_id = int(element.get("id"))
+        with self._lock:
+            versions = self.objects[(osm_type, osm_id)]
+            latest = max(versions)
+            if int(element.get("version")) != latest:
+                raise Conflict("Version mismatch: Provided {}, server had: {} of {} {}".format(element.get("version"), latest, osm_type.capitalize(), osm_id))
+            new_element = copy.deepcopy(element)
+            new_element.set("version", str(latest + 1))
+            new_element.set("changeset", str(changeset_id))
+            new_element.set("user", user)
+            new_element.set("timestamp", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+            new_element.set("visible", "true")
+            versions[latest + 1] = new_element
+            return latest + 1
+
+
+def way_xml(osm_id, version, changeset, tags, node_refs=(1, 2), user="someone", uid=1, visible=True):
+    """
+    Serialize a version of a way as XML element for FixtureStore.add_xml().
+    """
+    lines = ["<way id=\"{}\" version=\"{}\" changeset=\"{}\" timestamp=\"2018-01-01T00:00:00Z\" user=\"{}\" uid=\"{}\" visible=\"{}\">".format(osm_id, version, changeset, user, uid, "true" if visible else "false")]
+    lines.extend("<nd ref=\"{}\"/>".format(ref) for ref in node_refs)
+    lines.extend("<tag k={} v={}/>".format(quoteattr(k), quoteattr(v)) for k, v in tags.items())
+    lines.append("</way>")
+    return "".join(lines)
+
+
+def osm_document(elements):
+    root = ElementTree.Element("osm", {"version": "0.6", "generator": "mock_api_server"})
+    root.extend(elements)
+    return ElementTree.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+class MockApiServer:
+    """
+    HTTP server imitating the OSM API 0.6.
+
+    Args:
+        store (FixtureStore): objects served by the API
+        latency (float): seconds every response is delayed
+        error_rate (float): fraction of requests which are answered with error_status
+        error_status (int): status code of injected errors
+        error_methods (tuple of str): HTTP methods errors are injected into
+        seed (int): seed of the random numbers used for error injection
+    """
+
+    FIRST_CHANGESET = 1000000 #: ID of the first changeset created
+
+    def __init__(self, store, latency=0.0, error_rate=0.0, error_status=503, error_methods=("GET",), seed=1):
+        self.store = store
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_methods = error_methods
+        self.random = random.Random(seed)
+        self.changesets = {} #: changesets created, dictionary with keys "open" and "objects" indexed by ID
+        self.comments = [] #: changeset comments as (changeset ID, text)
+        self.requests = [] #: (method, path, status, seconds until the response was ready) of every request, recorded before the response is sent
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def api_url(self):
+        return "http://127.0.0.1:{}/api/0.6".format(self.server.server_port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def latencies(self):
+        return [r[3] for r in self.requests]
+
+    def inject_error(self, method):
+        if self.error_rate <= 0 or method not in self.error_methods:
+            return False
+        with self._lock:
+            return self.random.random() < self.error_rate
+
+    def record(self, method, path, status, duration):
+        with self._lock:
+            self.requests.append((method, path, status, duration))
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, avoid waiting for delayed ACKs
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def respond(self, status, body=b"", content_type="text/xml; charset=utf-8"):
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                # record the request before the client can see the response
+                server.record(self.method, self.request_path, status, time.perf_counter() - self.start)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return status
+
+            def body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def handle_method(self, method):
+                self.start = time.perf_counter()
+                url = urllib.parse.urlparse(self.path)
+                path = url.path
+                self.method = method
+                self.request_path = path
+                if not path.startswith("/api/0.6/"):
+                    self.respond(404, "Not found")
+                else:
+                    data = self.body() if method in ("PUT", "POST") else b""
+                    if server.latency > 0:
+                        time.sleep(server.latency)
+                    if server.inject_error(method):
+                        self.respond(server.error_status, "Injected error")
+                    else:
+                        parts = path[len("/api/0.6/"):].split("/")
+                        self.route(method, parts, urllib.parse.parse_qs(url.query), data)
+
+            def do_GET(self):
+                self.handle_method("GET")
+
+            def do_PUT(self):
+                self.handle_method("PUT")
+
+            def do_POST(self):
+                self.handle_method("POST")
+
+            def route(self, method, parts, query, data):
+                if parts[0] == "changeset":
+                    return self.changeset(method, parts[1:], data)
+                if method == "GET" and len(parts) == 1 and parts[0][:-1] in OSM_TYPES:
+                    return self.multi_fetch(parts[0][:-1], query.get(parts[0], [""])[0])
+                if parts[0] not in OSM_TYPES or len(parts) < 2:
+                    return self.respond(404, "Not found")
+                osm_type = parts[0]
+                osm_id = int(parts[1])
+                if method == "PUT" and len(parts) == 2:
+                    return self.put_object(osm_type, osm_id, data)
+                if method != "GET":
+                    return self.respond(405, "Method not allowed")
+                if len(parts) == 3 and parts[2] == "history":
+                    history = server.store.history(osm_type, osm_id)
+                    if history is None:
+                        return self.respond(404, "Not found")
+                    return self.respond(200, osm_document(history))
+                element = server.store.version(osm_type, osm_id, int(parts[2]) if len(parts) == 3 else None)
+                if element is None:
+                    return self.respond(404, "Not found")
+                if len(parts) == 2 and element.get("visible") == "false":
+                    return self.respond(410, "Gone")
+                return self.respond(200, osm_document([element]))
+
+            def multi_fetch(self, osm_type, ids):
+                elements = []
+                for item in ids.split(","):
+                    match = re.fullmatch("([0-9]+)(?:v([0-9]+))?", item)
+                    if match is None:
+                        return self.respond(400, "Bad request")
+                    version = int(match.group(2)) if match.group(2) else None
+                    element = server.store.version(osm_type, int(match.group(1)), version)
+                    if element is None:
+                        return self.respond(404, "Not found")
+                    elements.append(element)
+                return self.respond(200, osm_document(elements))
+
+            def open_changeset(self, cs_id):
+                with server._lock:
+                    changeset = server.changesets.get(cs_id)
+                if changeset is None:
+                    self.respond(404, "Changeset not found")
+                    return None
+                if not changeset["open"]:
+                    self.respond(409, "The changeset {} was closed at 2018-01-01 00:00:00 UTC".format(cs_id))
+                    return None
+                return changeset
+
+            def changeset(self, method, parts, data):
+                if method == "PUT" and parts == ["create"]:
+                    with server._lock:
+                        cs_id = server.FIRST_CHANGESET + len(server.changesets)
+                        server.changesets[cs_id] = {"open": True, "objects": 0}
+                    return self.respond(200, str(cs_id), "text/plain")
+                cs_id = int(parts[0])
+                if method == "POST" and parts[1:] == ["comment"]:
+                    text = urllib.parse.parse_qs(data.decode("utf-8")).get("text", [""])[0]
+                    with server._lock:
+                        server.comments.append((cs_id, text))
+                    return self.respond(200, osm_document([]))
+                changeset = self.open_changeset(cs_id)
+                if changeset is None:
+                    return 409
+                if method == "PUT" and parts[1:] == ["close"]:
+                    changeset["open"] = False
+                    return self.respond(200, "", "text/plain")
+                if method == "POST" and parts[1:] == ["upload"]:
+                    return self.upload(cs_id, changeset, data)
+                return self.respond(404, "Not found")
+
+            def upload(self, cs_id, changeset, data):
+                root = ElementTree.fromstring(data)
+                results = ElementTree.Element("diffResult", {"version": "0.6"})
+                # check all objects first, the API applies a diff upload completely or not at all
+                elements = [e for action in root for e in action]
+                for element in elements:
+                    latest = server.store.version(element.tag, int(element.get("id")))
+                    if latest is None:
+                        return self.respond(404, "The {} with the id {} was not found".format(element.tag, element.get("id")))
+                    if latest.get("version") != element.get("version"):
+                        return self.respond(409, "Version mismatch: Provided {}, server had: {} of {} {}".format(element.get("version"), latest.get("version"), element.tag.capitalize(), element.get("id")))
+                for element in elements:
+                    new_version = server.store.modify(element, cs_id, element.get("user", ""))
+                    ElementTree.SubElement(results, element.tag, {"old_id": element.get("id"), "new_id": element.get("id"), "new_version": str(new_version)})
+                changeset["objects"] += len(elements)
+                return self.respond(200, ElementTree.tostring(results, encoding="utf-8", xml_declaration=True))
+
+            def put_object(self, osm_type, osm_id, data):
+                element = ElementTree.fromstring(data).find(osm_type)
+                changeset = self.open_changeset(int(element.get("changeset")))
+                if changeset is None:
+                    return 409
+                try:
+                    new_version = server.store.modify(element, int(element.get("changeset")), element.get("user", ""))
+                except KeyError:
+                    return self.respond(404, "Not found")
+                except Conflict as err:
+                    return self.respond(409, str(err))
+                changeset["objects"] += 1
+                return self.respond(200, str(new_version), "text/plain")
+
+        return Handler
@@ -1,4 +1,5 @@
 import os
+import glob
 import inspect
 import copy
 import osmium
@@ -49,3 +50,12 @@ class MockDataProvider(OsmApiClient):
         input_file = self.__get_path__(osm_type, osm_id, version)
         self.handler.apply_file(input_file)
         return OsmApiResponse.EXISTS, self.handler.stored_way
+
+    def get_history(self, osm_type, osm_id):
+        version_dir = os.path.dirname(self.__get_path__(osm_type, osm_id, 1))
+        versions = []
+        for input_file in glob.glob("{}/*.osm".format(version_dir)):
+            self.handler.apply_file(input_file)
+            versions.append(self.handler.stored_way)
+        versions.sort(key=lambda obj: obj.version)
+        return OsmApiResponse.EXISTS, versions
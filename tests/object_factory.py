@@ -0,0 +1,17 @@
+"""
+Construction of OSM objects used by several test modules.
+"""
+
+import osmium
+
+from machina_reparanda.mutable_osm_objects import MutableTagList
+
+
+def make_way(osm_id, version, visible=True, tags=None):
+    """
+    Create a way without nodes. It is tagged highway=residential unless other tags are given.
+    """
+    tag_list = MutableTagList([])
+    for k, v in (tags if tags is not None else {"highway": "residential"}).items():
+        tag_list[k] = v
+    return osmium.osm.mutable.Way(id=osm_id, version=version, visible=visible, tags=tag_list, nodes=[])
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import tempfile
+import textwrap
+import unittest
+from unittest import mock
+
+from machina_reparanda import async_api
+from machina_reparanda.async_api import AsyncOsmApiClient, SyncApiClientAdapter
+from machina_reparanda.async_worker import AsyncWorker
+from machina_reparanda.osm_api_functions import OsmApiResponse
+
+from tests.mock_api_server import FixtureStore, MockApiServer, way_xml
+from tests.test_mock_api_server import make_configuration, make_store, read_osc
+
+ASYNC_IMPLEMENTATION = """
+from machina_reparanda.abstract_revert_implementation import AbstractAsyncRevertImplementation
+from machina_reparanda.osm_api_functions import OsmApiResponse
+from machina_reparanda.sort_functions import obj_to_str
+
+
+class RevertImplementation(AbstractAsyncRevertImplementation):
+    async def handle_obj(self, obj):
+        response, latest, is_latest = await self.get_latest(obj)
+        if response != OsmApiResponse.EXISTS:
+            return None, None
+        response, prev_version = await self.api_client.get_version(obj_to_str(obj), obj.id, obj.version - 1)
+        if response != OsmApiResponse.EXISTS:
+            return None, None
+        latest.tags["name"] = prev_version.tags["name"]
+        return latest, {obj.changeset}
+"""
+
+
+@unittest.skipIf(async_api.aiohttp is None, "aiohttp is not installed")
+@mock.patch("sys.stderr", new=mock.MagicMock())
+class AsyncApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_client(self):
+        store = FixtureStore()
+        store.add_xml("<osm>{}{}{}</osm>".format(way_xml(1, 1, 10, {"name": "A"}), way_xml(1, 2, 11, {"name": "B"}), way_xml(2, 1, 10, {}, visible=False)))
+
+        async def run(client):
+            try:
+                return await asyncio.gather(client.get_latest_version("way", 1), client.get_version("way", 1, 1),
+                                            client.get_latest_version("way", 2), client.get_latest_version("way", 3),
+                                            client.get_history("way", 1), client.get_versions("way", [(1, 1), (1, 2), (3, 1)]))
+            finally:
+                await client.close()
+
+        with MockApiServer(store) as server:
+            client = AsyncOsmApiClient(make_configuration(server))
+            latest, version, deleted, missing, history, versions = asyncio.run(run(client))
+        self.assertEqual(latest[0], OsmApiResponse.EXISTS)
+        self.assertEqual((latest[1].version, latest[1].tags["name"]), (2, "B"))
+        self.assertEqual((version[0], version[1].tags["name"]), (OsmApiResponse.EXISTS, "A"))
+        self.assertEqual(deleted, (OsmApiResponse.DELETED, None))
+        self.assertEqual(missing, (OsmApiResponse.NOT_FOUND, None))
+        self.assertEqual([v.version for v in history[1]], [1, 2])
+        self.assertEqual(sorted(versions), [("way", 1, 1), ("way", 1, 2)])
+        # the multi-fetch request is bisected twice because way 3 does not exist
+        self.assertEqual(client.requests, 10)
+
+    def test_retry(self):
+        store, osc = make_store(1)
+        with MockApiServer(store, error_rate=0.5, seed=3) as server:
+            client = AsyncOsmApiClient(make_configuration(server, http_max_retries=20))
+
+            async def run():
+                try:
+                    return await asyncio.gather(*[client.get_version("way", 1, 1) for i in range(10)])
+                finally:
+                    await client.close()
+
+            results = asyncio.run(run())
+        self.assertTrue(all(r[0] == OsmApiResponse.EXISTS for r in results))
+        self.assertGreater(client.retries, 0)
+
+    def test_sync_adapter(self):
+        store, osc = make_store(1)
+        with MockApiServer(store) as server:
+            adapter = SyncApiClientAdapter(AsyncOsmApiClient(make_configuration(server)))
+
+            async def run():
+                adapter.loop = asyncio.get_running_loop()
+                try:
+                    return await adapter.loop.run_in_executor(None, adapter.get_latest_version, "way", 1)
+                finally:
+                    await adapter.close()
+
+            response, latest = asyncio.run(run())
+        self.assertEqual((response, latest.version), (OsmApiResponse.EXISTS, 2))
+        self.assertEqual(adapter.api_url, server.api_url)
+
+    def revert(self, implementation=None, **kwargs):
+        store, osc = make_store(30)
+        with MockApiServer(store, latency=0.002) as server:
+            configuration = make_configuration(server, async_io=True, async_concurrency=8, upload_mode="single", http_rate=0, **kwargs)
+            if implementation is not None:
+                configuration.implementation = implementation
+            AsyncWorker(read_osc(self.tmp_dir.name, osc), configuration).work()
+        for i in range(1, 31):
+            latest = store.version("way", i)
+            self.assertEqual(latest.get("version"), "3")
+            self.assertEqual(latest.find("tag[@k='name']").get("v"), "Street {}".format(i))
+        # the latest versions are fetched with one multi-fetch request
+        self.assertEqual([r[1] for r in server.requests if r[0] == "GET" and r[1] in ("/api/0.6/ways", "/api/0.6/way/1")], ["/api/0.6/ways"])
+        uploads = [r[1] for r in server.requests if r[0] == "PUT" and r[1].startswith("/api/0.6/way/")]
+        self.assertEqual(uploads, ["/api/0.6/way/{}".format(i) for i in range(1, 31)])
+        self.assertEqual([c[0] for c in server.comments], [1000000, 20])
+
+    def test_worker_sync_implementation(self):
+        self.revert()
+
+    def test_worker_async_implementation(self):
+        path = os.path.join(self.tmp_dir.name, "async_revert.py")
+        with open(path, "w") as implementation:
+            implementation.write(textwrap.dedent(ASYNC_IMPLEMENTATION))
+        self.revert(path)
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import mock
+
+from machina_reparanda.changeset_download import ChangesetDownloadPool, is_complete_osc
+from machina_reparanda.rate_limit import HostRateLimiter
+
+OSC_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6">
+</osmChange>
+"""
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+    failures = {} #: number of 503 responses to send before a changeset is served
+
+    def do_GET(self):
+        cs_id = int(self.path.split("/")[-2])
+        StandInHandler.requests.append(cs_id)
+        if cs_id == 404:
+            status, body = 404, b""
+        elif StandInHandler.failures.get(cs_id, 0) > 0:
+            StandInHandler.failures[cs_id] -= 1
+            status, body = 503, b""
+        else:
+            status, body = 200, OSC_XML
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 503:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@mock.patch("sys.stderr", new=mock.MagicMock())
+class ChangesetDownloadPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        StandInHandler.requests = []
+        StandInHandler.failures = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = "http://127.0.0.1:{}/api/0.6/".format(self.server.server_port)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def pool(self):
+        return ChangesetDownloadPool(self.tmp_dir.name, workers=3, rate=0, max_retries=2, base_url=self.base_url)
+
+    def test_download(self):
+        pool = self.pool()
+        for cs_id in range(1, 11):
+            pool.submit(cs_id)
+        self.assertEqual(pool.close(), [])
+        self.assertEqual(pool.downloaded, 10)
+        for cs_id in range(1, 11):
+            self.assertTrue(is_complete_osc(os.path.join(self.tmp_dir.name, "c{}.osc".format(cs_id))))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), sorted("c{}.osc".format(i) for i in range(1, 11)))
+
+    def test_skip_complete_files(self):
+        with open(os.path.join(self.tmp_dir.name, "c1.osc"), "wb") as f:
+            f.write(OSC_XML)
+        with open(os.path.join(self.tmp_dir.name, "c2.osc"), "wb") as f:
+            f.write(OSC_XML[:60])
+        pool = self.pool()
+        pool.submit(1)
+        pool.submit(2)
+        pool.close()
+        self.assertEqual(pool.skipped, 1)
+        self.assertEqual(StandInHandler.requests, [2])
+        self.assertTrue(is_complete_osc(os.path.join(self.tmp_dir.name, "c2.osc")))
+
+    def test_retry(self):
+        StandInHandler.failures = {5: 2, 6: 3}
+        pool = self.pool()
+        with self.assertLogs(level="WARNING"):
+            pool.submit(5)
+            pool.submit(6)
+            pool.submit(404)
+            self.assertEqual(sorted(pool.close()), [6, 404])
+        self.assertEqual(StandInHandler.requests.count(5), 3)
+        self.assertEqual(StandInHandler.requests.count(6), 3)
+        self.assertEqual(StandInHandler.requests.count(404), 1)
+        self.assertTrue(is_complete_osc(os.path.join(self.tmp_dir.name, "c5.osc")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, "c6.osc")))
+
+    def test_shared_rate_limiter(self):
+        rate_limiter = HostRateLimiter(0)
+        pool = ChangesetDownloadPool(self.tmp_dir.name, workers=3, max_retries=2, base_url=self.base_url, rate_limiter=rate_limiter)
+        self.assertIs(pool.rate_limiter, rate_limiter)
+        pool.submit(1)
+        pool.close()
+        self.assertEqual(list(rate_limiter.buckets), ["127.0.0.1:{}".format(self.server.server_port)])
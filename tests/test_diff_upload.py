@@ -0,0 +1,129 @@
+import unittest
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.http_session import HttpSession
+from machina_reparanda.update_writer import OsmApiUploader
+
+from tests.mock_api_server import MockApiServer
+from tests.object_factory import make_way
+from tests.test_mock_api_server import make_configuration, make_store
+
+
+class FakeResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+
+
+class FakeSession:
+    """Stand-in for HttpSession which answers with canned responses."""
+
+    def __init__(self, upload_responses):
+        self.upload_responses = upload_responses
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs.get("data")))
+        if url.endswith("/changeset/create"):
+            return FakeResponse(200, "42")
+        if url.endswith("/upload"):
+            return self.upload_responses.pop(0)
+        return FakeResponse(200, "")
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+def diff_result(*ids):
+    elements = "".join("<way old_id=\"{0}\" new_id=\"{0}\" new_version=\"{1}\"/>".format(i, v) for i, v in ids)
+    return "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<diffResult version=\"0.6\">{}</diffResult>".format(elements)
+
+
+class DiffUploadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = Configuration({"user": "testUser", "uid": 12458, "password": "123secret", "upload_mode": "diff", "diff_upload_size": 2})
+        self.config.comment_reverted = False
+
+    def uploads(self, session):
+        return [r for r in session.requests if r[1].endswith("/upload")]
+
+    def test_chunked_upload(self):
+        session = FakeSession([FakeResponse(200, diff_result((1, 4), (2, 8))), FakeResponse(200, diff_result((3, 2)))])
+        uploader = OsmApiUploader(self.config, session)
+        uploader.handle_object(make_way(1, 3), {10})
+        uploader.handle_object(make_way(2, 7), {10})
+        uploader.handle_object(make_way(3, 1), {11})
+        self.assertEqual(len(self.uploads(session)), 1)
+        uploader.close_changeset()
+        uploads = self.uploads(session)
+        self.assertEqual(len(uploads), 2)
+        self.assertIn(b"<osmChange", uploads[0][2])
+        self.assertIn(b"changeset=\"42\"", uploads[0][2])
+        self.assertEqual(uploads[0][1], "{}/changeset/42/upload".format(self.config.api_url))
+        self.assertEqual(uploader.uploaded_versions, {("way", 1): 4, ("way", 2): 8, ("way", 3): 2})
+        self.assertEqual(uploader.used_changesets, {42})
+
+    def test_conflict_is_mapped_to_object(self):
+        conflict = FakeResponse(409, "Version mismatch: Provided 7, server had: 9 of Way 2")
+        session = FakeSession([conflict, FakeResponse(200, diff_result((1, 4)))])
+        uploader = OsmApiUploader(self.config, session)
+        uploader.handle_object(make_way(1, 3), {10})
+        uploader.handle_object(make_way(2, 7), {10})
+        uploads = self.uploads(session)
+        self.assertEqual(len(uploads), 2)
+        self.assertIn(b"id=\"2\"", uploads[0][2])
+        self.assertNotIn(b"id=\"2\"", uploads[1][2])
+        self.assertEqual(uploader.uploaded_versions, {("way", 1): 4})
+        self.assertEqual(uploader.pending, [])
+
+    def test_changeset_closed_by_api(self):
+        store, osc = make_store(4)
+        with MockApiServer(store) as server:
+            config = make_configuration(server, upload_mode="diff", diff_upload_size=2)
+            uploader = OsmApiUploader(config, HttpSession(config))
+            uploader.handle_object(make_way(1, 2), {20})
+            uploader.handle_object(make_way(2, 2), {21})
+            first = uploader.changeset
+            server.changesets[first]["open"] = False
+            uploader.handle_object(make_way(3, 2), {22})
+            uploader.handle_object(make_way(4, 2), {23})
+        self.assertNotEqual(uploader.changeset, first)
+        self.assertIn(first, uploader.used_changesets)
+        self.assertEqual(uploader.object_count, 2)
+        self.assertEqual(uploader.reverted_changesets, {22, 23})
+        self.assertEqual(server.changesets[uploader.changeset]["objects"], 2)
+        for i in range(1, 5):
+            self.assertEqual(store.version("way", i).get("version"), "3")
+
+    def test_conflicts_are_bisected(self):
+        store, osc = make_store(8)
+        with MockApiServer(store) as server:
+            config = make_configuration(server, upload_mode="diff", diff_upload_size=8)
+            uploader = OsmApiUploader(config, HttpSession(config))
+            for i in range(1, 9):
+                # ways 2 and 3 are outdated
+                uploader.handle_object(make_way(i, 1 if i in (2, 3) else 2), {20})
+        uploads = [r for r in server.requests if r[1].endswith("/upload")]
+        self.assertEqual(sorted(uploader.uploaded_versions), [("way", i) for i in (1, 4, 5, 6, 7, 8)])
+        # 8 objects, the first half of the remaining 7 (conflict), its halves 1 and 1, the second half 4
+        self.assertEqual(len(uploads), 5)
+        for i in (2, 3):
+            self.assertEqual(store.version("way", i).get("version"), "2")
+
+    def test_changeset_closed_by_api_single_mode(self):
+        store, osc = make_store(2)
+        with MockApiServer(store) as server:
+            config = make_configuration(server, upload_mode="single")
+            uploader = OsmApiUploader(config, HttpSession(config))
+            uploader.handle_object(make_way(1, 2), {20})
+            first = uploader.changeset
+            server.changesets[first]["open"] = False
+            uploader.handle_object(make_way(2, 2), {21})
+        self.assertNotEqual(uploader.changeset, first)
+        self.assertIn(first, uploader.used_changesets)
+        self.assertEqual((uploader.object_count, uploader.reverted_changesets), (1, {21}))
+        self.assertEqual(uploader.uploaded_versions, {("way", 1): 3, ("way", 2): 3})
@@ -0,0 +1,87 @@
+import unittest
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.history_provider import HistoryVersionProvider
+from machina_reparanda.osm_api_functions import OsmApiResponse
+from implementations.nanowa import RevertImplementation
+
+from tests.mock_data_provider import MockDataProvider
+
+
+class CountingDataProvider(MockDataProvider):
+    def __init__(self, configuration, **kwargs):
+        MockDataProvider.__init__(self, configuration, **kwargs)
+        self.version_requests = 0
+        self.history_requests = 0
+
+    def get_version(self, osm_type, osm_id, version, fallback_if_redacted=True):
+        self.version_requests += 1
+        return MockDataProvider.get_version(self, osm_type, osm_id, version, fallback_if_redacted)
+
+    def get_history(self, osm_type, osm_id):
+        self.history_requests += 1
+        return MockDataProvider.get_history(self, osm_type, osm_id)
+
+
+class RedactedHistoryProvider(CountingDataProvider):
+    """Data provider whose history of way 4 misses the redacted version 3."""
+
+    def get_history(self, osm_type, osm_id):
+        code, versions = CountingDataProvider.get_history(self, osm_type, osm_id)
+        return code, [v for v in versions if v.version != 3]
+
+
+class NotFoundHistoryProvider(CountingDataProvider):
+    """Data provider which does not know any history."""
+
+    def get_history(self, osm_type, osm_id):
+        self.history_requests += 1
+        return OsmApiResponse.NOT_FOUND, None
+
+
+class HistoryProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = Configuration({"user": "testUser", "uid": 12458, "password": "123secret"})
+
+    def test_solve_conflict_with_one_request(self):
+        backend = CountingDataProvider(self.config, fake_data=True)
+        provider = HistoryVersionProvider(backend, self.config)
+        revert_impl = RevertImplementation(self.config, provider)
+        code, v2 = provider.get_version("way", 4, 2)
+        code, latest = backend.get_latest_version("way", 4)
+        result, cs = revert_impl.solve_conflict(v2, latest, [3, 5])
+        self.assertEqual(backend.history_requests, 1)
+        self.assertEqual(backend.version_requests, 0)
+        self.assertEqual(cs, {5, 25})
+        self.assertEqual(result.version, 5)
+
+    def test_returns_copies(self):
+        backend = CountingDataProvider(self.config, fake_data=True)
+        provider = HistoryVersionProvider(backend, self.config)
+        code, v3 = provider.get_version("way", 3, 3)
+        v3.tags["building"] = "changed"
+        code, v3_again = provider.get_version("way", 3, 3)
+        self.assertNotEqual(v3_again.tags["building"], "changed")
+        self.assertEqual(backend.history_requests, 1)
+        # the versions are kept as snapshots in the memo of the client
+        self.assertIs(provider.memo, backend.memo)
+        self.assertEqual(provider.memo.hits, 2)
+
+    def test_redacted_version(self):
+        backend = RedactedHistoryProvider(self.config, fake_data=True)
+        provider = HistoryVersionProvider(backend, self.config)
+        code, obj = provider.get_version("way", 4, 3)
+        self.assertEqual(code, OsmApiResponse.REDACTED_FALLBACK)
+        self.assertEqual(obj.version, 2)
+        code, obj = provider.get_version("way", 4, 3, False)
+        self.assertEqual(code, OsmApiResponse.REDACTED)
+        self.assertIsNone(obj)
+        self.assertEqual(backend.history_requests, 1)
+
+    def test_failed_history_request_is_not_repeated(self):
+        backend = NotFoundHistoryProvider(self.config, fake_data=True)
+        provider = HistoryVersionProvider(backend, self.config)
+        code, versions = provider.get_history("way", 4)
+        self.assertEqual(code, OsmApiResponse.NOT_FOUND)
+        self.assertIsNone(versions)
+        self.assertEqual(backend.history_requests, 1)
@@ -0,0 +1,145 @@
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.http_session import HttpSession
+from machina_reparanda import OsmApiClient, OsmApiResponse
+
+WAY_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <way id="1" version="3" changeset="5" timestamp="2018-01-01T00:00:00Z" user="test" uid="1" visible="true">
+    <nd ref="1"/>
+    <nd ref="2"/>
+    <tag k="highway" v="residential"/>
+  </way>
+</osm>
+"""
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(WAY_XML)))
+        self.end_headers()
+        self.wfile.write(WAY_XML)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpSessionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        api_url = "http://127.0.0.1:{}/api/0.6".format(self.server.server_port)
+        # every lookup has to send a request
+        self.config = Configuration({"user": "testUser", "uid": 12458, "password": "123secret", "api_url": api_url, "memo_size": 0})
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reuse(self):
+        session = HttpSession(self.config)
+        client = OsmApiClient(self.config, session)
+        for i in range(5):
+            code, way = client.get_latest_version("way", 1)
+            self.assertEqual(code, OsmApiResponse.EXISTS)
+            self.assertEqual(way.version, 3)
+        self.assertEqual(session.statistics.requests, 5)
+        self.assertEqual(session.statistics.connections, 1)
+        self.assertEqual(session.statistics.reused(), 4)
+        session.close()
+
+    def test_no_keep_alive(self):
+        self.config.http_keep_alive = False
+        session = HttpSession(self.config)
+        client = OsmApiClient(self.config, session)
+        for i in range(3):
+            client.get_latest_version("way", 1)
+        self.assertEqual(session.statistics.connections, 3)
+        self.assertEqual(session.statistics.reused(), 0)
+        session.close()
+
+
+class FailingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    statuses = [] #: status codes to respond with before the request succeeds
+    requests = []
+
+    def respond(self):
+        FailingHandler.requests.append(self.command)
+        status = FailingHandler.statuses.pop(0) if FailingHandler.statuses else 200
+        body = WAY_XML if status == 200 else b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.respond()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RetryTestCase(unittest.TestCase):
+    def setUp(self):
+        FailingHandler.statuses = []
+        FailingHandler.requests = []
+        self.server = HTTPServer(("127.0.0.1", 0), FailingHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/api/0.6/way/1".format(self.server.server_port)
+        self.config = Configuration({"user": "testUser", "uid": 12458, "password": "123secret", "http_rate": 100,
+                                     "http_min_rate": 1, "http_max_retries": 3, "http_retry_base_delay": 0.01})
+        self.session = HttpSession(self.config)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_retried_on_server_error(self):
+        FailingHandler.statuses = [503, 502]
+        with self.assertLogs(level="WARNING"):
+            r = self.session.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(FailingHandler.requests), 3)
+        self.assertEqual(self.session.statistics.retries, 2)
+
+    def test_give_up(self):
+        FailingHandler.statuses = [500] * 10
+        with self.assertLogs(level="WARNING"):
+            r = self.session.get(self.url)
+        self.assertEqual(r.status_code, 500)
+        self.assertEqual(len(FailingHandler.requests), 4)
+
+    def test_post_not_retried_on_server_error(self):
+        FailingHandler.statuses = [503]
+        r = self.session.post(self.url, data="<osm/>")
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual(FailingHandler.requests, ["POST"])
+
+    def test_throttling(self):
+        FailingHandler.statuses = [429]
+        with self.assertLogs(level="WARNING"):
+            r = self.session.post(self.url, data="<osm/>")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(FailingHandler.requests, ["POST", "POST"])
+        bucket = self.session.rate_limiter.bucket(self.url)
+        self.assertEqual(bucket.rate, 50 + 1)
+        for i in range(10):
+            self.session.get(self.url)
+        self.assertEqual(bucket.rate, 50 + 11)
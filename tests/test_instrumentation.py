@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from machina_reparanda.instrumentation import Metrics, endpoint_name
+from machina_reparanda.worker import Worker
+
+from tests.mock_api_server import MockApiServer
+from tests.test_mock_api_server import make_store, make_configuration, read_osc
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_endpoint_name(self):
+        self.assertEqual(endpoint_name("GET", "https://api.openstreetmap.org/api/0.6/way/123/4"), "GET /way/{id}/{version}")
+        self.assertEqual(endpoint_name("GET", "http://127.0.0.1:80/api/0.6/node/5/history"), "GET /node/{id}/history")
+        self.assertEqual(endpoint_name("GET", "http://127.0.0.1:80/api/0.6/ways?ways=1v2,3v4"), "GET /ways")
+        self.assertEqual(endpoint_name("POST", "http://127.0.0.1:80/api/0.6/changeset/42/upload"), "POST /changeset/{id}/upload")
+
+    def test_histogram(self):
+        metrics = Metrics()
+        for i in range(99):
+            metrics.observe("http", "GET /way/{id}", 0.001, 10, 100)
+        metrics.observe("http", "GET /way/{id}", 2.0, 10, 100)
+        histogram = metrics.histograms[("http", "GET /way/{id}")]
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.bytes_received, 10000)
+        self.assertLess(histogram.quantile(0.5), 0.002)
+        self.assertGreaterEqual(histogram.quantile(1.0), 2.0)
+        text = metrics.to_prometheus()
+        self.assertIn("machina_reparanda_duration_seconds_count{category=\"http\",name=\"GET /way/{id}\"} 100", text)
+        self.assertIn("machina_reparanda_duration_seconds_bucket{category=\"http\",name=\"GET /way/{id}\",le=\"+Inf\"} 100", text)
+        self.assertIn("machina_reparanda_bytes_sent_total{category=\"http\",name=\"GET /way/{id}\"} 1000", text)
+
+    def test_wrap(self):
+        metrics = Metrics()
+        function = metrics.wrap("callback", "double", lambda x: 2 * x)
+        self.assertEqual(function(4), 8)
+        self.assertEqual(metrics.histograms[("callback", "double")].count, 1)
+
+
+@mock.patch("sys.stderr", new=mock.MagicMock())
+class WorkerMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_metrics_file(self):
+        store, osc = make_store(3)
+        path = os.path.join(self.tmp_dir.name, "metrics.json")
+        with MockApiServer(store) as server:
+            configuration = make_configuration(server, metrics_file=path)
+            Worker(read_osc(self.tmp_dir.name, osc), configuration).work()
+        with open(path) as metrics_file:
+            metrics = {(m["category"], m["name"]): m for m in json.load(metrics_file)["metrics"]}
+        self.assertEqual(metrics[("callback", "decide_and_do")]["count"], 3)
+        self.assertEqual(metrics[("http", "POST /changeset/{id}/upload")]["count"], 1)
+        self.assertGreater(metrics[("http", "POST /changeset/{id}/upload")]["bytes_sent"], 0)
+        self.assertEqual(metrics[("phase", "work")]["count"], 1)
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.journal import Journal
+from machina_reparanda.update_writer import OsmApiUploader
+from tests.object_factory import make_way
+from tests.test_diff_upload import FakeResponse, FakeSession, diff_result
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "journal.jsonl")
+        self.config = Configuration({"user": "testUser", "uid": 12458, "password": "123secret", "upload_mode": "diff", "diff_upload_size": 2})
+        self.config.comment_reverted = False
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_replay(self):
+        journal = Journal(self.path)
+        journal.changeset_opened(42)
+        journal.uploaded([("way", 1, 4, 42, {10}), ("node", 1, 2, 42, {11})])
+        journal.skipped("way", 2)
+        journal.failed_upload("way", 3, "conflict")
+        journal.close()
+        # simulate a crash while writing a record
+        with open(self.path, "a") as journal_file:
+            journal_file.write("{\"event\":\"upl")
+        with self.assertLogs(level="WARNING"):
+            journal = Journal(self.path, resume=True)
+        self.assertEqual(journal.completed, {("way", 1), ("node", 1), ("way", 2)})
+        self.assertEqual(journal.failed, {("way", 3)})
+        self.assertEqual(journal.open_changeset(), 42)
+        self.assertEqual(journal.reverted_changesets(), {10, 11})
+        journal.changeset_closed(42)
+        journal.close()
+        journal = Journal(self.path, resume=True)
+        self.assertEqual(journal.open_changeset(), 0)
+        self.assertEqual(journal.closed_changesets, {42})
+        journal.close()
+
+    def test_sync_per_upload_only(self):
+        journal = Journal(self.path)
+        with mock.patch("os.fsync") as fsync:
+            for i in range(100):
+                journal.skipped("way", i)
+            self.assertEqual(fsync.call_count, 0)
+            journal.uploaded([("way", 100, 2, 42, {10})])
+            self.assertEqual(fsync.call_count, 1)
+            journal.close()
+            self.assertEqual(fsync.call_count, 2)
+        journal = Journal(self.path, resume=True)
+        self.assertEqual(len(journal.completed), 101)
+        journal.close()
+
+    def test_overwrite_without_resume(self):
+        journal = Journal(self.path)
+        journal.skipped("way", 2)
+        journal.close()
+        journal = Journal(self.path)
+        self.assertEqual(journal.completed, set())
+        journal.close()
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_uploader_records_confirmed_uploads(self):
+        conflict = FakeResponse(409, "Version mismatch: Provided 7, server had: 9 of Way 2")
+        session = FakeSession([conflict, FakeResponse(200, diff_result((1, 4))), FakeResponse(200, diff_result((3, 2)))])
+        journal = Journal(self.path)
+        uploader = OsmApiUploader(self.config, session, journal)
+        uploader.handle_object(make_way(1, 3), {10})
+        uploader.handle_object(make_way(2, 7), {11})
+        uploader.handle_object(make_way(3, 1), {12})
+        journal.close()
+        # interrupted before the last object was uploaded
+        journal = Journal(self.path, resume=True)
+        self.assertEqual(journal.completed, {("way", 1)})
+        self.assertEqual(journal.failed, {("way", 2)})
+        session = FakeSession([FakeResponse(200, diff_result((3, 2)))])
+        uploader = OsmApiUploader(self.config, session, journal)
+        self.assertEqual(uploader.changeset, 42)
+        self.assertEqual(uploader.object_count, 1)
+        self.assertEqual(uploader.reverted_changesets, {10})
+        uploader.handle_object(make_way(3, 1), {12})
+        uploader.close_changeset()
+        self.assertFalse(any(r[1].endswith("/changeset/create") for r in session.requests))
+        self.assertEqual(journal.completed, {("way", 1), ("way", 3)})
+        self.assertEqual(journal.open_changeset(), 0)
+        self.assertIn(42, journal.commented)
+        journal.close()
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.input_handler import InputHandler
+from machina_reparanda.worker import Worker
+from machina_reparanda import OsmApiClient, OsmApiResponse
+
+from tests.mock_api_server import FixtureStore, MockApiServer, way_xml
+
+IMPLEMENTATION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "implementations", "revert_implementation.py")
+
+
+def make_store(way_count):
+    """Ways whose name has been changed by changeset 20."""
+    store = FixtureStore()
+    osc = []
+    for i in range(1, way_count + 1):
+        store.add_xml("<osm>{}</osm>".format(way_xml(i, 1, 10, {"highway": "residential", "name": "Street {}".format(i)})))
+        vandalised = way_xml(i, 2, 20, {"highway": "residential", "name": "Vandalised {}".format(i)}, uid=99)
+        store.add_xml("<osm>{}</osm>".format(vandalised))
+        osc.append(vandalised)
+    return store, "<osmChange version=\"0.6\"><modify>{}</modify></osmChange>".format("".join(osc))
+
+
+def make_configuration(server, **kwargs):
+    config = {"user": "testUser", "uid": 12458, "password": "123secret", "api_url": server.api_url, "http_retry_base_delay": 0.001}
+    config.update(kwargs)
+    configuration = Configuration(config)
+    configuration.implementation = IMPLEMENTATION
+    configuration.comment = "Revert vandalism"
+    return configuration
+
+
+def read_osc(directory, osc):
+    path = os.path.join(directory, "input.osc")
+    with open(path, "w") as osc_file:
+        osc_file.write(osc)
+    objects = []
+    InputHandler(objects).apply_file(path)
+    return objects
+
+
+@mock.patch("sys.stderr", new=mock.MagicMock())
+class MockApiServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def configuration(self, server, **kwargs):
+        return make_configuration(server, **kwargs)
+
+    def read_input(self, osc):
+        return read_osc(self.tmp_dir.name, osc)
+
+    def test_fixture_directory(self):
+        store = FixtureStore()
+        store.load_directory(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+        with MockApiServer(store) as server:
+            client = OsmApiClient(self.configuration(server))
+            response, latest = client.get_latest_version("way", 33072216)
+            self.assertEqual(response, OsmApiResponse.EXISTS)
+            self.assertEqual(latest.version, 7)
+            response, history = client.get_history("way", 33072216)
+            self.assertEqual([v.version for v in history], [5, 6, 7])
+            versions = client.get_versions("way", [(33072216, 5), (33072216, 6)])
+            self.assertEqual(sorted(versions), [("way", 33072216, 5), ("way", 33072216, 6)])
+            self.assertEqual(client.get_latest_version("way", 1)[0], OsmApiResponse.NOT_FOUND)
+
+    def test_revert(self):
+        store, osc = make_store(5)
+        with MockApiServer(store) as server:
+            Worker(self.read_input(osc), self.configuration(server)).work()
+        for i in range(1, 6):
+            latest = store.version("way", i)
+            self.assertEqual(latest.get("version"), "3")
+            self.assertEqual(latest.find("tag[@k='name']").get("v"), "Street {}".format(i))
+        self.assertEqual(server.changesets, {MockApiServer.FIRST_CHANGESET: {"open": False, "objects": 5}})
+        self.assertEqual(sorted(c[0] for c in server.comments), [20, MockApiServer.FIRST_CHANGESET])
+
+    def test_prefilter(self):
+        store, osc = make_store(2)
+        building = way_xml(3, 2, 20, {"building": "yes", "name": "Vandalised"}, uid=99)
+        store.add_xml("<osm>{}{}</osm>".format(way_xml(3, 1, 10, {"building": "yes", "name": "House"}), building))
+        osc = osc.replace("</modify>", building + "</modify>")
+        with MockApiServer(store) as server:
+            worker = Worker(self.read_input(osc), self.configuration(server))
+            worker.work()
+        self.assertEqual((worker.group_count, worker.filtered_count), (3, 1))
+        self.assertNotIn("/api/0.6/way/3", [r[1] for r in server.requests])
+        self.assertEqual(store.version("way", 3).get("version"), "2")
+
+    def test_error_injection(self):
+        store, osc = make_store(10)
+        with MockApiServer(store, error_rate=0.3) as server:
+            with self.assertLogs(level="WARNING"):
+                Worker(self.read_input(osc), self.configuration(server, http_max_retries=10)).work()
+        self.assertIn(503, [r[2] for r in server.requests])
+        for i in range(1, 11):
+            self.assertEqual(store.version("way", i).get("version"), "3")
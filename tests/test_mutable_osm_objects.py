@@ -0,0 +1,59 @@
+import copy
+import pickle
+import unittest
+
+from machina_reparanda.mutable_osm_objects import MutableWayNodeList, MutableNodeRef, MutableLocation, MutableTagList, UNDEFINED_LOCATION
+
+
+class MutableWayNodeListTestCase(unittest.TestCase):
+    def test_without_locations(self):
+        nodes = MutableWayNodeList([1, 2, 3])
+        self.assertEqual([n.ref for n in nodes], [1, 2, 3])
+        self.assertFalse(nodes[0].location.valid())
+        self.assertIsNone(nodes._x)
+        nodes[1] = MutableNodeRef(ref=5)
+        self.assertEqual(list(nodes.refs()), [1, 5, 3])
+        self.assertEqual(len(nodes), 3)
+
+    def test_with_locations(self):
+        nodes = MutableWayNodeList([1, 2])
+        nodes[1] = MutableNodeRef(ref=7, location=MutableLocation(x=95000000, y=521000000))
+        nodes.append(8)
+        self.assertFalse(nodes[0].location.valid())
+        self.assertAlmostEqual(nodes[1].location.lat, 52.1)
+        self.assertAlmostEqual(nodes[1].location.lon, 9.5)
+        self.assertFalse(nodes[2].location.valid())
+        self.assertEqual([n.ref for n in nodes], [1, 7, 8])
+
+    def test_copy_and_pickle(self):
+        nodes = MutableWayNodeList([1, 2, 3])
+        duplicate = copy.deepcopy(nodes)
+        duplicate[0] = 4
+        self.assertEqual(list(nodes.refs()), [1, 2, 3])
+        self.assertEqual(pickle.loads(pickle.dumps(nodes)), nodes)
+        self.assertNotEqual(duplicate, nodes)
+
+    def test_node_refs_are_copies(self):
+        nodes = MutableWayNodeList([1, 2])
+        node_ref = nodes[1]
+        node_ref.ref = 9
+        self.assertEqual(list(nodes.refs()), [1, 2])
+        nodes[1] = node_ref
+        self.assertEqual(list(nodes.refs()), [1, 9])
+
+    def test_undefined_location_is_immutable(self):
+        nodes = MutableWayNodeList([1])
+        with self.assertRaises(AttributeError):
+            nodes[0].location.x = 95000000
+        self.assertFalse(MutableNodeRef(ref=2).location.valid())
+        self.assertIs(copy.deepcopy(UNDEFINED_LOCATION), UNDEFINED_LOCATION)
+        self.assertIs(pickle.loads(pickle.dumps(MutableNodeRef(ref=2))).location, UNDEFINED_LOCATION)
+
+
+class MutableTagListTestCase(unittest.TestCase):
+    def test_pickle(self):
+        tags = MutableTagList([])
+        tags["highway"] = "residential"
+        restored = pickle.loads(pickle.dumps(tags))
+        self.assertEqual(restored["highway"], "residential")
+        self.assertIn("highway", restored)
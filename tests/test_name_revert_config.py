@@ -57,3 +57,17 @@ class NameRevertTestCase(unittest.TestCase):
         self.assertEqual(result.version, 4)
         self.assertEqual(len(cs), 1)
         self.assertIn(108213, cs)
+
+    def test_prefilter(self):
+        code, latest = self.data_source.get_latest_version("way", 257006627)
+        self.assertTrue(self.revert_impl.prefilter([latest]))
+        latest.tags.pop("highway")
+        self.assertFalse(self.revert_impl.prefilter([latest]))
+        self.assertTrue(self.revert_impl.prefilter([latest, latest]))
+
+    def test_multiple_versions(self):
+        code, v6 = self.data_source.get_version("way", 33072216, 6)
+        code, v7 = self.data_source.get_version("way", 33072216, 7)
+        result, cs = self.revert_impl.handle_multiple_versions([v6, v7])
+        self.assertIsNone(result)
+        self.assertIsNone(cs)
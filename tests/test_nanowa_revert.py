@@ -1,5 +1,6 @@
 
 import unittest
+from unittest import mock
 
 from machina_reparanda.configuration import Configuration
 from implementations.nanowa import RevertImplementation
@@ -29,6 +30,29 @@ class NameRevertTestCase(unittest.TestCase):
         self.assertEqual(latest.nodes, result.nodes)
         self.assertEqual(result.version, 3)
 
+    def test_prefilter(self):
+        code, latest = self.data_source.get_latest_version("way", 1)
+        code, previous = self.data_source.get_version("way", 1, 2)
+        # without a local copy of the previous version, only objects created by the changesets are dropped
+        self.assertTrue(self.revert_impl.prefilter([latest]))
+        with mock.patch.object(self.data_source, "get_local_version", return_value=previous) as get_local_version:
+            # wikipedia and source:geometry were removed
+            self.assertTrue(self.revert_impl.prefilter([latest]))
+            get_local_version.assert_called_once_with("way", 1, 2)
+            # no key of the tag rules was removed
+            self.assertFalse(self.revert_impl.prefilter([previous]))
+
+    def test_precomputed_latest_version(self):
+        code, latest = self.data_source.get_latest_version("way", 1)
+        code, obj = self.data_source.get_latest_version("way", 1)
+        self.revert_impl.set_latest_versions({("way", 1): (code, latest)})
+        with mock.patch.object(self.data_source, "get_latest_version") as get_latest_version:
+            response, result, is_latest = self.revert_impl.get_latest(obj)
+        get_latest_version.assert_not_called()
+        self.assertIs(result, latest)
+        self.assertTrue(is_latest)
+        self.assertEqual(self.revert_impl.latest_versions, {})
+
     def test_already_reverted(self):
         code, v2 = self.data_source.get_version("way", 2, 2)
         code, v3 = self.data_source.get_version("way", 2, 3)
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+
+import osmium
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.input_handler import InputHandler
+from machina_reparanda.mutable_osm_objects import MutableTagList, MutableNodeRefList, MutableLocation
+from machina_reparanda.osc_writer import OsmChangeWriter, apply_osc, read_sidecar
+
+
+class OsmChangeWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "revert.osc")
+        self.config = Configuration({"user": "testUser", "uid": 12458, "password": "123secret"})
+        self.config.comment = "Revert vandalism"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        writer = OsmChangeWriter(self.path, self.config)
+        tags = MutableTagList([])
+        tags["name"] = "Fish & Chips"
+        nodes = MutableNodeRefList()
+        nodes.append(3)
+        nodes.append(4)
+        writer.handle_object(osmium.osm.mutable.Way(id=7, version=2, visible=True, tags=tags, nodes=nodes), {10, 11})
+        node_tags = MutableTagList([])
+        node_tags["amenity"] = "bench"
+        location = MutableLocation(x=95000000, y=475000000)
+        writer.handle_object(osmium.osm.mutable.Node(id=3, version=5, visible=True, tags=node_tags, location=location), {12})
+        writer.handle_object(None, None)
+        writer.close_changeset()
+        self.assertEqual(writer.object_count, 2)
+
+        objects = []
+        InputHandler(objects).apply_file(self.path)
+        self.assertEqual(len(objects), 2)
+        way, node = objects
+        self.assertEqual((way.id, way.version), (7, 2))
+        self.assertEqual(way.tags["name"], "Fish & Chips")
+        self.assertEqual([nd.ref for nd in way.nodes], [3, 4])
+        self.assertEqual((node.id, node.version), (3, 5))
+        self.assertAlmostEqual(node.location.lat, 47.5)
+        self.assertAlmostEqual(node.location.lon, 9.5)
+
+        comment, object_changesets = read_sidecar(self.path)
+        self.assertEqual(comment, "Revert vandalism")
+        self.assertEqual(object_changesets, {("way", 7): {10, 11}, ("node", 3): {12}})
+
+    def test_sidecar_of_interrupted_run(self):
+        writer = OsmChangeWriter(self.path, self.config)
+        writer.handle_object(osmium.osm.mutable.Way(id=7, version=2, visible=True, tags=MutableTagList([]), nodes=MutableNodeRefList()), {10})
+        writer.handle_object(osmium.osm.mutable.Way(id=8, version=3, visible=True, tags=MutableTagList([]), nodes=MutableNodeRefList()), {11})
+        # the run is interrupted while the next line is written, the writer is never closed
+        writer.sidecar.write("{\"object\": \"way/9\", \"chan")
+        writer.sidecar.flush()
+        with open(self.path, "r", encoding="utf-8") as osc_file:
+            self.assertIn("id=\"8\"", osc_file.read())
+        with self.assertLogs(level="WARNING"):
+            comment, object_changesets = read_sidecar(self.path)
+        self.assertEqual(comment, "Revert vandalism")
+        self.assertEqual(object_changesets, {("way", 7): {10}, ("way", 8): {11}})
+        writer.file.close()
+        writer.sidecar.close()
+
+    def test_apply_interrupted_osc(self):
+        writer = OsmChangeWriter(self.path, self.config)
+        writer.handle_object(osmium.osm.mutable.Way(id=7, version=2, visible=True, tags=MutableTagList([]), nodes=MutableNodeRefList()), {10})
+        writer.handle_object(osmium.osm.mutable.Way(id=8, version=3, visible=True, tags=MutableTagList([]), nodes=MutableNodeRefList()), {11})
+        # the run is interrupted while the next object is written, the writer is never closed
+        writer.file.write(b"  <way id=\"9\" changeset=\"0\" version=\"1\" visible=\"true\" user=\"testUser\">\n    <nd r")
+        writer.file.close()
+        writer.sidecar.close()
+        objects = []
+        with self.assertLogs(level="WARNING"):
+            apply_osc(InputHandler(objects), self.path)
+        self.assertEqual([way.id for way in objects], [7, 8])
+        # a complete file is read as it is
+        with open(self.path, "rb") as osc_file:
+            data = osc_file.read()
+        with open(self.path, "wb") as osc_file:
+            osc_file.write(data[:data.rfind(b"  <way id=\"9\"")] + b"</modify>\n</osmChange>\n")
+        objects = []
+        apply_osc(InputHandler(objects), self.path)
+        self.assertEqual([way.id for way in objects], [7, 8])
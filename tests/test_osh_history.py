@@ -0,0 +1,104 @@
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from machina_reparanda.osh_history import HistoryFile, HistoryIndexBuilder, OshHistoryProvider
+from machina_reparanda.osm_api_functions import OsmApiResponse
+from machina_reparanda.worker import Worker
+
+from tests.mock_api_server import MockApiServer, way_xml
+from tests.test_mock_api_server import make_configuration, make_store, read_osc
+
+OSH = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+<node id="1" version="1" changeset="1" timestamp="2018-01-01T00:00:00Z" user="a" uid="1" visible="true" lat="1" lon="2"/>
+<node id="1" version="2" changeset="2" timestamp="2018-01-01T00:00:00Z" user="a" uid="1" visible="false"/>
+{}
+</osm>
+"""
+
+
+class OshHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "history.osh")
+        # version 2 of way 5 is missing
+        self.write_osh(way_xml(5, 1, 10, {"name": "A"}) + way_xml(5, 3, 12, {"name": "C"}))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_osh(self, ways):
+        with open(self.path, "w") as osh:
+            osh.write(OSH.format(ways))
+
+    def test_index(self):
+        history_file = HistoryFile(self.path)
+        self.assertTrue(os.path.exists(self.path + ".idx"))
+        self.assertEqual(history_file.count, 4)
+        self.assertEqual(sorted(history_file.versions("way", 5)), [1, 3])
+        self.assertEqual(history_file.versions("way", 1), {})
+        self.assertEqual(history_file.versions("relation", 5), {})
+        node = history_file.load(history_file.versions("node", 1)[2])
+        self.assertFalse(node.visible)
+        history_file.close()
+        # the index is reused as long as the source is unchanged
+        with mock.patch("machina_reparanda.osh_history.build_history_index") as build:
+            HistoryFile(self.path).close()
+        build.assert_not_called()
+        self.write_osh(way_xml(5, 1, 10, {"name": "A"}))
+        history_file = HistoryFile(self.path)
+        self.assertEqual(history_file.count, 3)
+        history_file.close()
+
+    def test_unsorted_chunks(self):
+        relation = "<relation id=\"2\" version=\"1\" changeset=\"3\" timestamp=\"2018-01-01T00:00:00Z\" user=\"b\" uid=\"2\" visible=\"true\">" \
+            "<member type=\"way\" ref=\"5\" role=\"outer\"/><tag k=\"type\" v=\"multipolygon\"/></relation>"
+        self.write_osh(way_xml(5, 3, 12, {"name": "Straße"}) + relation + way_xml(4, 1, 10, {}) + way_xml(5, 1, 10, {"name": "A"}))
+        with mock.patch.object(HistoryIndexBuilder, "CHUNK_SIZE", 2):
+            history_file = HistoryFile(self.path)
+        self.assertEqual([history_file._entry(i)[:3] for i in range(history_file.count)], [(1, 1, 1), (1, 1, 2), (2, 4, 1), (2, 5, 1), (2, 5, 3), (3, 2, 1)])
+        way = history_file.load(history_file.versions("way", 5)[3])
+        self.assertEqual((way.version, way.changeset, way.user, way.tags["name"], list(way.nodes.refs())), (3, 12, "someone", "Straße", [1, 2]))
+        self.assertEqual(way.timestamp, datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc))
+        relation = history_file.load(history_file.versions("relation", 2)[1])
+        self.assertEqual([(m.type, m.ref, m.role) for m in relation.members], [("w", 5, "outer")])
+        node = history_file.load(history_file.versions("node", 1)[1])
+        self.assertEqual((node.location.lat, node.location.lon), (1, 2))
+        history_file.close()
+
+    def test_provider(self):
+        client = mock.Mock()
+        client.get_version.return_value = (OsmApiResponse.EXISTS, "from API")
+        client.get_versions.return_value = {("way", 5, 4): "from API"}
+        provider = OshHistoryProvider(client, HistoryFile(self.path))
+        response, obj = provider.get_version("way", 5, 3)
+        self.assertEqual((response, obj.tags["name"]), (OsmApiResponse.EXISTS, "C"))
+        # a missing version is reported as not found instead of redacted
+        self.assertEqual(provider.get_version("way", 5, 2), (OsmApiResponse.NOT_FOUND, None))
+        self.assertEqual(provider.get_version("way", 5, 2, False), (OsmApiResponse.NOT_FOUND, None))
+        self.assertEqual(provider.get_version("way", 5, 4), (OsmApiResponse.EXISTS, "from API"))
+        response, history = provider.get_history("way", 5)
+        self.assertEqual([v.version for v in history], [1, 3])
+        versions = provider.get_versions("way", [(5, 1), (5, 4)])
+        self.assertEqual(sorted(versions), [("way", 5, 1), ("way", 5, 4)])
+        client.get_versions.assert_called_once_with("way", [(5, 4)])
+        self.assertEqual((provider.hits, provider.misses), (5, 2))
+        client.get_local_version.return_value = None
+        self.assertEqual(provider.get_local_version("way", 5, 1).version, 1)
+        self.assertIsNone(provider.get_local_version("way", 5, 2))
+        client.get_local_version.assert_called_once_with("way", 5, 2)
+        provider.history_file.close()
+
+    @mock.patch("sys.stderr", new=mock.MagicMock())
+    def test_revert(self):
+        store, osc = make_store(3)
+        self.write_osh("".join(way_xml(i, 1, 10, {"highway": "residential", "name": "Street {}".format(i)}) for i in range(1, 4)))
+        with MockApiServer(store) as server:
+            configuration = make_configuration(server, history_file=self.path, use_history=False, prefetch_groups=0)
+            Worker(read_osc(self.tmp_dir.name, osc), configuration).work()
+        self.assertEqual([store.version("way", i).get("version") for i in range(1, 4)], ["3", "3", "3"])
+        # only the latest versions are requested
+        self.assertEqual(sorted(r[1] for r in server.requests if r[0] == "GET"), ["/api/0.6/way/1", "/api/0.6/way/2", "/api/0.6/way/3"])
@@ -0,0 +1,56 @@
+import unittest
+
+import osmium
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.mutable_osm_objects import MutableTagList, MutableNodeRefList
+from machina_reparanda.osm_xml_builder import OsmXmlBuilder, quote_attribute
+from machina_reparanda.revert_exceptions import TagInvalidException
+
+
+class Member:
+    def __init__(self, mtype, ref, role):
+        self.type = mtype
+        self.ref = ref
+        self.role = role
+
+
+class OsmXmlBuilderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.builder = OsmXmlBuilder(Configuration({"user": "A&B", "uid": 1, "password": "secret"}))
+        self.builder.set_changeset(42)
+
+    def test_quote_attribute(self):
+        self.assertEqual(quote_attribute("Straße"), "\"Straße\"")
+        self.assertEqual(quote_attribute("a & <b>"), "\"a &amp; &lt;b&gt;\"")
+        self.assertEqual(quote_attribute("say \"hi\""), "'say \"hi\"'")
+        self.assertEqual(quote_attribute("a\nb"), "\"a&#10;b\"")
+
+    def test_way(self):
+        tags = MutableTagList([])
+        tags["name"] = "Fish & Chips"
+        nodes = MutableNodeRefList()
+        nodes.append(3)
+        nodes.append(4)
+        way = osmium.osm.mutable.Way(id=7, version=2, visible=True, tags=tags, nodes=nodes)
+        self.assertEqual(self.builder.way(way), b"<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<osm version=\"0.6\">\n"
+                         b"  <way id=\"7\" changeset=\"42\" version=\"2\" visible=\"true\" user=\"A&amp;B\">\n"
+                         b"    <nd ref=\"3\"/>\n    <nd ref=\"4\"/>\n    <tag k=\"name\" v=\"Fish &amp; Chips\"/>\n  </way>\n</osm>\n")
+
+    def test_osm_change(self):
+        tags = MutableTagList([])
+        tags["type"] = "route"
+        tags["name"] = "Straße"
+        relation = osmium.osm.mutable.Relation(id=1, version=5, visible=True, tags=tags, members=[Member("n", 1, ""), Member("w", 2, "<forward>")])
+        xml = self.builder.osm_change([relation])
+        self.assertTrue(xml.startswith(b"<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<osmChange version=\"0.6\" generator=\"machina_reparanda\">\n<modify>\n"))
+        self.assertIn(b"    <member type=\"node\" ref=\"1\" role=\"\"/>\n    <member type=\"way\" ref=\"2\" role=\"&lt;forward&gt;\"/>\n", xml)
+        self.assertIn("v=\"Straße\"".encode("utf-8"), xml)
+        self.assertTrue(xml.endswith(b"  </relation>\n</modify>\n</osmChange>\n"))
+
+    def test_too_long_value(self):
+        tags = MutableTagList([])
+        tags["note"] = "x" * 256
+        way = osmium.osm.mutable.Way(id=7, version=2, visible=True, tags=tags, nodes=[])
+        with self.assertRaises(TagInvalidException):
+            self.builder.way(way)
@@ -0,0 +1,106 @@
+import threading
+import unittest
+
+import osmium
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.osm_api_functions import OsmApiResponse
+from machina_reparanda.prefetcher import PrefetchingApiClient
+from machina_reparanda.sort_functions import group_by_type_id
+
+from tests.object_factory import make_way
+
+
+class CountingClient:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def get_latest_version(self, osm_type, osm_id):
+        with self.lock:
+            self.calls.append(("latest", osm_type, osm_id))
+        return OsmApiResponse.EXISTS, osmium.osm.mutable.Way(id=osm_id, version=10)
+
+    def get_version(self, osm_type, osm_id, version, fallback_if_redacted=True):
+        with self.lock:
+            self.calls.append((osm_type, osm_id, version))
+        return OsmApiResponse.EXISTS, osmium.osm.mutable.Way(id=osm_id, version=version)
+
+    def get_latest_versions(self, osm_type, osm_ids):
+        with self.lock:
+            self.calls.append(("latest_versions", osm_type, tuple(osm_ids)))
+        return {(osm_type, i, 10): osmium.osm.mutable.Way(id=i, version=10, visible=(i != 2)) for i in osm_ids}
+
+    def get_versions(self, osm_type, id_versions):
+        with self.lock:
+            self.calls.append(("versions", osm_type, tuple(id_versions)))
+        return {(osm_type, i, v): osmium.osm.mutable.Way(id=i, version=v) for i, v in id_versions}
+
+
+class PrefetcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.config = Configuration({"user": "testUser", "uid": 12458, "password": "123secret", "prefetch_groups": 3, "batch_size": 0})
+        self.objects = [make_way(1, 2), make_way(2, 1), make_way(3, 4), make_way(3, 5), make_way(4, 7)]
+
+    def test_order_and_prefetched_results(self):
+        backend = CountingClient()
+        client = PrefetchingApiClient(backend, self.config)
+        seen = []
+        for objects in client.prefetch(group_by_type_id(self.objects)):
+            seen.append([(o.id, o.version) for o in objects])
+            code, latest = client.get_latest_version("way", objects[0].id)
+            self.assertEqual(latest.id, objects[0].id)
+            if objects[0].version > 1:
+                code, prev = client.get_version("way", objects[0].id, objects[0].version - 1)
+                self.assertEqual(prev.version, objects[0].version - 1)
+        client.close()
+        self.assertEqual(seen, [[(1, 2)], [(2, 1)], [(3, 4), (3, 5)], [(4, 7)]])
+        # every version has been downloaded exactly once
+        self.assertEqual(len(backend.calls), 7)
+        self.assertEqual(len(set(backend.calls)), 7)
+
+    def test_disabled(self):
+        self.config.prefetch_groups = 0
+        backend = CountingClient()
+        client = PrefetchingApiClient(backend, self.config)
+        groups = list(client.prefetch(group_by_type_id(self.objects)))
+        self.assertEqual(len(groups), 4)
+        self.assertEqual(backend.calls, [])
+
+    def test_multi_fetch(self):
+        self.config.batch_size = 2
+        backend = CountingClient()
+        client = PrefetchingApiClient(backend, self.config)
+        seen = []
+        for objects in client.prefetch(group_by_type_id(self.objects)):
+            seen.append(objects[0].id)
+            code, latest = client.get_latest_version("way", objects[0].id)
+            if objects[0].id == 2:
+                self.assertEqual(code, OsmApiResponse.DELETED)
+            else:
+                self.assertEqual(latest.id, objects[0].id)
+            if objects[0].version > 1:
+                code, prev = client.get_version("way", objects[0].id, objects[0].version - 1)
+                self.assertEqual(prev.version, objects[0].version - 1)
+        client.close()
+        self.assertEqual(seen, [1, 2, 3, 4])
+        self.assertEqual(sorted(backend.calls), [
+            ("latest_versions", "way", (1, 2)),
+            ("latest_versions", "way", (3, 4)),
+            ("versions", "way", ((1, 1),)),
+            ("versions", "way", ((3, 3), (4, 6)))
+        ])
+
+    def test_block_fits_lookahead(self):
+        self.config.batch_size = 100
+        self.config.prefetch_groups = 2
+        backend = CountingClient()
+        client = PrefetchingApiClient(backend, self.config)
+        self.assertEqual((client.lookahead, client.block_size), (2, 2))
+        for objects in client.prefetch(group_by_type_id(self.objects)):
+            client.get_latest_version("way", objects[0].id)
+        client.close()
+        self.assertEqual(sorted(c for c in backend.calls if c[0] == "latest_versions"), [
+            ("latest_versions", "way", (1, 2)),
+            ("latest_versions", "way", (3, 4))
+        ])
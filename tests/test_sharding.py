@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.http_session import HttpSession
+from machina_reparanda.sharding import ShardCoordinator, existing_shard_paths, shard_configuration, write_partitions
+from machina_reparanda.sorted_input import read_run
+
+from tests.mock_api_server import MockApiServer
+from tests.test_mock_api_server import make_configuration, make_store, read_osc
+
+
+@mock.patch("sys.stderr", new=mock.MagicMock())
+class ShardingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_partitions(self):
+        store, osc = make_store(5)
+        objects = read_osc(self.tmp_dir.name, osc)
+        objects.insert(1, objects[0])  # two versions of way 1
+        paths = write_partitions(objects, 2, self.tmp_dir.name)
+        shards = [[obj.id for obj in read_run(path)] for path in paths]
+        self.assertEqual(shards, [[1, 1, 2, 3], [4, 5]])
+
+    def test_shard_configuration(self):
+        configuration = Configuration({"user": "testUser", "uid": 12458, "password": "123secret", "journal_path": "journal"})
+        configuration.reuse_changeset = 7
+        first = shard_configuration(configuration, 0, 2)
+        second = shard_configuration(configuration, 1, 2)
+        self.assertEqual((first.journal_path, second.journal_path), ("journal.shard0", "journal.shard1"))
+        self.assertEqual((first.reuse_changeset, second.reuse_changeset), (7, 0))
+        self.assertFalse(second.comment_reverted)
+        self.assertTrue(configuration.comment_reverted)
+
+    def test_shard_rate(self):
+        configuration = Configuration({"user": "testUser", "uid": 12458, "password": "123secret", "http_rate": 12.0, "http_min_rate": 0.6})
+        shards = [shard_configuration(configuration, i, 3) for i in range(3)]
+        for shard in shards:
+            self.assertAlmostEqual(shard.http_rate, 4.0)
+            self.assertAlmostEqual(shard.http_min_rate, 0.2)
+            self.assertAlmostEqual(HttpSession(shard).rate_limiter.rate, 4.0)
+        self.assertAlmostEqual(sum(shard.http_rate for shard in shards), configuration.http_rate)
+        self.assertEqual(configuration.http_rate, 12.0)
+
+    def test_revert(self):
+        store, osc = make_store(9)
+        objects = read_osc(self.tmp_dir.name, osc)
+        with MockApiServer(store) as server:
+            configuration = make_configuration(server, journal_path=os.path.join(self.tmp_dir.name, "journal"), metrics_file=os.path.join(self.tmp_dir.name, "metrics.json"))
+            coordinator = ShardCoordinator(configuration, 3, self.tmp_dir.name)
+            coordinator.work(iter(objects))
+        for i in range(1, 10):
+            self.assertEqual(store.version("way", i).get("version"), "3")
+        self.assertEqual(coordinator.used_changesets, set(server.changesets))
+        self.assertEqual(len(server.changesets), 3)
+        self.assertEqual(coordinator.reverted_changesets, {20})
+        comments = [text for cs_id, text in server.comments if cs_id == 20]
+        self.assertEqual(len(comments), 1)
+        for cs_id in server.changesets:
+            self.assertIn(str(cs_id), comments[0])
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, "journal.shard2")))
+        self.assertEqual(existing_shard_paths(os.path.join(self.tmp_dir.name, "journal")), [os.path.join(self.tmp_dir.name, "journal.shard{}".format(i)) for i in range(3)])
+        # the metrics of all shards are merged
+        self.assertEqual(coordinator.metrics.histograms[("phase", "work")].count, 3)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, "metrics.json")))
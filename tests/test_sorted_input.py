@@ -0,0 +1,40 @@
+import glob
+import os
+import unittest
+
+from machina_reparanda.input_handler import InputHandler
+from machina_reparanda.sort_functions import type_id_version
+from machina_reparanda.sorted_input import ExternalSorter
+
+
+class ExternalSorterTestCase(unittest.TestCase):
+    def setUp(self):
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fake", "way")
+        self.files = sorted(glob.glob(os.path.join(data_dir, "*", "*.osm")))
+        expected = []
+        input_handler = InputHandler(expected)
+        for filename in self.files:
+            input_handler.apply_file(filename)
+        expected.sort(key=type_id_version)
+        self.expected = [type_id_version(obj) for obj in expected]
+
+    def check_sorter(self, run_size, workers=1):
+        sorter = ExternalSorter(run_size)
+        sorter.add_files(self.files, workers)
+        tmp_dir = sorter.tmp_dir.name
+        result = [type_id_version(obj) for obj in sorter.sorted_objects()]
+        self.assertEqual(result, self.expected)
+        self.assertFalse(os.path.exists(tmp_dir))
+        return sorter
+
+    def test_in_memory(self):
+        sorter = self.check_sorter(1000)
+        self.assertEqual(sorter.buffer.runs, [])
+
+    def test_spilled_runs(self):
+        sorter = self.check_sorter(3)
+        self.assertGreater(len(sorter.buffer.runs), 2)
+
+    def test_worker_processes(self):
+        sorter = self.check_sorter(1000, 3)
+        self.assertGreater(len(sorter.buffer.runs), 1)
@@ -0,0 +1,36 @@
+import unittest
+
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.tag_rules import TagRuleSet
+from implementations.nanowa import RevertImplementation
+
+from tests.mock_data_provider import MockDataProvider
+
+
+class TagRuleSetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rules = TagRuleSet(keys=["source"], prefixes=["source:", "wikipedia:"], patterns=["name(:[a-z]{2})?"])
+
+    def test_matches(self):
+        for key in ["source", "source:geometry", "wikipedia:de", "name", "name:de"]:
+            self.assertTrue(self.rules.matches(key), key)
+        for key in ["sources", "wikipedia", "name:left", "highway", "old_name"]:
+            self.assertFalse(self.rules.matches(key), key)
+        # results are remembered
+        self.assertIn("highway", self.rules._memo)
+
+    def test_diff(self):
+        old = {"source": "survey", "source:geometry": "bing", "name": "A", "highway": "primary"}
+        new = {"source:geometry": "esri", "name": "A", "name:de": "B", "surface": "asphalt"}
+        diff = self.rules.diff(old, new)
+        self.assertEqual(diff.removed, {"source": "survey"})
+        self.assertEqual(diff.changed, {"source:geometry": ("bing", "esri")})
+        self.assertEqual(diff.added, {"name:de": "B"})
+        self.assertFalse(self.rules.diff(new, new))
+        self.assertEqual(self.rules.select(new), {"source:geometry": "esri", "name": "A", "name:de": "B"})
+
+    def test_configured_implementation(self):
+        config = Configuration({"user": "testUser", "uid": 12458, "password": "123secret", "tag_rules": {"keys": ["name"]}})
+        revert_impl = RevertImplementation(config, MockDataProvider(config, fake_data=True))
+        self.assertTrue(revert_impl.tag_rules.matches("name"))
+        self.assertFalse(revert_impl.tag_rules.matches("wikipedia"))
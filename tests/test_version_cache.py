@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+from machina_reparanda.version_cache import VersionCache
+
+from tests.object_factory import make_way
+
+
+class VersionCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hit_and_miss(self):
+        cache = VersionCache(self.path)
+        self.assertIsNone(cache.get("way", 1, 2))
+        cache.put("way", make_way(1, 2, tags={"name": "Way 1 v2"}))
+        obj = cache.get("way", 1, 2)
+        self.assertEqual(obj.tags["name"], "Way 1 v2")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.close()
+
+    def test_persistence(self):
+        cache = VersionCache(self.path)
+        cache.put("way", make_way(1, 2))
+        cache.close()
+        cache = VersionCache(self.path)
+        self.assertIsNotNone(cache.get("way", 1, 2))
+        self.assertIsNone(cache.get("node", 1, 2))
+        self.assertGreater(cache.size, 0)
+        cache.close()
+
+    def test_eviction(self):
+        cache = VersionCache(self.path)
+        cache.put("way", make_way(1, 1))
+        entry_size = cache.size
+        cache.close()
+        cache = VersionCache(self.path, max_size=entry_size * 5)
+        for i in range(2, 11):
+            cache.put("way", make_way(i, 1))
+            # keep way 1 recently used
+            self.assertIsNotNone(cache.get("way", 1, 1))
+        self.assertLessEqual(cache.size, entry_size * 5)
+        self.assertGreater(cache.evictions, 0)
+        self.assertIsNotNone(cache.get("way", 1, 1))
+        self.assertIsNotNone(cache.get("way", 10, 1))
+        self.assertIsNone(cache.get("way", 2, 1))
+        cache.close()
+
+    def test_latest_ttl(self):
+        cache = VersionCache(self.path)
+        cache.put_latest("way", make_way(1, 3))
+        self.assertIsNone(cache.get_latest("way", 1))
+        cache.close()
+        cache = VersionCache(self.path, latest_ttl=3600)
+        cache.put_latest("way", make_way(1, 3))
+        self.assertEqual(cache.get_latest("way", 1).version, 3)
+        cache.invalidate_latest("way", 1)
+        self.assertIsNone(cache.get_latest("way", 1))
+        self.assertEqual(cache.get("way", 1, 3).version, 3)
+        cache.close()
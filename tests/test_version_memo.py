@@ -0,0 +1,56 @@
+import unittest
+from unittest import mock
+
+from machina_reparanda.osm_api_functions import OsmApiClient, OsmApiResponse
+from machina_reparanda.update_writer import OsmApiUploader
+from machina_reparanda.version_memo import VersionMemo
+
+from tests.mock_api_server import FixtureStore, MockApiServer, way_xml
+from tests.object_factory import make_way
+from tests.test_mock_api_server import make_configuration
+
+
+class VersionMemoTestCase(unittest.TestCase):
+    def test_lru(self):
+        memo = VersionMemo(2)
+        memo.put("way", make_way(1, 1))
+        memo.put("way", make_way(1, 2), latest=True)
+        self.assertEqual(memo.get("way", 1, 1).version, 1)
+        memo.put("way", make_way(2, 1))
+        # version 2 of way 1 was used least recently
+        self.assertIsNone(memo.get("way", 1, 2))
+        self.assertIsNone(memo.get_latest("way", 1))
+        self.assertEqual((memo.hits, memo.misses, memo.evictions, len(memo)), (1, 2, 1, 2))
+
+    def test_copies(self):
+        memo = VersionMemo(10)
+        way = make_way(1, 1)
+        memo.put("way", way, latest=True)
+        way.tags["name"] = "changed"
+        copy = memo.get_latest("way", 1)
+        copy.tags["name"] = "changed again"
+        self.assertNotIn("name", memo.get("way", 1, 1).tags)
+        memo.invalidate_latest("way", 1)
+        self.assertIsNone(memo.get_latest("way", 1))
+        self.assertIsNotNone(memo.get("way", 1, 1))
+        self.assertEqual(memo.invalidations, 1)
+
+    @mock.patch("sys.stderr", new=mock.MagicMock())
+    def test_invalidate_after_upload(self):
+        store = FixtureStore()
+        store.add_xml("<osm>{}</osm>".format(way_xml(1, 1, 10, {"name": "A"})))
+        with MockApiServer(store) as server:
+            configuration = make_configuration(server, upload_mode="single", memo_size=10)
+            client = OsmApiClient(configuration)
+            response, latest = client.get_latest_version("way", 1)
+            self.assertEqual(client.get_latest_version("way", 1)[1].version, 1)
+            self.assertEqual(client.get_version("way", 1, 1)[0], OsmApiResponse.EXISTS)
+            self.assertEqual(len(server.requests), 1)
+            uploader = OsmApiUploader(configuration)
+            uploader.upload_listeners.append(client.object_uploaded)
+            latest.tags["name"] = "B"
+            uploader.handle_object(latest, {10})
+            uploader.close_changeset()
+            response, latest = client.get_latest_version("way", 1)
+        self.assertEqual((latest.version, latest.tags["name"]), (2, "B"))
+        self.assertEqual(client.memo.invalidations, 1)
@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+
+"""
+© 2018 Michael Reichert
+
+This file is part of Machina Reparanda.
+
+Machina Reparanda is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 2 of the License, or
+(at your option) any later version.
+
+Machina Reparanda is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Machina Reparanda. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import argparse
+import json
+import logging
+from machina_reparanda.configuration import Configuration
+from machina_reparanda.http_session import HttpSession
+from machina_reparanda.input_handler import InputHandler
+from machina_reparanda.journal import Journal
+from machina_reparanda.osc_writer import apply_osc, read_sidecar
+from machina_reparanda.sort_functions import obj_to_str
+from machina_reparanda.update_writer import OsmApiUploader
+
+
+class UploadSink():
+    """List-like target for InputHandler which uploads every object as soon as it has been read."""
+    def __init__(self, uploader, object_changesets, journal=None):
+        self.uploader = uploader
+        self.object_changesets = object_changesets
+        self.journal = journal
+        self.reverted_changesets = set()
+        self.skipped = 0
+
+    def append(self, obj):
+        osm_type = obj_to_str(obj)
+        if self.journal is not None and self.journal.is_completed(osm_type, obj.id):
+            self.skipped += 1
+            return
+        changesets = self.object_changesets.get((osm_type, obj.id), set())
+        self.reverted_changesets |= changesets
+        self.uploader.handle_object(obj, changesets)
+
+
+parser = argparse.ArgumentParser(description="Upload an osmChange file written by revert_tag_changes.py --osc-output")
+parser.add_argument("-a", "--automatic-conflict-solution", help="add conflicts_automatically_resolved=yes to all uploaded changesets", action="store_true", default=False)
+parser.add_argument("-c", "--config", help="path to configuration file if not located at ~/.machina_reparanda", default="~/.machina_reparanda")
+parser.add_argument("-l", "--log-level", help="log level (DEBUG, INFO, WARNING, ERROR, CRITICAL)", default="INFO", type=str)
+parser.add_argument("-S", "--no-comment-reverted", help="don't post a changeset comment to all reverted changesets (e.g. to avoid email spamming)", action="store_true", default=False)
+parser.add_argument("-m", "--comment", help="changeset comment, defaults to the comment given when the file was written", type=str, default=None)
+parser.add_argument("-n", "--changeset-size", help="maximum number of objects per changeset", type=int, default=9999)
+parser.add_argument("-u", "--upload-mode", help="upload every object with its own request (single) or many objects at once as osmChange (diff)", choices=["single", "diff"], default=None)
+parser.add_argument("--journal", help="path to a file where the progress of the upload is recorded", type=str, default=None)
+parser.add_argument("--resume", help="continue the interrupted upload recorded in the journal", action="store_true", default=False)
+parser.add_argument("osc_file", help="OSC file written by revert_tag_changes.py")
+args = parser.parse_args()
+
+numeric_log_level = getattr(logging, args.log_level.upper())
+if not isinstance(numeric_log_level, int):
+    raise ValueError("Invalid log level {}".format(args.log_level.upper()))
+logging.basicConfig(level=numeric_log_level)
+logging.getLogger("requests").setLevel(logging.WARNING)
+logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+with open(os.path.expanduser(args.config), "r") as config_file:
+    configuration = Configuration(json.load(config_file))
+
+comment, object_changesets = read_sidecar(args.osc_file)
+configuration.automatic_conflict_solution = args.automatic_conflict_solution
+configuration.comment = args.comment if args.comment is not None else comment
+if args.upload_mode is not None:
+    configuration.upload_mode = args.upload_mode
+if args.resume and args.journal is None:
+    sys.stderr.write("ERROR: --resume requires --journal.\n")
+    exit(1)
+if not args.resume and args.journal is not None and os.path.exists(args.journal) and os.path.getsize(args.journal) > 0:
+    sys.stderr.write("ERROR: Journal {} exists. Use --resume to continue the upload or remove the file.\n".format(args.journal))
+    exit(1)
+if configuration.comment == "":
+    sys.stderr.write("ERROR: No changeset comment given.\n")
+    exit(1)
+
+journal = None
+if args.journal is not None:
+    journal = Journal(args.journal, args.resume)
+session = HttpSession(configuration)
+uploader = OsmApiUploader(configuration, session, journal)
+uploader.max_object_count = args.changeset_size
+sink = UploadSink(uploader, object_changesets, journal)
+apply_osc(InputHandler(sink), args.osc_file)
+uploader.close_changeset()
+if sink.skipped > 0:
+    logging.info("Skipped {} objects uploaded in a previous run".format(sink.skipped))
+reverted_changesets = sink.reverted_changesets
+if journal is not None:
+    reverted_changesets |= journal.reverted_changesets()
+if not args.no_comment_reverted:
+    uploader.comment_reverted_changesets(reverted_changesets)
+if journal is not None:
+    journal.close()
+logging.info("HTTP connections: {}".format(session.statistics))